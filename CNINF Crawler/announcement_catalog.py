@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A partitioned Parquet catalog of the announcements downloaded by the crawler,
+so that the metadata of the whole universe is loaded in one read instead of
+concatenating the file_info of every fund.
+
+Records are buffered in memory and written as one file per partition when the
+buffer is full or flush() is called; a crawl of many funds therefore adds a
+few large files rather than one small file per fund. Layout under [root]:
+    filed_year=2021/part-xxxx.parquet
+    filed_year=2022/part-xxxx.parquet
+    ...
+
+An announcement may be written again by a later run(e.g. resumed or
+re-downloaded); load() keeps the latest record of each ann_id, and compact()
+rewrites the catalog the same way.
+
+Requires pyarrow(or fastparquet) for pandas' parquet support.
+
+CONTENTS
+--------
+- <CLASS> announcement_catalog
+
+'''
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+
+COLUMNS = ['ann_id', 'code', 'title', 'filed_date', 'url', 'file_path',
+           'report_type', 'year', 'quarter', 'info', 'crawled_at']
+PARTITION = 'filed_year'
+
+def _partitioning():
+    '''
+    Read the partition as a string with pyarrow, so that filters compare it
+    to strings(e.g. ('filed_year', '>=', '2020')) instead of an inferred int
+
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError:
+        return {}
+    return {'partitioning': ds.partitioning(pa.schema([(PARTITION, pa.string())]), flavor = 'hive')}
+
+class announcement_catalog:
+    def __init__(self, root: str, buffer_rows: int = 50000):
+        '''
+        Parameters
+        ----------
+        root: str
+            Root directory of the catalog; created if not exists
+        buffer_rows: int, default 50000
+            Num of records kept in memory before they are written
+
+        '''
+        self.root = root
+        self.buffer_rows = buffer_rows
+        os.makedirs(root, exist_ok = True)
+
+        self.buffer = []
+        self._lock = threading.Lock()
+
+    def add(self, records: list):
+        '''
+        Add records to the catalog; written when the buffer is full
+
+        Parameters
+        ----------
+        records: list
+            A list of dicts with the keys in COLUMNS(crawled_at optional)
+
+        '''
+        with self._lock:
+            now = time.time()
+            for record in records:
+                record.setdefault('crawled_at', now)
+            self.buffer += records
+            full = len(self.buffer) >= self.buffer_rows
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the records in the buffer
+
+        '''
+        with self._lock:
+            records, self.buffer = self.buffer, []
+            if len(records) == 0:
+                return
+
+            df = pd.DataFrame.from_records(records, columns = COLUMNS)
+            df[PARTITION] = df['filed_date'].str[:4]
+            df.to_parquet(self.root, partition_cols = [PARTITION], index = False)
+
+    def load(self, columns: list = None, filters: list = None):
+        '''
+        Read the catalog, keeping the latest record of each announcement
+
+        Parameters
+        ----------
+        columns: list, default None
+            Columns to read; all if None
+        filters: list, default None
+            Passed to pd.read_parquet, e.g [('filed_year', '>=', '2020')]
+
+        Returns
+        -------
+        output: pd.DataFrame
+
+        '''
+        if not any(name.startswith(PARTITION + '=') for name in os.listdir(self.root)):
+            return pd.DataFrame(columns = COLUMNS + [PARTITION])
+
+        # the sort and the de-duplication need these columns, dropped after if not asked for
+        read_columns = None
+        if columns is not None:
+            read_columns = list(dict.fromkeys(list(columns) + ['ann_id', 'crawled_at', 'code', 'filed_date']))
+        output = pd.read_parquet(self.root, columns = read_columns, filters = filters, **_partitioning())
+        # partition values are read back as categories
+        if PARTITION in output:
+            output[PARTITION] = output[PARTITION].astype(str)
+
+        output = output.sort_values('crawled_at').drop_duplicates('ann_id', keep = 'last')
+        output = output.sort_values(['code', 'filed_date']).reset_index(drop = True)
+        if columns is not None:
+            output = output[list(columns)]
+        return output
+
+    def compact(self):
+        '''
+        Rewrite the catalog as one file per partition, without duplicates
+
+        '''
+        self.flush()
+        with self._lock:
+            df = self.load()
+            if len(df) == 0:
+                return
+
+            temp_root = self.root.rstrip('/\\') + '.compact'
+            if os.path.exists(temp_root):
+                shutil.rmtree(temp_root)
+            df.to_parquet(temp_root, partition_cols = [PARTITION], index = False)
+
+            # swap the old partitions for the new ones
+            for name in os.listdir(self.root):
+                if name.startswith(PARTITION + '='):
+                    shutil.rmtree(os.path.join(self.root, name))
+            for name in os.listdir(temp_root):
+                shutil.move(os.path.join(temp_root, name), os.path.join(self.root, name))
+            shutil.rmtree(temp_root)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Throughput benchmark of the crawlers against the local mock server, so that
+concurrency and rate settings can be compared on any machine without network.
+
+For each scenario the benchmark reports:
+    - requests/s and MB/s seen by the server;
+    - funds/hour end to end;
+    - num of throttled and failed responses;
+    - time spent on the network and sleeping in the rate limiters, from the
+      metrics of the crawler.
+
+Scenarios:
+    - cninf-serial: crawl_single_fund + save_file in a loop
+    - cninf-async:  crawl_single_fund + save_file_async in a loop
+    - cninf-many:   crawl_many
+    - eastmoney:    download_single of the EastMoney crawler
+    - eastmoney-concurrent: download_concurrent of the EastMoney crawler
+
+Usage:
+    python benchmark_crawler.py --funds 20 --reports 40 --latency 0.05 --throttle-rps 50
+
+CONTENTS
+--------
+- <FUNC> run_cninf
+- <FUNC> run_eastmoney
+- <FUNC> run_scenario
+
+'''
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import time
+from mock_server import start_mock_server, mock_config
+from crawl_common.rate_limiter import aimd_limiter
+
+SCENARIOS = ['cninf-serial', 'cninf-async', 'cninf-many', 'eastmoney', 'eastmoney-concurrent']
+
+def make_limiters(args):
+    query_limiter = aimd_limiter(rate = args.rate, max_rate = args.max_rate, base_backoff = 0.5, name = 'query')
+    download_limiter = aimd_limiter(rate = args.rate, max_rate = args.max_rate, base_backoff = 0.5, name = 'download')
+    return query_limiter, download_limiter
+
+def run_cninf(mode: str, codes: list, base_url: str, workdir: str, args):
+    '''
+    Run the CNINF crawler in a given mode against the mock server
+
+    '''
+    from cninf_crawler import cninf_crawler
+    from cninf_orgid import orgid_cache
+    from cninf_session import session_pool
+
+    # the mock server derives the orgId from the code
+    cache_path = os.path.join(workdir, 'orgid.db')
+    cache = orgid_cache(cache_path)
+    for code in codes:
+        cache.put(code, 'code', {'code': code, 'name': code, 'orgId': f'jjjl{code}',
+                                 'type': 'fund', 'type_d': '基金'})
+    cache.close()
+
+    query_limiter, download_limiter = make_limiters(args)
+    crawler = cninf_crawler(cache_path, base_url + '/',
+                            session = session_pool(pool_maxsize = max(10, args.in_flight * args.workers)),
+                            query_limiter = query_limiter,
+                            download_limiter = download_limiter,
+                            base_url = base_url)
+    store_path = os.path.join(workdir, 'reports')
+
+    if mode == 'cninf-many':
+        crawler.crawl_many(codes, '2000-01-01', '2030-01-01', 'all', 'fund', store_path,
+                           list_workers = 1, download_workers = args.workers)
+        return crawler.metrics
+
+    for code in codes:
+        report_list = crawler.crawl_single_fund(code, '2000-01-01', '2030-01-01', 'all', 'fund')
+        if mode == 'cninf-serial':
+            crawler.save_file(code, report_list, store_path)
+        else:
+            crawler.save_file_async(code, report_list, store_path, max_in_flight = args.in_flight)
+    return crawler.metrics
+
+def run_eastmoney(mode: str, codes: list, base_url: str, workdir: str, args):
+    '''
+    Run download_single/download_concurrent of the EastMoney crawler against 
+    the mock server
+
+    '''
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'EastMoney Crawler', 'main.py')
+    spec = importlib.util.spec_from_file_location('eastmoney_main', main_path)
+    eastmoney = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(eastmoney)
+
+    eastmoney.API_BASE = base_url
+    eastmoney.NOTICE_BASE = base_url
+    eastmoney.PDF_BASE = base_url
+    eastmoney.LIMITER = aimd_limiter(rate = args.rate, max_rate = args.max_rate, base_backoff = 0.5, name = 'eastmoney')
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if mode == 'eastmoney':
+            eastmoney.download_single(codes)
+        else:
+            eastmoney.download_concurrent(codes, workers = args.workers, attachment_workers = args.in_flight * 2)
+    finally:
+        os.chdir(cwd)
+    return eastmoney.METRICS
+
+def run_scenario(scenario: str, args):
+    '''
+    Run a scenario on a fresh mock server and working directory
+
+    Returns
+    -------
+    output: dict
+        The measurements of the scenario
+
+    '''
+    config = mock_config(latency = args.latency,
+                         pdf_size = args.pdf_size * 1024,
+                         reports_per_fund = args.reports,
+                         throttle_rps = args.throttle_rps,
+                         error_rate = args.error_rate)
+    server, base_url = start_mock_server(config = config)
+    codes = [f'{i:06d}' for i in range(1, args.funds + 1)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        log = io.StringIO()
+        start = time.perf_counter()
+        with (contextlib.redirect_stdout(log) if args.quiet else contextlib.nullcontext()):
+            if scenario.startswith('eastmoney'):
+                metrics = run_eastmoney(scenario, codes, base_url, workdir, args)
+            else:
+                metrics = run_cninf(scenario, codes, base_url, workdir, args)
+        elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    stats = config.stats
+    snapshot = metrics.snapshot()
+    return {'scenario': scenario,
+            'elapsed_s': round(elapsed, 3),
+            'requests': stats['requests'],
+            'requests_per_s': round(stats['requests'] / elapsed, 2),
+            'mb_per_s': round(stats['bytes'] / elapsed / 1024**2, 3),
+            'funds_per_hour': round(len(codes) / elapsed * 3600, 1),
+            'throttled': stats['throttled'],
+            'errors': stats['errors'],
+            'network_s': snapshot['time_network'],
+            'sleeping_s': snapshot['time_sleeping']}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the crawlers against a local mock server')
+    parser.add_argument('--scenario', choices = SCENARIOS + ['all'], default = 'all')
+    parser.add_argument('--funds', type = int, default = 10)
+    parser.add_argument('--reports', type = int, default = 40, help = 'announcements per fund')
+    parser.add_argument('--pdf-size', type = int, default = 512, help = 'size of each pdf in KB')
+    parser.add_argument('--latency', type = float, default = 0.02, help = 'server latency in seconds')
+    parser.add_argument('--throttle-rps', type = float, default = None)
+    parser.add_argument('--error-rate', type = float, default = 0.0)
+    parser.add_argument('--rate', type = float, default = 50.0, help = 'initial rate of the limiters')
+    parser.add_argument('--max-rate', type = float, default = 500.0)
+    parser.add_argument('--in-flight', type = int, default = 4, help = 'max_in_flight of save_file_async')
+    parser.add_argument('--workers', type = int, default = 4, help = 'download workers of crawl_many')
+    parser.add_argument('--out', default = None, help = 'save the results to a json file')
+    parser.add_argument('--verbose', dest = 'quiet', action = 'store_false', help = 'show the crawler logs')
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS if args.scenario == 'all' else [args.scenario]
+    results = []
+    for scenario in scenarios:
+        result = run_scenario(scenario, args)
+        results.append(result)
+        print(' | '.join(f'{key}: {value}' for key, value in result.items()))
+
+    if args.out is not None:
+        with open(args.out, 'w', encoding = 'utf-8') as f:
+            json.dump(results, f, indent = 2)
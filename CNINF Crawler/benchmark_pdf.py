@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Side-by-side benchmark of the pdf backends(see pdf_backends) on a sample of
+our reports, to choose the backend of pdf2txt on a machine.
+
+For each backend the benchmark reports:
+    - pages/s and files/s, over the files it could read;
+    - peak RSS of the process running it, in MB;
+    - num of files it failed on;
+    - agreement of its text with the reference backend: the share of
+      character bigrams the two texts have in common(whitespace ignored),
+      averaged over the files, 1.0 meaning the same characters in the same
+      local order.
+
+Each backend runs in a fresh process, so that the peak RSS of one does not
+carry over to the next. Peak RSS is read from the resource module on
+Linux/macOS, or from psutil if installed(e.g. on Windows); None otherwise.
+
+Usage:
+    python benchmark_pdf.py --pdf-dir F:/eastmoney/CNINF --sample 200 --reference pypdf2
+
+CONTENTS
+--------
+- <FUNC> sample_files
+- <FUNC> peak_rss_mb
+- <FUNC> run_backend
+- <FUNC> agreement
+- <FUNC> run_benchmark
+
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from pdf_backends import BACKENDS, available_backends, get_backend
+
+def sample_files(pdf_dir: str, n: int, seed: int = 0):
+    '''
+    Draw [n] pdf files at random from [pdf_dir] and its sub-folders
+
+    '''
+    files = []
+    for root, _, names in os.walk(pdf_dir):
+        files += [os.path.join(root, name) for name in names if name.lower().endswith('.pdf')]
+    files.sort()
+    random.Random(seed).shuffle(files)
+    return files[:n]
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of this process in MB; None if unknown
+
+    '''
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB elsewhere
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024**2
+    except ImportError:
+        return None
+
+def run_backend(name: str, files: list):
+    '''
+    Extract the text of [files] with a backend; run in a fresh process
+
+    Returns
+    -------
+    output: dict
+        pages, seconds, failed, peak_rss_mb and texts(None for a failed file)
+
+    '''
+    backend = get_backend(name)
+    pages, seconds, failed, texts = 0, 0.0, 0, []
+    for file_path in files:
+        start = time.perf_counter()
+        try:
+            text = backend.extract_pages(file_path)
+        except Exception:
+            failed += 1
+            texts.append(None)
+            continue
+        seconds += time.perf_counter() - start
+        pages += len(text)
+        texts.append(''.join(text))
+
+    return {'pages': pages, 'seconds': seconds, 'failed': failed,
+            'peak_rss_mb': peak_rss_mb(), 'texts': texts}
+
+def _bigrams(text: str):
+    text = re.sub(r'\s+', '', text)
+    return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+def agreement(text: str, reference: str):
+    '''
+    Share of character bigrams two texts have in common, whitespace ignored
+
+    Returns
+    -------
+    float
+        2 * common / (total of both), between 0 and 1; 1.0 if both are empty
+
+    '''
+    a, b = _bigrams(text), _bigrams(reference)
+    total = sum(a.values()) + sum(b.values())
+    if total == 0:
+        return 1.0
+    return 2 * sum((a & b).values()) / total
+
+def run_benchmark(files: list, backends: list, reference: str):
+    '''
+    Run each backend on [files] in a fresh process and compare the outputs
+
+    Returns
+    -------
+    results: list
+        One dict of measurements per backend
+
+    '''
+    context = multiprocessing.get_context('spawn')
+    outputs = {}
+    for name in backends:
+        with context.Pool(1) as pool:
+            outputs[name] = pool.apply(run_backend, (name, files))
+
+    results = []
+    for name in backends:
+        output = outputs[name]
+        scores = []
+        if reference in outputs:
+            for text, ref_text in zip(output['texts'], outputs[reference]['texts']):
+                if text is not None and ref_text is not None:
+                    scores.append(agreement(text, ref_text))
+        n_read = len(files) - output['failed']
+        results.append({'backend': name,
+                        'version': get_backend(name).version(),
+                        'files': n_read,
+                        'failed': output['failed'],
+                        'pages': output['pages'],
+                        'seconds': round(output['seconds'], 3),
+                        'pages_per_s': round(output['pages'] / output['seconds'], 2) if output['seconds'] > 0 else None,
+                        'files_per_s': round(n_read / output['seconds'], 2) if output['seconds'] > 0 else None,
+                        'peak_rss_mb': round(output['peak_rss_mb'], 1) if output['peak_rss_mb'] is not None else None,
+                        f'agreement_{reference}': round(sum(scores) / len(scores), 4) if len(scores) > 0 else None})
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the pdf backends on a sample of reports')
+    parser.add_argument('--pdf-dir', required = True, help = 'folder of the reports, searched recursively')
+    parser.add_argument('--sample', type = int, default = 100, help = 'num of files drawn at random')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--backends', nargs = '+', choices = list(BACKENDS), default = None,
+                        help = 'backends to compare; all those installed if not given')
+    parser.add_argument('--reference', choices = list(BACKENDS), default = 'pypdf2',
+                        help = 'backend the others are compared to')
+    parser.add_argument('--out', default = None, help = 'save the results to a json file')
+    args = parser.parse_args()
+
+    backends = args.backends if args.backends is not None else available_backends()
+    missing = [name for name in backends if not BACKENDS[name].available()]
+    if len(missing) > 0:
+        parser.error(f'not installed: {missing}')
+    if args.reference not in backends and BACKENDS[args.reference].available():
+        backends.append(args.reference)
+
+    files = sample_files(args.pdf_dir, args.sample, args.seed)
+    print(f'{len(files)} file(s), backends: {backends}')
+    results = run_benchmark(files, backends, args.reference)
+    for result in results:
+        print(' | '.join(f'{key}: {value}' for key, value in result.items()))
+
+    if args.out is not None:
+        with open(args.out, 'w', encoding = 'utf-8') as f:
+            json.dump(results, f, indent = 2)
@@ -8,13 +8,26 @@ WorkFlow:
     i. prepare the code2orgid dict file;
     ii. for a single fund, use crawl_single_fund to get the report info you need;
         alternatively, use it in a loop;
-    iii. use save_file to download the file(s) you just got; for a list of fund report info, use it in a loop
+    iii. use save_file to download the file(s) you just got; for a list of fund report info, use it in a loop;
+        save_file_async downloads the files of a fund concurrently
+    iv. alternatively, use crawl_many to do ii and iii for a list of funds, with
+        listing and downloading pipelined
+    v. to crawl from several hosts, add the codes to a work_queue on a shared
+        file system and run crawl_from_queue on each host(see crawl_node.py)
+    vi. optionally, give text_path when initialising the crawler to convert pdf
+        files to txt while downloading them, with or without keeping the pdf
+    vii. optionally, give catalog_path to append the metadata of the files saved
+        to a partitioned Parquet catalog, loaded later with announcement_catalog.load
+    viii. use export_metrics to save the latencies, bytes, throttles and queue 
+        depths of the crawl as json and/or a Prometheus textfile
+    ix. close the crawler when done(or use it in a with statement), to shut down
+        the converter workers and flush the catalog
 
 CONTENTS
 --------
 - <FUNC> unix2date
 - <FUNC> find_info_in_title
-- <FUNC> num_cn2eng
+- <FUNC> num_cn2eng(re-exported from report_titles)
 - <CLASS> cninf_crawler
 
 OTHER INFO.
@@ -26,14 +39,33 @@ OTHER INFO.
     - WeChat: L13079237
     
 '''
-import requests
 import random
-import time
 import pandas as pd
 import os
+import shutil
 import datetime
-import re
-from cninf_orgid import find_info
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from cninf_orgid import find_info, orgid_cache
+from cninf_session import session_pool
+from crawl_common.rate_limiter import aimd_limiter, is_throttled
+from crawl_common.crawl_manifest import crawl_manifest
+from crawl_common.atomic_download import stream_download, download_bytes, write_atomic, revalidate, DownloadError
+from crawl_common.report_store import report_store
+from report_titles import num_cn2eng, classify_title, classify_titles, format_info
+from crawl_common.crawl_metrics import crawl_metrics
+from pdf2txt import text_converter, conversion_signature
+from conversion_manifest import conversion_manifest
+from announcement_catalog import announcement_catalog
+from work_queue import work_queue
+from retry_policy import retry_policy, circuit_breaker, RetryableError
+
+__all__ = ['unix2date', 'find_info_in_title', 'num_cn2eng', 'cninf_crawler']
 
 def unix2date(unix_time):
     '''
@@ -77,78 +109,125 @@ def find_info_in_title(title:str):
     Returns
     -------
     A str in the format described above
-        
-    '''
     
-    year_detector = re.compile(r'[0-9,一,二,三,四,五,六,七,八,九,零]{4}年')
-    quarter_detector = re.compile(r'[1-4,一,二,三,四]季')
-    annual_detector = re.compile(r'年[度,报]')
-    mid_detector = re.compile(r'(半年|中期)')
-    
-    year = re.findall(year_detector, title)
-    quarter = re.findall(quarter_detector, title)
-    annual = re.findall(annual_detector, title)
-    mid = re.findall(mid_detector, title)
-    
-    if len(year) > 0:
-        year = num_cn2eng(year[0][:-1])
-    else: year = ''
-        
-    if len(quarter) > 0:
-        quarter = num_cn2eng(quarter[0][0])
-        report_type = 'Q'
-    elif len(mid) > 0:
-        quarter = 5
-        report_type  = 'H'     
-    elif len(annual) > 0:
-        report_type = 'A'
-        quarter = 6
-    else:
-        report_type = ''
-        quarter = ''
-    
-    return '-'.join([report_type, str(year), str(quarter)])
-
-def num_cn2eng(date:str):
-    '''
-    A func to convert Chinese num to Arab num, e.g '二〇一二' -> 2012
-    
-    Parameters
-    ----------
-    date: str
-        A str of Chinese num 
-        
-    Returns
-    -------
-    output: str
-        A str of Arab num
+    The title is parsed by report_titles.classify_title, which compiles the
+    patterns once and memoizes the result of each title.
         
     '''
-    cn2eng_date_dict = {'一':1,
-                        '二':2,
-                        '三':3,
-                        '四':4,
-                        '五':5,
-                        '六':6,
-                        '七':7,
-                        '八':8,
-                        '九':9,
-                        '零':0,
-                        '〇':0}
-    output = ''
-    for num in date:
-        if num in cn2eng_date_dict.keys():
-            num = cn2eng_date_dict[num]
-        
-        output += str(num)
-    return output    
+    return format_info(*classify_title(title))
 
-    
 class cninf_crawler:
     def __init__(self,
                  code2orgid_dict_path: str,
-                 target_weblink: str):
+                 target_weblink: str,
+                 session = None,
+                 query_limiter = None,
+                 download_limiter = None,
+                 manifest_path: str = None,
+                 store_root: str = None,
+                 base_url: str = 'http://www.cninfo.com.cn',
+                 metrics = None,
+                 text_path: str = None,
+                 keep_pdf: bool = True,
+                 convert_workers: int = 2,
+                 catalog_path: str = None,
+                 retry = None,
+                 pdf_backend: str = 'auto'):
+        '''
+        Parameters
+        ----------
+        code2orgid_dict_path: str
+            Path to the code-orgId dict file; either the .xlsx file or an 
+            orgid_cache(.db), which loads much faster
+        target_weblink: str
+            Host where the reports are saved, e.g 'http://static.cninfo.com.cn/'
+        session: session_pool, default None
+            Shared keep-alive session layer; a new session_pool is created if
+            not given, so that connections are reused within this crawler
+        query_limiter: aimd_limiter, default None
+            Rate limiter for the announcement queries; starts at 1 page/s
+        download_limiter: aimd_limiter, default None
+            Rate limiter for the file downloads; starts at 1 file per 8s
+        manifest_path: str, default None
+            Path to a SQLite crawl manifest; if given, downloads are recorded 
+            in it and announcements already done are skipped on later runs
+        store_root: str, default None
+            Root of a content-addressed report_store; if given, each file is 
+            downloaded and stored once and hard-linked under store_path/code/
+        base_url: str, default 'http://www.cninfo.com.cn'
+            Host of the query and search api
+        metrics: crawl_metrics, default None
+            Where the latencies, bytes, throttles, sleeping time and queue 
+            depths of this crawler are recorded; created if not given. Export
+            them with export_metrics
+        text_path: str, default None
+            If given, pdf files are converted to txt while downloading(fused 
+            mode): each pdf is downloaded into memory and handed to a pool of
+            conversion workers, which save text_path/code/[title]_[date].txt,
+            the same layout as My_pdf2txt. If keep_pdf, each txt is recorded
+            with its page offsets in text_path/.conversions.db, the
+            conversion_manifest of My_pdf2txt
+        keep_pdf: bool, default True
+            Whether to save the pdf as well in fused mode; if False, a fresh 
+            crawl writes the txt only, and the txt takes the place of the pdf
+            in the manifest and file_info
+        convert_workers: int, default 2
+            Num of conversion worker processes in fused mode
+        catalog_path: str, default None
+            Root of a partitioned Parquet announcement_catalog; if given, the
+            metadata of the files saved is appended to it(see flush_catalog)
+        retry: retry_policy, default None
+            Retry policy of the queries and orgId searches; by default 5 tries
+            with jittered backoff and a circuit breaker shared by all the 
+            workers of this crawler
+        pdf_backend: str, default 'auto'
+            Text extractor of the fused mode(see pdf_backends); the fastest
+            one installed if 'auto'
+
+        '''
         self.target_weblink = target_weblink
+        self.base_url = base_url
+        self.metrics = metrics if metrics is not None else crawl_metrics()
+        # a session given by the caller is left open by close()
+        self._owns_session = session is None
+        self.session = session if session is not None else session_pool()
+        self.metrics.instrument(self.session)
+        
+        ''' adaptive rate limiters replacing the fixed sleeps '''
+        if query_limiter is None:
+            query_limiter = aimd_limiter(rate = 1.0, name = 'query')
+        if download_limiter is None:
+            download_limiter = aimd_limiter(rate = 1/8, increase = 0.01, name = 'download')
+        self.query_limiter = query_limiter
+        self.download_limiter = download_limiter
+        self.metrics.watch_limiter(query_limiter)
+        self.metrics.watch_limiter(download_limiter)
+        
+        ''' retries with backoff and a circuit breaker '''
+        if retry is None:
+            retry = retry_policy(breaker = circuit_breaker(name = 'query circuit'), name = 'query')
+        self.retry = retry
+        self.metrics.watch_retry(retry)
+        
+        ''' resumable crawl manifest '''
+        self.manifest = crawl_manifest(manifest_path) if manifest_path is not None else None
+        
+        ''' content-addressed store deduplicating identical reports '''
+        self.store = report_store(store_root) if store_root is not None else None
+        
+        ''' fused download-to-text mode '''
+        self.text_path = text_path
+        self.keep_pdf = keep_pdf
+        self.converter = text_converter(convert_workers, pdf_backend) if text_path is not None else None
+        # the manifest keys each txt on its pdf, so there is nothing to record without the pdf
+        self.conversions = None
+        if text_path is not None and keep_pdf:
+            os.makedirs(text_path, exist_ok = True)
+            self.conversions = conversion_manifest(f'{text_path}/.conversions.db')
+            self.signature = conversion_signature(self.converter.backend)
+        
+        ''' parquet catalog of the announcements saved '''
+        self.catalog = announcement_catalog(catalog_path) if catalog_path is not None else None
         
         ''' header-specification '''
         # a list of user_agents to be chosen randomly when posting
@@ -179,8 +258,11 @@ class cninf_crawler:
                        }
         
         ''' initialise code-orgId dict '''
-        raw_dict = pd.read_excel(code2orgid_dict_path)
-        self.code2orgid_dict = dict([(raw_dict.loc[idx,'code'], raw_dict.loc[idx,'post']) for idx in raw_dict.index])
+        if code2orgid_dict_path.endswith(('.xlsx', '.xls')):
+            raw_dict = pd.read_excel(code2orgid_dict_path)
+            self.code2orgid_dict = dict(zip(raw_dict['code'], raw_dict['post']))
+        else:
+            self.code2orgid_dict = orgid_cache(code2orgid_dict_path).code2post('fund')
         
         ''' report-type dicts for fund and stock '''
         fund_type_dict = {'all':'category_ndbg_jjgg;category_bndbg_jjgg;category_jdbg_jjgg',
@@ -229,10 +311,12 @@ class cninf_crawler:
                 - type_d: detail type
 
         '''
-        output = find_info(random.choice(self.user_agents), 
-                           key, 
-                           type_, 
-                           mode)
+        output = self.retry.call(lambda: find_info(random.choice(self.user_agents), 
+                                                   key, 
+                                                   type_, 
+                                                   mode,
+                                                   session = self.session,
+                                                   base_url = self.base_url))
         
         if verbose:
             print('Found')
@@ -247,11 +331,19 @@ class cninf_crawler:
                           end:str,
                           report_type:str,
                           type_: str,
-                          verbose = False):
+                          verbose = False,
+                          incremental = False,
+                          page_workers: int = 4,
+                          window_days: int = None):
         '''
         A method to get the list of all reports of a given fund between 
         [start] and [end]
         
+        The first page tells the total num of records, so the remaining pages
+        are then fetched concurrently(still paced by the query limiter). Long
+        periods may be split into sub-windows which are paged in parallel, and
+        the results are merged and deduplicated by announcementId.
+        
         Parameters
         ----------
         code: str
@@ -270,6 +362,22 @@ class cninf_crawler:
             Fund or stock to be crawled. Should be one of the following:
                 - 'fund';
                 - 'stock'
+        verbose: bool, default False
+            Whether to print the titles of the reports found
+        incremental: bool, default False
+            Only list the reports filed after the latest announcementTime seen
+            for this code and report type in previous crawls(the watermark, 
+            kept in the manifest). The query starts from the date of the 
+            watermark and announcements not later than it are dropped. 
+            The watermark is moved by save_file/save_file_async once the 
+            reports are downloaded(see advance_watermark), so a report whose
+            download failed is listed again next time.
+            Requires manifest_path when initialising the crawler.
+        page_workers: int, default 4
+            Num of pages fetched at the same time; 1 to page one after another
+        window_days: int, default None
+            Split [start]~[end] into sub-windows of this many days if it is
+            longer; useful for stock crawls over long periods. At least 1
                 
         Returns
         -------
@@ -277,19 +385,27 @@ class cninf_crawler:
             A list of all reports satisfying the requirements above
             
         '''
-        query_path = 'http://www.cninfo.com.cn/new/hisAnnouncement/query'
-        headers = self.headers
+        query_path = self.base_url + '/new/hisAnnouncement/query'
+        # copy the headers so that funds can be crawled in parallel threads
+        headers = dict(self.headers)
         headers['User-Agent'] = random.choice(self.user_agents)
         
         type_dict = self.report_type_dicts[type_]
         type_flag = type_dict[report_type]
+        
+        watermark = None
+        if incremental:
+            if self.manifest is None:
+                raise ValueError('Incremental mode requires manifest_path when initialising the crawler')
+            watermark = self.manifest.get_watermark(code, type_flag)
+            if watermark is not None:
+                start = max(start, unix2date(watermark))
             
-        period = start+'~'+end
+        periods = self._split_period(start, end, window_days)
         
         print(f'Start crawling {code}...')
         print(f'Requirements:\n -Time:{start}\n      ~{end}\n -Report type: {report_type}\n')
         
-        page_num = 1
         if type_ == 'fund':
             try:
                 stock = self.code2orgid_dict[code]
@@ -301,7 +417,7 @@ class cninf_crawler:
             stock = code
             column = 'szse'
         
-        query = {'pageNum': page_num,
+        query = {'pageNum': 1,
                  'pageSize': 30,
                  'tabName': 'fulltext',
                  'column': column,  
@@ -311,34 +427,21 @@ class cninf_crawler:
                  'plate': '',   
                  'category': type_flag,
                  'trade': '',
-                 'seDate': period 
+                 'seDate': ''
                  }
+        
+        announcements = self.fetch_pages(query_path, headers, query, periods, page_workers, watermark)
+        report_list, _ = self._cut_at_watermark(announcements, watermark)
 
-        # get the first page first
-        namelist = requests.post(query_path, headers=headers, data=query)
-        report_list = namelist.json()['announcements']
-        print(f'Page {page_num} completed')
-        
-        # check if there are more pages, if True, continue the crawling
-        while namelist.json()['hasMore']:
-            time.sleep(1)
-            
-            # update page numbre
-            page_num += 1
-            query['pageNum'] = page_num
-            
-            # reset user-agent
-            headers['User-Agent'] = random.choice(self.user_agents) 
-            
-            # get report list in the next page
-            namelist = requests.post(query_path, headers=headers, data=query)
-            report_list += namelist.json()['announcements']
-            
-            print(f'Page {page_num} completed')
-
-        print('All pages completed')
+        print(f'All pages completed ({self.query_limiter})')
         print('-'*25)
         
+        if incremental:
+            print(f'{len(report_list)} new report(s) since the last crawl')
+            # the watermark to move once downloaded
+            for record in report_list:
+                record['watermark_category'] = type_flag
+        
         if verbose:
             print('Reports found:\n')
             for record in report_list:
@@ -346,10 +449,177 @@ class cninf_crawler:
             print('-' * 35)
         return report_list
         
+    @staticmethod
+    def _split_period(start: str, end: str, window_days: int = None):
+        '''
+        Split [start]~[end] into consecutive sub-windows of at most 
+        [window_days] days; ValueError if [window_days] < 1
+        
+        Returns
+        -------
+        output: list
+            A list of seDate strs in the format 'YYYY-MM-DD~YYYY-MM-DD'
+        
+        '''
+        if window_days is None:
+            return [start+'~'+end]
+        if window_days < 1:
+            raise ValueError(f'window_days must be at least 1, got {window_days}')
+        
+        window_start = datetime.datetime.strptime(start, '%Y-%m-%d')
+        period_end = datetime.datetime.strptime(end, '%Y-%m-%d')
+        output = []
+        while True:
+            window_end = min(window_start + datetime.timedelta(days = window_days - 1), period_end)
+            output.append(window_start.strftime('%Y-%m-%d') + '~' + window_end.strftime('%Y-%m-%d'))
+            if window_end >= period_end: break
+            window_start = window_end + datetime.timedelta(days = 1)
+        
+        return output
+    
+    def fetch_pages(self, 
+                    query_path: str, 
+                    headers: dict, 
+                    query: dict, 
+                    periods: list, 
+                    page_workers: int = 4, 
+                    watermark: int = None):
+        '''
+        Fetch all pages of a query over a list of periods. The first page of
+        each period is fetched first to read the total num of records, then 
+        all the remaining pages are fetched concurrently.
+        
+        Announcements come latest first, so in incremental mode the pages of
+        a period after one reaching the watermark hold known announcements 
+        only and are not fetched.
+        
+        Parameters
+        ----------
+        query_path: str
+            Url of the query api
+        headers: dict
+            Headers of the query; each page gets its own copy and user-agent
+        query: dict
+            The query, whose pageNum and seDate are filled in for each page
+        periods: list
+            seDate strs, e.g the output of _split_period
+        page_workers: int, default 4
+            Num of pages fetched at the same time
+        watermark: int, default None
+            The watermark of an incremental crawl(13-digit unix timestamp)
+        
+        Returns
+        -------
+        output: list
+            Announcements of all periods, latest first and deduplicated by 
+            announcementId
+        
+        '''
+        page_size = query['pageSize']
+        
+        def fetch(period, page_num):
+            page_query = dict(query, pageNum = page_num, seDate = period)
+            page_headers = dict(headers, **{'User-Agent': random.choice(self.user_agents)})
+            namelist = self.post_query(query_path, page_headers, page_query)
+            print(f'Page {page_num} of {period} completed')
+            return namelist
+        
+        pages = []
+        with ThreadPoolExecutor(max_workers = max(1, page_workers)) as executor:
+            first_pages = list(executor.map(fetch, periods, [1] * len(periods)))
+            
+            rest = []
+            for period, namelist in zip(periods, first_pages):
+                pages.append(namelist['announcements'])
+                if self._cut_at_watermark(namelist['announcements'], watermark)[1]:
+                    # the rest of the period is known
+                    continue
+                total = namelist.get('totalAnnouncement')
+                if total is None:
+                    # no total in the response: fall back to paging one by one
+                    page_num = 1
+                    while namelist['hasMore']:
+                        page_num += 1
+                        namelist = fetch(period, page_num)
+                        pages.append(namelist['announcements'])
+                        if self._cut_at_watermark(namelist['announcements'], watermark)[1]: break
+                    continue
+                n_pages = -(-int(total) // page_size)
+                rest += [(period, page_num) for page_num in range(2, n_pages + 1)]
+            
+            futures = [executor.submit(fetch, period, page_num) for period, page_num in rest]
+            pages += [future.result()['announcements'] for future in futures]
+        
+        # records may shift between pages while paging, and windows may share
+        # the boundary day, so deduplicate by announcementId
+        output = {}
+        for page in pages:
+            # the server returns None instead of an empty list if nothing is found
+            for record in (page if page is not None else []):
+                output.setdefault(record['announcementId'], record)
+        
+        return sorted(output.values(), key = lambda record: record['announcementTime'], reverse = True)
+    
+    @staticmethod
+    def _cut_at_watermark(announcements, watermark):
+        '''
+        Drop the announcements not later than the watermark
+        
+        Returns
+        -------
+        output: list
+            Announcements later than the watermark
+        reach_known: bool
+            Whether any known announcement is found
+        
+        '''
+        # the server returns None instead of an empty list if nothing is found
+        announcements = announcements if announcements is not None else []
+        if watermark is None:
+            return announcements, False
+        
+        output = [record for record in announcements if record['announcementTime'] > watermark]
+        return output, len(output) < len(announcements)
+    
+    def post_query(self, query_path: str, headers: dict, query: dict, max_tries: int = None):
+        '''
+        Post a query under the query rate limiter and the retry policy. 
+        Throttled responses(403/429/5xx or a body that is not json) make the 
+        limiter back off; they and network errors are retried with jittered
+        backoff, at most [max_tries] times(default: that of the policy), and
+        pause all the workers of the crawler if the circuit breaker opens
+        
+        Returns
+        -------
+        output: dict
+            The json content of the response
+        
+        '''
+        def attempt():
+            self.query_limiter.acquire()
+            r = self.session.post(query_path, headers=headers, data=query)
+            if not is_throttled(r.status_code):
+                try:
+                    output = r.json()
+                    self.query_limiter.on_success()
+                    return output
+                except ValueError: pass
+            self.metrics.count('query_retry', endpoint = 'query')
+            self.query_limiter.on_throttle()
+            raise RetryableError(f'Query throttled(status {r.status_code}): {query_path}')
+        
+        try:
+            return self.retry.call(attempt, max_tries = max_tries)
+        except Exception:
+            self.metrics.count('query_failed', endpoint = 'query')
+            raise
+    
     def save_file(self,
                   code: str,
                   report_list: list,
-                  store_path: str):
+                  store_path: str,
+                  revalidate = False,
+                  return_failed = False):
         
         '''
         A method to download files in report_list to local directory
@@ -362,17 +632,418 @@ class cninf_crawler:
             A list generated by crawl_single_fund
         store_path: str
             The directory where the downloaded files will be saved
+        revalidate: bool, default False
+            Probe the files already done with a conditional HEAD request and
+            download again only those changed upstream; requires a manifest
+        return_failed: bool, default False
+            Also return the num of files failed
         
         Returns
         -------
         file_info: pd.DataFrame
             A df saving the info about the file downloaded, including code, filed dates, and paths
+        n_failed: int
+            Num of files failed to download(or convert); only if return_failed
         
         '''
         print(f'Start downloading reports for {code}...')
-        store_path = store_path
-        target_weblink = self.target_weblink
+        headers = self.download_headers()
+        
+        tasks, resumed = self.init_download_tasks(code, report_list, store_path, revalidate)
+        
+        # collect the tasks done and build the df once at the end
+        done_tasks = list(resumed)
+        n_failed = 0
+        for task in tasks:
+            headers['User-Agent'] = random.choice(self.user_agents)
+            if not self.download_task(task, headers):
+                n_failed += 1
+                continue
+            
+            done_tasks.append(task)
+            print(f'{len(done_tasks)}/{len(report_list)} done ({self.download_limiter})')
+        
+        file_info = self.build_file_info(done_tasks)
+        self.advance_watermark(code, report_list)
+
+        print('Saving procedure completed')
+        print(f'Resumed {len(resumed)} file(s) from the manifest')
+        print(f'Skipped {len(report_list)-len(file_info)} file(s)')
+        print('-'*35)
+        if return_failed:
+            return file_info, n_failed
+        return file_info
+    
+    def save_file_async(self,
+                        code: str,
+                        report_list: list,
+                        store_path: str,
+                        max_in_flight: int = 4,
+                        revalidate = False,
+                        return_failed = False):
+        '''
+        Async version of save_file. Files are downloaded concurrently, with at
+        most [max_in_flight] requests in flight for each host(static.cninfo.com.cn
+        in most cases). The same skip rules as save_file are applied. It may
+        be called from a running event loop(e.g. a notebook), though it 
+        blocks until the downloads are done.
+        
+        Parameters
+        ----------
+        code: str
+            Code of the fund
+        report_list: list
+            A list generated by crawl_single_fund
+        store_path: str
+            The directory where the downloaded files will be saved
+        max_in_flight: int, default 4
+            Max num of concurrent requests sent to a single host
+        revalidate: bool, default False
+            See save_file
+        return_failed: bool, default False
+            See save_file
+        
+        Returns
+        -------
+        file_info: pd.DataFrame
+            A df saving the info about the file downloaded, including code, filed dates, and paths
+        n_failed: int
+            Num of files failed; only if return_failed
+        
+        '''
+        print(f'Start downloading reports for {code} (async, {max_in_flight} per host)...')
+        tasks, resumed = self.init_download_tasks(code, report_list, store_path, revalidate, 
+                                                  probe_workers = max_in_flight)
+        
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            results = asyncio.run(self._download_all(tasks, max_in_flight))
+        else:
+            # asyncio.run cannot be nested in the loop already running, e.g 
+            # in Jupyter, IPython or Spyder; run a new loop on a thread
+            with ThreadPoolExecutor(max_workers = 1) as executor:
+                results = executor.submit(asyncio.run, self._download_all(tasks, max_in_flight)).result()
+        
+        done_tasks = resumed + [task for task, suc in zip(tasks, results) if suc]
+        file_info = self.build_file_info(done_tasks)
+        self.advance_watermark(code, report_list)
+        
+        print('Saving procedure completed')
+        print(f'Resumed {len(resumed)} file(s) from the manifest')
+        print(f'Skipped {len(report_list)-len(file_info)} file(s)')
+        print('-'*35)
+        if return_failed:
+            return file_info, results.count(False)
+        return file_info
+    
+    def advance_watermark(self, code: str, report_list: list):
+        '''
+        Move the watermark of an incremental crawl(see crawl_single_fund) 
+        past the reports downloaded. It stops below the earliest report not 
+        done under [code] in the manifest(failed or pending), so that the 
+        report is listed again by the next incremental crawl; reports 
+        skipped by init_download_task count as done. An announcement shared
+        with another code counts as done only once saved under this code.
+        
+        Parameters
+        ----------
+        code: str
+            Code of the fund
+        report_list: list
+            A list generated by crawl_single_fund with incremental = True; 
+            nothing is done for other lists
+        
+        '''
+        records = [record for record in report_list if 'watermark_category' in record]
+        if self.manifest is None or len(records) == 0:
+            return
+        
+        done_ids = self.manifest.done_ids(code)
+        categories = {}
+        for record in records:
+            task = self.init_download_task(code, record, '')
+            done = task is None or task['ann_id'] in done_ids
+            categories.setdefault(record['watermark_category'], []).append((record['announcementTime'], done))
+        
+        for category, times in categories.items():
+            not_done = [time for time, done in times if not done]
+            cap = min(not_done) if len(not_done) > 0 else None
+            done_times = [time for time, done in times if cap is None or time < cap]
+            if len(done_times) > 0:
+                self.manifest.set_watermark(code, category, max(done_times))
+    
+    def build_file_info(self, tasks: list):
+        '''
+        Build the file_info of the tasks done in one go, with the titles 
+        classified as a batch; the tasks are also added to the catalog, if 
+        any
+        
+        Returns
+        -------
+        file_info: pd.DataFrame
+            A df with columns code, filed_date, file_path and info
+        
+        '''
+        title_info = classify_titles([task['title'] for task in tasks])
+        file_info = pd.DataFrame({'code': [task['code'] for task in tasks],
+                                  'filed_date': [task['filed_date'] for task in tasks],
+                                  'file_path': [task['file_path'] for task in tasks],
+                                  'info': title_info['info']},
+                                 columns = ['code', 'filed_date', 'file_path', 'info'])
+        
+        if self.catalog is not None and len(tasks) > 0:
+            records = [{'ann_id': task['ann_id'],
+                        'code': task['code'],
+                        'title': task['title'],
+                        'filed_date': task['filed_date'],
+                        'url': task['url'],
+                        'file_path': task['file_path'],
+                        'report_type': title_info['report_type'][i],
+                        'year': title_info['year'][i],
+                        'quarter': title_info['quarter'][i],
+                        'info': title_info['info'][i]} for i, task in enumerate(tasks)]
+            self.catalog.add(records)
+        
+        return file_info
+    
+    def flush_catalog(self):
+        '''
+        Write the records buffered in the catalog; call it after a loop of 
+        save_file/save_file_async(crawl_many does it itself)
+        
+        '''
+        if self.catalog is not None:
+            self.catalog.flush()
+    
+    async def _download_all(self, tasks: list, max_in_flight: int):
+        '''
+        Run the download tasks concurrently; a semaphore is kept for each host
+        so that no host receives more than [max_in_flight] requests at a time.
+        Blocking requests calls are handed over to a thread pool; set the 
+        per-host limit of the session_pool to at least [max_in_flight] so that
+        every request in flight gets a keep-alive connection.
+        
+        Returns a list of bools recording whether each task succeeded.
+        
+        '''
+        loop = asyncio.get_running_loop()
+        host_semaphores = {}
+        done = [0]
+        
+        async def download_one(task):
+            host = urlparse(task['url']).netloc
+            if host not in host_semaphores:
+                host_semaphores[host] = asyncio.Semaphore(max_in_flight)
+            
+            async with host_semaphores[host]:
+                self.metrics.add_queue('download_waiting', -1)
+                self.metrics.add_queue('download_in_flight', 1)
+                headers = self.download_headers()
+                headers['Host'] = host
+                suc = await loop.run_in_executor(executor, self.download_task, task, headers)
+                self.metrics.add_queue('download_in_flight', -1)
+            
+            if not suc: return False
+            done[0] += 1
+            print(f'{done[0]}/{len(tasks)} done ({self.download_limiter})')
+            return True
+        
+        max_workers = max_in_flight * max(1, len(set(urlparse(task['url']).netloc for task in tasks)))
+        self.metrics.add_queue('download_waiting', len(tasks))
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            results = await asyncio.gather(*[download_one(task) for task in tasks])
+        return results
+    
+    def download_task(self, task: dict, headers: dict):
+        '''
+        Download a single task under the download rate limiter. The file is 
+        streamed into a temp file and renamed to its path only after the checks
+        in stream_download pass, then marked done in the manifest.
+        
+        With a report_store, a url already fetched(e.g. under another share 
+        class) is linked from the store without any request.
+        
+        Returns
+        -------
+        bool
+            Whether the download succeeded
+        
+        '''
+        if 'text_path' in task:
+            return self.fused_task(task, headers)
+        
+        # a file changed upstream must not be linked from its old blob
+        if self.store is not None and not task.get('force', False):
+            try:
+                sha256 = self.store.link_known(task['url'], task['file_path'], task['code'])
+                size = os.path.getsize(task['file_path']) if sha256 is not None else None
+            except OSError as e:
+                # e.g. the blob is missing or cannot be linked across devices
+                self.download_failed(task, e)
+                return False
+            if sha256 is not None:
+                self.metrics.count('store_hit', endpoint = 'download')
+                self.mark_done(task, size, sha256)
+                return True
+        
+        self.download_limiter.acquire()
+        check_pdf = task['file_path'].endswith('.pdf')
+        try:
+            # the whole transfer, whereas the session records the time to the headers
+            with self.metrics.timer('download'):
+                if self.store is not None:
+                    size, sha256, validators = self.store.download(self.session, task['url'], task['file_path'],
+                                                                   task['code'], headers = headers, check_pdf = check_pdf,
+                                                                   return_validators = True)
+                else:
+                    size, sha256, validators = stream_download(self.session, task['url'], task['file_path'],
+                                                               headers = headers, check_pdf = check_pdf,
+                                                               return_validators = True)
+        except Exception as e:
+            self.download_failed(task, e)
+            return False
         
+        self.download_limiter.on_success()
+        self.metrics.count('downloaded_files', endpoint = 'download')
+        self.metrics.count('downloaded_bytes', size, endpoint = 'download')
+        task['validators'] = validators
+        self.mark_done(task, size, sha256)
+        return True
+    
+    def fused_task(self, task: dict, headers: dict):
+        '''
+        Download a pdf into memory and convert it in a worker of the converter,
+        which saves the txt; the pdf is saved only if keep_pdf. With a 
+        report_store, a pdf already stored is linked and its txt, if any, 
+        copied instead of being converted again.
+        
+        Returns
+        -------
+        bool
+            Whether the txt is saved
+        
+        '''
+        sha256 = None
+        offsets = None
+        if self.store is not None and self.keep_pdf and not task.get('force', False):
+            try:
+                sha256 = self.store.link_known(task['url'], task['file_path'], task['code'])
+                size = os.path.getsize(task['file_path']) if sha256 is not None else None
+            except OSError as e:
+                self.download_failed(task, e)
+                return False
+        
+        if sha256 is not None:
+            self.metrics.count('store_hit', endpoint = 'download')
+            data = None
+            known_text = self.store.get_text(sha256)
+            if known_text is not None:
+                try:
+                    shutil.copyfile(known_text, task['text_path'])
+                    if self.conversions is not None:
+                        offsets = self.conversions.page_offsets(known_text)
+                except OSError as e:
+                    # e.g. the txt was removed or is locked; convert the pdf again
+                    print(f'Copying {known_text} FAILED: {e}; converting the pdf')
+                    known_text = None
+            if known_text is None:
+                try:
+                    with open(task['file_path'], 'rb') as f:
+                        data = f.read()
+                except OSError as e:
+                    self.download_failed(task, e)
+                    return False
+        else:
+            self.download_limiter.acquire()
+            try:
+                with self.metrics.timer('download'):
+                    data, sha256, task['validators'] = download_bytes(self.session, task['url'], headers = headers,
+                                                                      check_pdf = True, return_validators = True)
+                if self.keep_pdf and self.store is not None:
+                    self.store.put_bytes(data, sha256, task['url'], task['file_path'], task['code'])
+                elif self.keep_pdf:
+                    write_atomic(data, task['file_path'])
+            except Exception as e:
+                self.download_failed(task, e)
+                return False
+            
+            self.download_limiter.on_success()
+            size = len(data)
+            self.metrics.count('downloaded_files', endpoint = 'download')
+            self.metrics.count('downloaded_bytes', size, endpoint = 'download')
+        
+        if data is not None:
+            with self.metrics.timer('convert'):
+                offsets = self.converter.convert(data, task['text_path'])
+            if offsets is None:
+                self.metrics.count('convert_failed', endpoint = 'convert')
+                self.mark_failed(task)
+                return False
+            if self.store is not None and self.keep_pdf:
+                self.store.set_text(sha256, task['text_path'])
+        
+        if self.conversions is not None:
+            self.conversions.record(task['file_path'], task['text_path'], self.signature, sha256, offsets)
+        self.mark_done(task, size, sha256)
+        return True
+    
+    def download_failed(self, task: dict, e: Exception):
+        print(f'FAILED {task["title"]}: {e}')
+        if isinstance(e, DownloadError) and e.throttled:
+            self.download_limiter.on_throttle()
+        self.mark_failed(task)
+    
+    def mark_done(self, task: dict, size: int, sha256: str):
+        if self.manifest is not None:
+            self.manifest.mark_done(task['ann_id'], task['code'], task['file_path'], size, sha256)
+            # the validators of the response, for later revalidation sweeps
+            validators = task.get('validators')
+            if validators is not None and any(value is not None for value in validators.values()):
+                self.manifest.set_validators(task['url'], validators)
+    
+    
+    def is_changed(self, task: dict):
+        '''
+        Probe a task already done with a conditional HEAD request. Files
+        downloaded before any validator was stored are compared by size.
+        
+        Returns
+        -------
+        bool
+            Whether the file has changed upstream; True if the probe fails
+        
+        '''
+        validators = self.manifest.get_validators(task['url'])
+        if validators is None:
+            record = self.manifest.get(task['ann_id'], task['code'])
+            validators = {'content_length': record['size'] if record is not None else None}
+        
+        self.download_limiter.acquire()
+        try:
+            changed, fresh = revalidate(self.session, task['url'], validators, 
+                                        headers = self.download_headers())
+        except Exception as e:
+            print(f'Revalidation FAILED {task["title"]}: {e}')
+            if isinstance(e, DownloadError) and e.throttled:
+                self.download_limiter.on_throttle()
+            return True
+        
+        self.download_limiter.on_success()
+        if not changed:
+            self.manifest.set_validators(task['url'], fresh)
+        return changed
+    
+    def mark_failed(self, task: dict):
+        self.metrics.count('download_failed', endpoint = 'download')
+        if self.manifest is not None:
+            self.manifest.mark_failed(task['ann_id'], task['code'])
+    
+    def download_headers(self):
+        '''
+        Headers used when downloading files from static.cninfo.com.cn
+        
+        '''
         headers = {'Host': 'static.cninfo.com.cn',
                    'Connection': 'keep-alive',
                    'Upgrade-Insecure-Requests': '1',
@@ -382,60 +1053,422 @@ class cninf_crawler:
                    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
                    'Cookie': 'routeId=.uc1'
                    }
-        file_info = pd.DataFrame(columns = ['code', 'filed_date', 'file_path', 'info'])
-        idx = 0
+        return headers
+    
+    def init_download_tasks(self, code: str, report_list: list, store_path: str, revalidate = False,
+                            probe_workers: int = 1):
+        '''
+        Initialise the download tasks of a fund. If a manifest is attached, the
+        tasks are registered in it and those already done are split out, so that
+        no file on disk has to be checked.
+        
+        Parameters
+        ----------
+        code: str
+            Code of the fund
+        report_list: list
+            A list generated by crawl_single_fund
+        store_path: str
+            The directory where the downloaded files will be saved
+        revalidate: bool, default False
+            Move the tasks already done but changed upstream back to tasks
+        probe_workers: int, default 1
+            Num of HEAD probes sent at the same time when revalidating; all go
+            through the download limiter
+        
+        Returns
+        -------
+        tasks: list
+            Tasks to be downloaded
+        resumed: list
+            Tasks already done according to the manifest
+        
+        '''
+        tasks = []
         for report in report_list:
-            title = report['announcementTitle']
-            if '摘要' in title:
-                # print(f'SKIP {title}: REPORT ABSTRACT')
-                continue
-            elif '提示性' in title:
-                # print(f'SKIP {title}: SUGGESTIVE ANNOUNCEMENT')
-                continue
-            elif '推迟' in title:
-                # print(f'SKIP {report}: POSTPONEMENT OF ISSUE')
-                continue
-            elif '延缓' in title:
-                continue
-            else:
-                download_url = target_weblink + report["adjunctUrl"]
+            task = self.init_download_task(code, report, store_path)
+            if task is not None:
+                tasks.append(task)
+        
+        resumed = []
+        if self.manifest is not None:
+            self.manifest.register(code, tasks)
+            done_ids = self.manifest.done_ids(code)
+            resumed = [task for task in tasks if task['ann_id'] in done_ids]
+            tasks = [task for task in tasks if task['ann_id'] not in done_ids]
+        elif revalidate:
+            raise ValueError('Revalidation requires manifest_path when initialising the crawler')
+        
+        if revalidate:
+            with ThreadPoolExecutor(max_workers = max(1, probe_workers)) as executor:
+                flags = list(executor.map(self.is_changed, resumed))
+            changed = [task for task, is_changed in zip(resumed, flags) if is_changed]
+            for task in changed:
+                task['force'] = True
+            resumed = [task for task in resumed if not task.get('force', False)]
+            tasks += changed
+            print(f'Revalidated {len(resumed) + len(changed)} file(s); {len(changed)} changed upstream')
+        
+        # initialise the folder
+        if len(tasks) > 0:
+            os.makedirs(store_path + '/' +  code, exist_ok = True)
+            if self.text_path is not None:
+                os.makedirs(self.text_path + '/' +  code, exist_ok = True)
+        
+        return tasks, resumed
+    
+    def init_download_task(self, code: str, report: dict, store_path: str):
+        '''
+        A method to initialise the download url and local path of a report.
+        Abstracts, suggestive announcements and postponement notices are skipped.
+        
+        Parameters
+        ----------
+        code: str
+            Code of the fund
+        report: dict
+            A single record in the list generated by crawl_single_fund
+        store_path: str
+            The directory where the downloaded files will be saved
+        
+        Returns
+        -------
+        task: dict or None
+            A dict with keys ann_id, code, url, file_path, filed_date and title; 
+            None if the report should be skipped
+        
+        '''
+        title = report['announcementTitle']
+        if '摘要' in title:
+            # print(f'SKIP {title}: REPORT ABSTRACT')
+            return None
+        elif '提示性' in title:
+            # print(f'SKIP {title}: SUGGESTIVE ANNOUNCEMENT')
+            return None
+        elif '推迟' in title:
+            # print(f'SKIP {report}: POSTPONEMENT OF ISSUE')
+            return None
+        elif '延缓' in title:
+            return None
+        
+        download_url = self.target_weblink + report["adjunctUrl"]
+        
+        try:
+            '''
+            Occasionaly some of the info necessary for initialising the 
+            file cannot be found; skip such files
+            
+            '''
+            # initialise the file name
+            filed_date = unix2date(report['announcementTime'])
+            file_format = report['adjunctType'].lower()
+            file_name = f'{title}_{filed_date}.{file_format}'
+            
+        except: return None
+            
+        # initialise the full path of the file
+        file_path = store_path + '/' +  code + '/' + file_name
+        
+        # fall back to the url when the id is missing
+        ann_id = str(report.get('announcementId', report['adjunctUrl']))
+        
+        task = {'ann_id': ann_id,
+                'code': code,
+                'url': download_url,
+                'file_path': file_path,
+                'filed_date': filed_date,
+                'title': title}
+        
+        # fused mode: the pdf is converted while downloading
+        if self.converter is not None and file_format == 'pdf':
+            task['text_path'] = self.text_path + '/' + code + '/' + file_name.split('.')[0] + '.txt'
+            if not self.keep_pdf:
+                task['file_path'] = task['text_path']
+        
+        return task
+    
+    def crawl_many(self,
+                   codes: list,
+                   start: str,
+                   end: str,
+                   report_type: str,
+                   type_: str,
+                   store_path: str,
+                   list_workers: int = 1,
+                   download_workers: int = 2,
+                   queue_size: int = 8,
+                   incremental = False):
+        '''
+        Crawl and download the reports of a list of funds. The listing phase
+        (crawl_single_fund) of the upcoming funds runs while the reports of the 
+        earlier funds are being downloaded(save_file): listing workers put the 
+        report lists into a bounded queue, from which download workers take them.
+        
+        Parameters
+        ----------
+        codes: list
+            A list of fund/stock codes
+        start, end, report_type, type_:
+            See crawl_single_fund
+        store_path: str
+            The directory where the downloaded files will be saved
+        list_workers: int, default 1
+            Num of threads listing reports
+        download_workers: int, default 2
+            Num of threads downloading files
+        queue_size: int, default 8
+            Max num of listed funds waiting to be downloaded; listing workers
+            wait when the queue is full
+        incremental: bool, default False
+            See crawl_single_fund
+        
+        Returns
+        -------
+        file_info: pd.DataFrame
+            The file_info of all funds concatenated
+        failed_codes: list
+            Codes failed in either phase, including those with any file 
+            failed to download; pass them to crawl_many again to retry
+        
+        '''
+        code_queue = queue.Queue()
+        for code in codes:
+            code_queue.put(code)
+        report_queue = queue.Queue(maxsize = queue_size)
+        
+        lock = threading.Lock()
+        progress = {'listed': 0, 'downloaded': 0}
+        file_infos = []
+        failed_codes = []
+        
+        def show_progress():
+            print(f'[crawl_many] listed {progress["listed"]}/{len(codes)}, '
+                  f'downloaded {progress["downloaded"]}/{len(codes)}, '
+                  f'queued {report_queue.qsize()}')
+        
+        def list_worker():
+            while True:
+                try:
+                    code = code_queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    report_list = self.crawl_single_fund(code, start, end, report_type, type_,
+                                                         incremental = incremental)
+                except Exception as e:
+                    print(f'FAILED listing {code}: {e}')
+                    with lock:
+                        failed_codes.append(code)
+                    continue
                 
+                report_queue.put((code, report_list))
+                self.metrics.set_queue('report_queue', report_queue.qsize())
+                with lock:
+                    progress['listed'] += 1
+                    show_progress()
+        
+        def download_worker():
+            while True:
+                item = report_queue.get()
+                self.metrics.set_queue('report_queue', report_queue.qsize())
+                if item is None:
+                    return
+                code, report_list = item
                 try:
-                    '''
-                    Occasionaly some of the info necessary for initialising the 
-                    file cannot be found; skip such files
-                    
-                    '''
-                    # initialise the file name
-                    filed_date = unix2date(report['announcementTime'])
-                    file_format = report['adjunctType'].lower()
-                    file_name = f'{title}_{filed_date}.{file_format}'
-                    
-                except: continue
-            
-                # initialise the folder
-                folder_name = store_path + '/' +  code
-                os.makedirs(folder_name, exist_ok = True)
-                    
-                # initialise the full path of the file
-                file_path = folder_name + '/' + file_name
-    
-                time.sleep(random.randint(2,4))
-                headers['User-Agent'] = random.choice(self.user_agents)
-                r = requests.get(download_url, headers=headers)
-                time.sleep(5)
-                with open(file_path, 'wb') as f:
-                    f.write(r.content)
+                    file_info, n_failed = self.save_file(code, report_list, store_path, return_failed = True)
+                except Exception as e:
+                    print(f'FAILED downloading {code}: {e}')
+                    with lock:
+                        failed_codes.append(code)
+                    continue
+                
+                with lock:
+                    file_infos.append(file_info)
+                    if n_failed > 0:
+                        print(f'FAILED downloading {n_failed} file(s) of {code}')
+                        failed_codes.append(code)
+                    else:
+                        progress['downloaded'] += 1
+                    show_progress()
+        
+        listers = [threading.Thread(target = list_worker, daemon = True) for _ in range(list_workers)]
+        downloaders = [threading.Thread(target = download_worker, daemon = True) for _ in range(download_workers)]
+        for thread in listers + downloaders:
+            thread.start()
+        
+        for thread in listers:
+            thread.join()
+        # one stop signal for each download worker
+        for _ in downloaders:
+            report_queue.put(None)
+        for thread in downloaders:
+            thread.join()
+        
+        if len(file_infos) > 0:
+            file_info = pd.concat(file_infos, ignore_index = True)
+        else:
+            file_info = self.build_file_info([])
+        if self.catalog is not None:
+            self.catalog.flush()
+        
+        print(f'crawl_many completed: {len(file_info)} file(s) from {len(file_infos)} code(s)')
+        print(f'Failed {len(failed_codes)} code(s)')
+        print(self.metrics.summary())
+        print('-'*35)
+        return file_info, failed_codes
+    
+    def crawl_from_queue(self,
+                         work: work_queue,
+                         start: str,
+                         end: str,
+                         report_type: str,
+                         type_: str,
+                         store_path: str,
+                         workers: int = 1,
+                         incremental = False):
+        '''
+        Crawl and download the codes claimed from a work_queue shared with 
+        crawlers on other hosts, until nothing is left to claim. Each code is
+        listed and downloaded by the node which claimed it, then completed in
+        the queue; a failed code, or one with any file failed, is given back 
+        to be retried by any node.
+        
+        Parameters
+        ----------
+        work: work_queue
+            The shared queue, with the codes added by work_queue.add
+        start, end, report_type, type_:
+            See crawl_single_fund
+        store_path: str
+            The directory where the downloaded files will be saved; usually
+            a local disk of the node
+        workers: int, default 1
+            Num of codes crawled at the same time on this node
+        incremental: bool, default False
+            See crawl_single_fund
+        
+        Returns
+        -------
+        file_info: pd.DataFrame
+            The file_info of the codes completed by this node
+        failed_codes: list
+            Codes failed on this node
+        
+        '''
+        lock = threading.Lock()
+        file_infos = []
+        failed_codes = []
+        
+        def call_queue(func, *args, tries = 1):
+            # the queue file may be locked or out of reach for a while(e.g. 
+            # a network share); a lease not completed expires and is retried
+            for attempt in range(tries):
+                try:
+                    return func(*args)
+                except sqlite3.Error as e:
+                    print(f'[{work.worker_id}] work queue FAILED at {func.__name__} '
+                          f'({attempt + 1}/{tries}): {e}')
+                    if attempt + 1 < tries:
+                        time.sleep(2 ** attempt)
+            return None
+        
+        def worker():
+            while True:
+                codes = call_queue(work.claim, 1, tries = 5)
+                if codes is None:
+                    print(f'[{work.worker_id}] stopped claiming: work queue unavailable')
+                    return
+                if len(codes) == 0:
+                    return
+                code = codes[0]
+                try:
+                    report_list = self.crawl_single_fund(code, start, end, report_type, type_,
+                                                         incremental = incremental)
+                    file_info, n_failed = self.save_file(code, report_list, store_path, return_failed = True)
+                except Exception as e:
+                    print(f'FAILED {code}: {e}')
+                    call_queue(work.fail, code, str(e))
+                    with lock:
+                        # a code given back may fail again on this node
+                        if code not in failed_codes:
+                            failed_codes.append(code)
+                    continue
                 
-                file_info.loc[idx, :] = code, filed_date, file_path, find_info_in_title(title)
-                idx += 1
-                print(f'{idx}/{len(report_list)} done')
+                if n_failed > 0:
+                    # given back, so that the files failed are tried again
+                    print(f'FAILED {code}: {n_failed} file(s) not downloaded')
+                    call_queue(work.fail, code, f'{n_failed} file(s) not downloaded')
+                    with lock:
+                        file_infos.append(file_info)
+                        if code not in failed_codes:
+                            failed_codes.append(code)
+                    continue
                 
-
-        print('Saving procedure completed')
-        print(f'Skipped {len(report_list)-idx} file(s)')
+                call_queue(work.complete, code)
+                with lock:
+                    file_infos.append(file_info)
+                    print(f'[{work.worker_id}] completed {code}; queue: {call_queue(work.stats)}')
+        
+        threads = [threading.Thread(target = worker, daemon = True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        if len(file_infos) > 0:
+            file_info = pd.concat(file_infos, ignore_index = True)
+        else:
+            file_info = self.build_file_info([])
+        self.flush_catalog()
+        
+        print(f'crawl_from_queue completed: {len(file_info)} file(s) from {len(file_infos)} code(s)')
+        print(f'Failed {len(failed_codes)} code(s)')
+        print(self.metrics.summary())
         print('-'*35)
-        return file_info
+        return file_info, failed_codes
+    
+    def export_metrics(self, json_path: str = None, prom_path: str = None):
+        '''
+        Export the metrics of this crawler
+        
+        Parameters
+        ----------
+        json_path: str, default None
+            Path of the json file
+        prom_path: str, default None
+            Path of the Prometheus textfile, e.g 
+            '/var/lib/node_exporter/textfile/cninf.prom'
+        
+        '''
+        if json_path is not None:
+            self.metrics.to_json(json_path)
+        if prom_path is not None:
+            self.metrics.to_prometheus(prom_path)
+    
+    def close(self):
+        '''
+        Write the records buffered in the catalog, shut down the workers of
+        the converter and close the manifests, the store and the session(if
+        created by the crawler)
+        
+        '''
+        self.flush_catalog()
+        if self.converter is not None:
+            self.converter.close()
+        if self.conversions is not None:
+            self.conversions.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        if self.store is not None:
+            self.store.close()
+        if self._owns_session:
+            self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
     
     
 if __name__ == '__main__':
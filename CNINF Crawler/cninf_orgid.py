@@ -10,19 +10,37 @@ Check whether it contains the orgid you are looking for.
 
 WorkFlow:
     i. prepare a list of fund names or codes
-    ii. use init_key2orgid_dict
+    ii. use init_key2orgid_dict; or, with an orgid_cache, use resolve_many to
+        look up only the keys missing from the cache, concurrently
 
 CONTENTS
 --------
+- <CLASS> OrgIdNotFound
+- <FUNC> find_info
+- <CLASS> orgid_cache
 - <CLASS> cninf_orgid_finder
 
 '''
 import requests
 import random
 import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
 from tqdm import tqdm
+from cninf_session import session_pool
+from crawl_common.rate_limiter import aimd_limiter, is_throttled
+from retry_policy import retry_policy, circuit_breaker, RetryableError, FatalError
 
-def find_info(user_agent: str, key: str, type_: str, mode: str):
+class OrgIdNotFound(FatalError, KeyError):
+    '''
+    No fund/stock found for a key; a KeyError as raised by earlier versions
+
+    '''
+
+def find_info(user_agent: str, key: str, type_: str, mode: str, session = None,
+              base_url: str = 'http://www.cninfo.com.cn'):
     '''
     A method to find info about a fund/stock
 
@@ -38,6 +56,10 @@ def find_info(user_agent: str, key: str, type_: str, mode: str):
         Find with fund code /name; should be one of the following:
             - 'code'
             - 'name'
+    session: session_pool or requests.Session, default None
+        Session used to post the query; fall back to bare requests if None
+    base_url: str, default 'http://www.cninfo.com.cn'
+        Host of the search api
 
     Returns
     -------
@@ -48,6 +70,13 @@ def find_info(user_agent: str, key: str, type_: str, mode: str):
             - orgId
             - type(stock/fund)
             - type_d: detail type
+    
+    Raises
+    ------
+    OrgIdNotFound
+        If nothing is found for the key
+    RetryableError
+        If the response is throttled or not json
 
     '''
     hd = {
@@ -62,35 +91,49 @@ def find_info(user_agent: str, key: str, type_: str, mode: str):
         'Accept': 'application/json,text/plain,*/*',
         'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8'}
     
-    info = {}
+    http = session if session is not None else requests
+    
+    if mode == 'name':
+        url = base_url + '/new/information/topSearch/detailOfQuery'
+        data = {'keyWord': key,
+                'maxSecNum': 10,
+                'maxListNum': 5,
+				}
+    elif mode == 'code':
+        url = base_url + '/new/information/topSearch/query'
+        data = {'keyWord': key,
+               'maxNum': 10}
+    else:
+        raise ValueError(f'Unknown mode: {mode}')
+    
+    # network errors are raised as they are; the retry policy of the caller
+    # tells them apart from a key that does not exist
+    r = http.post(url, headers=hd, data=data)
+    if is_throttled(r.status_code):
+        raise RetryableError(f'status {r.status_code} when searching {key}')
     try:
-        if mode == 'name':
-            url = 'http://www.cninfo.com.cn/new/information/topSearch/detailOfQuery'
-            data = {'keyWord': key,
-                    'maxSecNum': 10,
-                    'maxListNum': 5,
-    				}
-            r = requests.post(url, headers=hd, data=data)
-            info = r.json()['keyBoardList'][0]
-            
-        elif mode == 'code':
-            url = 'http://www.cninfo.com.cn/new/information/topSearch/query'
-            data = {'keyWord': key,
-                   'maxNum': 10}
-            org_id = 'error'
-            r = requests.post(url, headers=hd, data=data)
-            
-            if type_ == 'stock':
-                for record in r.json():
-                    if '股' in record['category']:
-                        info = record
-                        break
-            else:                   
-                for record in r.json():
-                    if '基金' in record['category'] or 'QDII' in record['category'] :
-                        info = record
-                        break
-    except: pass
+        content = r.json()
+    except ValueError:
+        raise RetryableError(f'response is not json when searching {key}')
+    
+    info = {}
+    if mode == 'name':
+        if content.get('keyBoardList'):
+            info = content['keyBoardList'][0]
+    elif type_ == 'stock':
+        for record in content:
+            if '股' in record['category']:
+                info = record
+                break
+    else:                   
+        for record in content:
+            if '基金' in record['category'] or 'QDII' in record['category'] :
+                info = record
+                break
+    
+    if len(info) == 0:
+        raise OrgIdNotFound(key)
+    
     output = {'code': info['code'],
               'name': info['zwjc'],
               'orgId': info['orgId'],
@@ -99,8 +142,137 @@ def find_info(user_agent: str, key: str, type_: str, mode: str):
     
     return output
 
+class orgid_cache:
+    def __init__(self, db_path: str):
+        '''
+        An indexed on-disk cache of the info found by find_info, keyed by
+        (key, mode, type_), where key is a code or a name.
+        
+        Parameters
+        ----------
+        db_path: str
+            Path to the SQLite file; created if not exists
+        
+        '''
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread = False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS orgids (
+                                    key TEXT,
+                                    mode TEXT,
+                                    type TEXT,
+                                    code TEXT,
+                                    name TEXT,
+                                    orgId TEXT,
+                                    category TEXT,
+                                    updated_at REAL,
+                                    PRIMARY KEY (key, mode, type))''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_orgid_code ON orgids(type, code)')
+    
+    def get(self, key: str, mode: str = 'code', type_: str = 'fund'):
+        '''
+        Returns the cached info in the format of find_info; None if not cached
+        
+        '''
+        with self._lock:
+            row = self.conn.execute('''SELECT code, name, orgId, category FROM orgids
+                                       WHERE key = ? AND mode = ? AND type = ?''',
+                                    (key, mode, type_)).fetchone()
+        if row is None: return None
+        
+        return {'code': row[0],
+                'name': row[1],
+                'orgId': row[2],
+                'type': type_,
+                'type_d': row[3]}
+    
+    def put(self, key: str, mode: str, info: dict):
+        '''
+        Save the output of find_info
+        
+        '''
+        with self._lock, self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO orgids 
+                                 (key, mode, type, code, name, orgId, category, updated_at)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                              (key, mode, info['type'], info['code'], info['name'], 
+                               info['orgId'], info['type_d'], time.time()))
+    
+    def missing(self, key_list: list, mode: str = 'code', type_: str = 'fund'):
+        '''
+        Returns the keys in key_list not cached yet, in the original order
+        
+        '''
+        with self._lock:
+            cached = set(row[0] for row in 
+                         self.conn.execute('SELECT key FROM orgids WHERE mode = ? AND type = ?', 
+                                           (mode, type_)).fetchall())
+        return [key for key in key_list if key not in cached]
+    
+    def code2post(self, type_: str = 'fund'):
+        '''
+        Returns a dict in the format of cninf_orgid_dict.xlsx:
+            {code: 'code,orgId'}
+        
+        '''
+        with self._lock:
+            rows = self.conn.execute('SELECT DISTINCT code, orgId FROM orgids WHERE type = ?', 
+                                     (type_,)).fetchall()
+        return dict((code, f'{code},{org_id}') for code, org_id in rows)
+    
+    def import_excel(self, code2orgid_dict_path: str, type_: str = 'fund'):
+        '''
+        Import an existing cninf_orgid_dict.xlsx(columns: code, post) into the cache
+        
+        '''
+        raw_dict = pd.read_excel(code2orgid_dict_path, dtype = {'code': str})
+        now = time.time()
+        rows = []
+        for code, post in zip(raw_dict['code'], raw_dict['post']):
+            org_id = str(post).split(',')[-1]
+            rows.append((code, 'code', type_, code, None, org_id, None, now))
+        
+        with self._lock, self.conn:
+            self.conn.executemany('''INSERT OR IGNORE INTO orgids 
+                                     (key, mode, type, code, name, orgId, category, updated_at)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        return len(rows)
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
 class cninf_orgid_finder:
-    def __init__(self):
+    def __init__(self, session = None, cache_path: str = None, limiter = None,
+                 base_url: str = 'http://www.cninfo.com.cn', retry = None):
+        '''
+        Parameters
+        ----------
+        session: session_pool, default None
+            Shared keep-alive session layer; a new session_pool is created if
+            not given
+        cache_path: str, default None
+            Path to an orgid_cache; if given, keys found are saved in it and 
+            cached keys are never queried again
+        limiter: aimd_limiter, default None
+            Rate limiter shared by the queries; starts at 1 query per 2s
+        base_url: str, default 'http://www.cninfo.com.cn'
+            Host of the search api
+        retry: retry_policy, default None
+            Retry policy of the queries; by default 5 tries with jittered 
+            backoff and a circuit breaker shared by the threads of resolve_many
+        
+        '''
+        self.base_url = base_url
+        if retry is None:
+            retry = retry_policy(breaker = circuit_breaker(name = 'orgid circuit'), name = 'orgid')
+        self.retry = retry
+        self.session = session if session is not None else session_pool()
+        self.cache = orgid_cache(cache_path) if cache_path is not None else None
+        self.limiter = limiter if limiter is not None else aimd_limiter(rate = 0.5, name = 'orgid')
+        
         # a list of user_agents to be chosen randomly when posting
         self.user_agents = ["Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; Win64; x64; Trident/5.0; .NET CLR 3.5.30729; .NET CLR 3.0.30729; .NET CLR 2.0.50727; Media Center PC 6.0)",
                         
@@ -131,6 +303,35 @@ class cninf_orgid_finder:
         print('Initialised successfully')
         print('-'*32) 
         
+    def lookup(self, key: str, mode: str = 'code', type_: str = 'fund'):
+        '''
+        Query the info of a key under the rate limiter and the retry policy,
+        without the cache
+        
+        Returns
+        -------
+        output: dict
+            The output of find_info; OrgIdNotFound is raised if not found
+        
+        '''
+        def attempt():
+            self.limiter.acquire()
+            try:
+                info = find_info(random.choice(self.user_agents),
+                                 key, type_, mode, session = self.session, base_url = self.base_url)
+            except OrgIdNotFound:
+                # nothing found for the key; not a throttling signal
+                self.limiter.on_success()
+                raise
+            except Exception:
+                self.limiter.on_throttle()
+                raise
+            
+            self.limiter.on_success()
+            return info
+        
+        return self.retry.call(attempt)
+        
     def get_orgid(self, key:str, mode = 'code', type_ = 'fund', verbose = True):
         '''
         A method to find the 'orgid' of a fund that is required when posting
@@ -153,14 +354,22 @@ class cninf_orgid_finder:
         Returns
         -------
         orgid: str
-            orgid of the fund
+            orgid of the fund; 'error' if not found
+            
+        Raises the last error if the query still fails after the retries of
+        the retry policy.
             
         '''
         
-        info = find_info(random.choice(self.user_agents),
-                         key, type_, mode)
-        if len(info) > 0:
-            org_id = info['orgId']
+        info = self.cache.get(key, mode, type_) if self.cache is not None else None
+        if info is None:
+            try:
+                info = self.lookup(key, mode, type_)
+            except OrgIdNotFound:
+                info = {}
+            if self.cache is not None and len(info) > 0:
+                self.cache.put(key, mode, info)
+        org_id = info['orgId'] if len(info) > 0 else 'error'
         
         if verbose:
             print('-'*20)
@@ -198,20 +407,79 @@ class cninf_orgid_finder:
         output_dict = {}
         failed_keys = []
         for key in tqdm(key_list):
+            # retried with backoff inside; a key still failing does not stop the loop
             try:
                 org_id = self.get_orgid(key, mode)
-            except:
-                print('Sleep for a while...')
-                time.sleep(10)
-                print('Resumed...')
-                org_id = self.get_orgid(key, mode)
+            except Exception as e:
+                print(f'FAILED {key}: {e}')
+                org_id = 'error'
 
             if org_id == 'error':
                 failed_keys.append(key)
                 continue
             
             output_dict[key] = org_id
-            time.sleep(2)
+        return output_dict, failed_keys
+
+    def resolve_many(self, key_list: list, mode: str = 'code', type_: str = 'fund', workers: int = 4):
+        '''
+        A bulk version of init_key2orgid_dict: only the keys missing from the 
+        cache are queried, by [workers] threads under the shared rate limiter
+        
+        Parameters
+        ----------
+        key_list: list
+            A list of keys
+        mode: str, default 'code'
+            Must be one of the followings:
+                - 'name', or
+                - 'code'
+        type_: str, default 'fund'
+            Must be one of the followings:
+                - 'fund', or
+                - 'stock'
+        workers: int, default 4
+            Num of threads querying at the same time
+        
+        Returns
+        -------
+        output_dict: dict
+            A dict in the following format:
+                {key: orgid}
+        failed_keys: list
+            A list of failed keys
+        
+        '''
+        if self.cache is None:
+            raise ValueError('resolve_many requires cache_path when initialising the finder')
+        
+        to_find = self.cache.missing(key_list, mode, type_)
+        print(f'{len(key_list) - len(to_find)} key(s) cached, {len(to_find)} to be found')
+        
+        def resolve(key):
+            try:
+                info = self.lookup(key, mode, type_)
+            except Exception as e:
+                if not isinstance(e, OrgIdNotFound):
+                    print(f'FAILED {key}: {e}')
+                return False
+            
+            self.cache.put(key, mode, info)
+            return True
+        
+        failed_keys = []
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            futures = dict((executor.submit(resolve, key), key) for key in to_find)
+            for future in tqdm(as_completed(futures), total = len(futures)):
+                if not future.result():
+                    failed_keys.append(futures[future])
+        
+        output_dict = {}
+        for key in key_list:
+            info = self.cache.get(key, mode, type_)
+            if info is not None:
+                output_dict[key] = info['orgId']
+        print(f'Found {len(output_dict)}/{len(key_list)}; current rate {self.limiter}')
         return output_dict, failed_keys
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A shared session layer for the CNINF crawler and the orgId finder.
+
+Bare requests.post/requests.get open a new TCP connection for every call.
+session_pool keeps one requests.Session per host(www.cninfo.com.cn,
+static.cninfo.com.cn, ...), each with its own keep-alive connection pool, so
+that connections are reused across pages, downloads and orgId queries.
+
+The pool exposes get/post with the same signature as requests, so it can be
+passed to cninf_crawler, cninf_orgid_finder and find_info wherever a session
+is accepted.
+
+CONTENTS
+--------
+- <CLASS> session_pool
+
+'''
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+class session_pool:
+    def __init__(self,
+                 pool_maxsize: int = 10,
+                 host_limits: dict = None,
+                 pool_block: bool = True,
+                 metrics = None):
+        '''
+        Parameters
+        ----------
+        pool_maxsize: int, default 10
+            Max num of keep-alive connections kept for a single host
+        host_limits: dict, default None
+            Per-host overrides of pool_maxsize, e.g
+                {'static.cninfo.com.cn': 4}
+        pool_block: bool, default True
+            Whether to wait for a free connection when the pool of a host is
+            exhausted, instead of opening a throwaway connection; keeping it
+            True makes the per-host limit a hard cap
+        metrics: crawl_metrics, default None
+            If given, every response of every host is recorded in it
+
+        '''
+        self.pool_maxsize = pool_maxsize
+        self.host_limits = host_limits if host_limits is not None else {}
+        self.pool_block = pool_block
+        self.metrics = metrics
+
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, host: str):
+        '''
+        Get the session of a given host, initialise it if not exists
+
+        Parameters
+        ----------
+        host : str
+            Host name, e.g 'www.cninfo.com.cn'
+
+        Returns
+        -------
+        session: requests.Session
+
+        '''
+        with self._lock:
+            if host not in self.sessions:
+                pool_size = self.host_limits.get(host, self.pool_maxsize)
+                adapter = HTTPAdapter(pool_connections = 1,
+                                      pool_maxsize = pool_size,
+                                      pool_block = self.pool_block)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if self.metrics is not None:
+                    self.metrics.instrument(session)
+                self.sessions[host] = session
+
+            return self.sessions[host]
+
+    def request(self, method: str, url: str, **kwargs):
+        host = urlparse(url).netloc
+        return self.session_for(host).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A sidecar SQLite manifest of the txt files written by pdf2txt, so that a
+re-run converts only the reports that are new or have changed.
+
+For each txt file the manifest keeps the source pdf's size, mtime and(when
+known) sha256, the backend and its version, the cleaning options and the
+size of the txt written. The cached txt is still valid when:
+    - the txt file is there with the size recorded;
+    - the backend, its version and the cleaning options are the same;
+    - the pdf has the same size and mtime; or, with use_hash, the same
+      sha256(e.g. the reports were copied to another disk and lost their
+      mtime), in which case the new mtime is recorded.
+Any other file is converted again and its record replaced.
+
+The manifest also keeps the offset(in characters) at which each page starts
+in the txt, for the later stages that need to map text back to pages.
+
+CONTENTS
+--------
+- <FUNC> file_sha256
+- <CLASS> conversion_manifest
+
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024):
+    '''
+    sha256 of a file, read in chunks
+
+    '''
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class conversion_manifest:
+    def __init__(self, db_path: str, use_hash: bool = False):
+        '''
+        Parameters
+        ----------
+        db_path: str
+            Path to the SQLite file; created if not exists
+        use_hash: bool, default False
+            Whether to compare the sha256 of a pdf whose mtime or size has
+            changed, instead of converting it again at once
+
+        '''
+        self.db_path = db_path
+        self.use_hash = use_hash
+        self.conn = sqlite3.connect(db_path, check_same_thread = False)
+        self._lock = threading.Lock()
+
+        with self._lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS conversions (
+                                    text_path TEXT PRIMARY KEY,
+                                    pdf_path TEXT,
+                                    pdf_size INTEGER,
+                                    pdf_mtime_ns INTEGER,
+                                    pdf_sha256 TEXT,
+                                    backend TEXT,
+                                    backend_version TEXT,
+                                    options TEXT,
+                                    text_size INTEGER,
+                                    converted_at REAL,
+                                    page_offsets TEXT)''')
+            # manifests written before the page offsets were kept
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(conversions)')]
+            if 'page_offsets' not in columns:
+                self.conn.execute('ALTER TABLE conversions ADD COLUMN page_offsets TEXT')
+
+    def is_fresh(self, pdf_path: str, text_path: str, signature: tuple):
+        '''
+        Whether the txt converted from a pdf is still valid
+
+        Parameters
+        ----------
+        pdf_path: str
+        text_path: str
+        signature: tuple
+            (backend, backend_version, options) of the current conversion
+
+        Returns
+        -------
+        bool
+
+        '''
+        with self._lock:
+            row = self.conn.execute('''SELECT pdf_size, pdf_mtime_ns, pdf_sha256, backend, backend_version,
+                                       options, text_size FROM conversions WHERE text_path = ?''',
+                                    (text_path,)).fetchone()
+        if row is None or tuple(row[3:6]) != tuple(signature):
+            return False
+        try:
+            if os.path.getsize(text_path) != row[6]:
+                return False
+            stat = os.stat(pdf_path)
+        except OSError:
+            return False
+
+        if (stat.st_size, stat.st_mtime_ns) == (row[0], row[1]):
+            return True
+        if not self.use_hash or row[2] is None or stat.st_size != row[0]:
+            return False
+        if file_sha256(pdf_path) != row[2]:
+            return False
+
+        # same content under a new mtime
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE conversions SET pdf_mtime_ns = ? WHERE text_path = ?',
+                              (stat.st_mtime_ns, text_path))
+        return True
+
+    def record(self, pdf_path: str, text_path: str, signature: tuple, sha256: str = None,
+               page_offsets: list = None):
+        '''
+        Record a txt just written from a pdf
+
+        Parameters
+        ----------
+        pdf_path: str
+        text_path: str
+        signature: tuple
+            (backend, backend_version, options) of the conversion
+        sha256: str, default None
+            sha256 of the pdf, if known; computed if None and use_hash
+        page_offsets: list, default None
+            Offset in the txt at which each page starts, if known
+
+        '''
+        stat = os.stat(pdf_path)
+        if sha256 is None and self.use_hash:
+            sha256 = file_sha256(pdf_path)
+        row = (text_path, pdf_path, stat.st_size, stat.st_mtime_ns, sha256) + tuple(signature) + \
+              (os.path.getsize(text_path), time.time(),
+               json.dumps(page_offsets) if page_offsets is not None else None)
+        with self._lock, self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO conversions
+                                 (text_path, pdf_path, pdf_size, pdf_mtime_ns, pdf_sha256, backend,
+                                  backend_version, options, text_size, converted_at, page_offsets)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', row)
+
+    def page_offsets(self, text_path: str):
+        '''
+        Offsets(in characters) at which the pages start in a txt
+
+        Returns
+        -------
+        offsets: list
+            None if the txt or its offsets are not recorded
+
+        '''
+        with self._lock:
+            row = self.conn.execute('SELECT page_offsets FROM conversions WHERE text_path = ?',
+                                    (text_path,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
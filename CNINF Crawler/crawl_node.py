@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Run one node of a multi-host crawl. Every node claims fund codes from the
+same work_queue file on a shared file system and downloads them through its
+own IP, so throughput grows with the num of nodes.
+
+Usage:
+    # once, from any host: put the codes into the queue
+    python crawl_node.py --queue /mnt/share/queue.db --add codes.txt
+
+    # on every host
+    python crawl_node.py --queue /mnt/share/queue.db --orgid orgid.db --store ./reports \
+        --start 2020-01-01 --end 2022-12-31 --workers 2
+
+    # progress
+    python crawl_node.py --queue /mnt/share/queue.db --stats
+
+CONTENTS
+--------
+- <FUNC> load_codes
+- <FUNC> run_node
+
+'''
+import argparse
+import os
+from work_queue import work_queue
+
+def load_codes(path: str):
+    '''
+    Read fund codes from a text file, one per line
+
+    '''
+    with open(path, 'r', encoding = 'utf-8') as f:
+        codes = [line.strip() for line in f]
+    return [code for code in codes if code != '']
+
+def run_node(args):
+    '''
+    Crawl the codes claimed from the queue until nothing is left
+
+    '''
+    from cninf_crawler import cninf_crawler
+
+    manifest_path = args.manifest if args.manifest is not None else os.path.join(args.store, '.manifest.db')
+    os.makedirs(args.store, exist_ok = True)
+    with cninf_crawler(args.orgid, 'http://static.cninfo.com.cn/',
+                       manifest_path = manifest_path,
+                       catalog_path = args.catalog) as crawler:
+        with work_queue(args.queue, lease_seconds = args.lease) as work:
+            print(f'Node {work.worker_id} started; queue: {work.stats()}')
+            crawler.crawl_from_queue(work, args.start, args.end, args.report_type, args.type,
+                                     args.store, workers = args.workers, incremental = args.incremental)
+
+        if args.metrics is not None:
+            crawler.export_metrics(json_path = args.metrics + '.json', prom_path = args.metrics + '.prom')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run a node of a crawl coordinated by a shared work queue')
+    parser.add_argument('--queue', required = True, help = 'path to the queue file on the shared file system')
+    parser.add_argument('--add', default = None, help = 'add the codes in this file to the queue and exit')
+    parser.add_argument('--stats', action = 'store_true', help = 'show the state of the queue and exit')
+    parser.add_argument('--retry-failed', action = 'store_true', help = 'put the failed codes back and exit')
+    parser.add_argument('--orgid', default = 'orgid.db', help = 'code2orgid dict file or orgid_cache')
+    parser.add_argument('--store', default = './reports', help = 'where the reports are saved on this node')
+    parser.add_argument('--manifest', default = None, help = 'manifest of this node; [store]/.manifest.db if not given')
+    parser.add_argument('--catalog', default = None, help = 'root of the parquet catalog')
+    parser.add_argument('--metrics', default = None, help = 'export the metrics to [metrics].json and [metrics].prom')
+    parser.add_argument('--start', default = '2000-01-01')
+    parser.add_argument('--end', default = '2030-12-31')
+    parser.add_argument('--report-type', default = 'all', choices = ['all', 'quarter', 'annual', 'mid-term'])
+    parser.add_argument('--type', default = 'fund', choices = ['fund', 'stock'])
+    parser.add_argument('--workers', type = int, default = 1, help = 'codes crawled at the same time on this node')
+    parser.add_argument('--lease', type = float, default = 900.0, help = 'lease of a claimed code in seconds')
+    parser.add_argument('--incremental', action = 'store_true')
+    args = parser.parse_args()
+
+    if args.add is not None or args.stats or args.retry_failed:
+        work = work_queue(args.queue)
+        if args.add is not None:
+            print(f'Added {work.add(load_codes(args.add))} code(s)')
+        if args.retry_failed:
+            print(f'Put {work.retry_failed()} failed code(s) back')
+        print(work.stats())
+        work.close()
+    else:
+        run_node(args)
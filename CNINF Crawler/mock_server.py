@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A local stand-in for the CNINF and EastMoney servers, used to tune and
+benchmark the crawlers without touching the live sites.
+
+Endpoints served(all on one host/port):
+    CNINF
+    - POST /new/hisAnnouncement/query                 paginated announcements
+                                                      (announcements, hasMore,
+                                                      totalAnnouncement)
+    - POST /new/information/topSearch/query           orgId search by code
+    - POST /new/information/topSearch/detailOfQuery   orgId search by name
+    - GET  /finalpage/[date]/[id].PDF                 the static pdf host
+    EastMoney
+    - GET  /f10/JJGG?fundcode=...                     announcement list
+    - GET  /pdf/H2_[id]_1.pdf                         attachments
+
+Behaviour is controlled by mock_config:
+    - latency: seconds added to every response;
+    - pdf_size: size of the fake pdf files;
+    - reports_per_fund: num of announcements per code;
+    - throttle_rps: above this num of requests/s, CNINF answers 429 and
+      EastMoney answers its block page; None to disable;
+    - error_rate: share of requests answered with 500.
+The server counts requests, throttled/failed responses and bytes sent.
+
+CONTENTS
+--------
+- <CLASS> mock_config
+- <FUNC> fake_pdf
+- <FUNC> fake_announcements
+- <CLASS> mock_handler
+- <FUNC> start_mock_server
+
+'''
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BLOCK_PAGE = b'<html><body>The access control configuration prevents your request at this time</body></html>'
+
+class mock_config:
+    def __init__(self,
+                 latency: float = 0.0,
+                 pdf_size: int = 1024 * 1024,
+                 reports_per_fund: int = 40,
+                 throttle_rps: float = None,
+                 error_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.pdf_size = pdf_size
+        self.reports_per_fund = reports_per_fund
+        self.throttle_rps = throttle_rps
+        self.error_rate = error_rate
+        self.seed = seed
+        
+        # counters filled in by the server
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'bytes': 0}
+
+def fake_pdf(ann_id: str, size: int):
+    '''
+    A deterministic fake pdf of about [size] bytes, with the magic and trailer
+    checked by stream_download
+
+    '''
+    head = b'%PDF-1.4\n% mock report ' + ann_id.encode('utf-8') + b'\n'
+    tail = b'\n%%EOF\n'
+    filler = hashlib.sha256(ann_id.encode('utf-8')).hexdigest().encode('utf-8')
+    body_size = max(0, size - len(head) - len(tail))
+    body = (filler * (body_size // len(filler) + 1))[:body_size]
+    return head + body + tail
+
+def fake_announcements(code: str, n: int):
+    '''
+    Deterministic announcements of a code, latest first; quarterly, mid-term
+    and annual reports filed from 2010 on
+
+    '''
+    output = []
+    names = {1: '第一季度报告', 2: '第二季度报告', 3: '第三季度报告', 4: '第四季度报告',
+             5: '半年度报告', 6: '年度报告'}
+    start = datetime.datetime(2010, 1, 20)
+    for i in range(n):
+        filed = start + datetime.timedelta(days = 45 * i)
+        kind = i % 6 + 1
+        year = filed.year if kind < 4 else filed.year - 1
+        ann_id = f'{code}{i:05d}'
+        output.append({'announcementId': ann_id,
+                       'announcementTitle': f'{code}基金{year}年{names[kind]}',
+                       'announcementTime': int(filed.timestamp() * 1000),
+                       'adjunctUrl': f'finalpage/{filed:%Y-%m-%d}/{ann_id}.PDF',
+                       'adjunctType': 'PDF',
+                       'secCode': code})
+    output.reverse()
+    return output
+
+class mock_handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _reply(self, status: int, body: bytes, content_type: str = 'application/json;charset=UTF-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.config.stats['bytes'] += len(body)
+
+    def _reply_json(self, obj):
+        self._reply(200, json.dumps(obj, ensure_ascii = False).encode('utf-8'))
+
+    def _gate(self):
+        '''
+        Apply latency, throttling and error injection; returns False if the
+        request has been answered already
+
+        '''
+        config = self.config
+        if config.latency > 0:
+            time.sleep(config.latency)
+
+        now = time.monotonic()
+        with self.server.lock:
+            config.stats['requests'] += 1
+            window = self.server.window
+            window.append(now)
+            while window and window[0] < now - 1:
+                window.pop(0)
+            throttled = config.throttle_rps is not None and len(window) > config.throttle_rps
+            failed = self.server.rng.random() < config.error_rate
+            if throttled:
+                config.stats['throttled'] += 1
+            elif failed:
+                config.stats['errors'] += 1
+
+        if throttled:
+            if self.path.startswith(('/f10/', '/pdf/')):
+                self._reply(200, BLOCK_PAGE, 'text/html')
+            else:
+                self._reply(429, b'Too Many Requests', 'text/plain')
+            return False
+        if failed:
+            self._reply(500, b'Internal Server Error', 'text/plain')
+            return False
+        return True
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = parse_qs(self.rfile.read(length).decode('utf-8'))
+        return dict((key, value[0]) for key, value in data.items())
+
+    def do_POST(self):
+        form = self._form()
+        if not self._gate(): return
+        path = urlparse(self.path).path
+
+        if path == '/new/hisAnnouncement/query':
+            self._query(form)
+        elif path == '/new/information/topSearch/query':
+            key = form.get('keyWord', '')
+            self._reply_json([{'code': key, 'zwjc': f'mock{key}', 'orgId': f'jjjl{key}', 'category': '基金'}])
+        elif path == '/new/information/topSearch/detailOfQuery':
+            key = form.get('keyWord', '')
+            self._reply_json({'keyBoardList': [{'code': key, 'zwjc': key, 'orgId': f'jjjl{key}', 'category': '基金'}]})
+        else:
+            self._reply(404, b'Not Found', 'text/plain')
+
+    def do_GET(self):
+        if not self._gate(): return
+        url = urlparse(self.path)
+
+        if url.path.startswith('/finalpage/'):
+            ann_id = url.path.rsplit('/', 1)[-1].split('.')[0]
+            self._reply(200, fake_pdf(ann_id, self.config.pdf_size), 'application/pdf')
+        elif url.path == '/f10/JJGG':
+            code = parse_qs(url.query).get('fundcode', [''])[0]
+            data = []
+            for record in fake_announcements(code, self.config.reports_per_fund):
+                data.append({'FUNDCODE': code,
+                             'TITLE': record['announcementTitle'],
+                             'PUBLISHDATEDesc': datetime.datetime.fromtimestamp(record['announcementTime']/1000).strftime('%Y-%m-%d'),
+                             'ID': record['announcementId'],
+                             'ATTACHTYPE': '0'})
+            self._reply_json({'Data': data, 'TotalCount': len(data)})
+        elif url.path.startswith('/pdf/H2_'):
+            ann_id = url.path.split('_')[1]
+            self._reply(200, fake_pdf(ann_id, self.config.pdf_size), 'application/pdf')
+        else:
+            self._reply(404, b'Not Found', 'text/plain')
+
+    def _query(self, form: dict):
+        # 'stock' is 'code,orgId' for funds and stocks alike
+        code = form.get('stock', '').split(',')[0]
+        page_num = int(form.get('pageNum', 1))
+        page_size = int(form.get('pageSize', 30))
+
+        records = fake_announcements(code, self.config.reports_per_fund)
+        period = form.get('seDate', '')
+        if '~' in period:
+            start, end = period.split('~')
+            records = [record for record in records
+                       if start <= datetime.datetime.fromtimestamp(record['announcementTime']/1000).strftime('%Y-%m-%d') <= end]
+
+        total = len(records)
+        page = records[(page_num - 1) * page_size: page_num * page_size]
+        self._reply_json({'announcements': page if len(page) > 0 else None,
+                          'hasMore': page_num * page_size < total,
+                          'totalAnnouncement': total,
+                          'totalRecordNum': total})
+
+def start_mock_server(host: str = '127.0.0.1', port: int = 0, config: mock_config = None):
+    '''
+    Start the mock server in a daemon thread
+
+    Parameters
+    ----------
+    host: str, default '127.0.0.1'
+    port: int, default 0
+        0 to pick a free port
+    config: mock_config, default None
+
+    Returns
+    -------
+    server: ThreadingHTTPServer
+        Call server.shutdown() to stop; server.config.stats holds the counters
+    base_url: str
+        e.g 'http://127.0.0.1:8000'
+
+    '''
+    server = ThreadingHTTPServer((host, port), mock_handler)
+    server.daemon_threads = True
+    server.config = config if config is not None else mock_config()
+    server.lock = threading.Lock()
+    server.window = []
+    server.rng = random.Random(server.config.seed)
+
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+if __name__ == '__main__':
+    server, base_url = start_mock_server(port = 8000)
+    print(f'Mock server running at {base_url}; Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -4,9 +4,34 @@ DESCRIPTION
 -----------
 A new module to convert pdf file to txt.
 
+The crawler may also convert the reports while downloading them(text_path of
+cninf_crawler): the pdf is kept in memory and handed to a text_converter, so
+that a fresh crawl writes the txt only, or the pdf and txt once each.
+
+The text is extracted by one of the backends of pdf_backends; by default the
+fastest one installed, with PyPDF2 as the fallback.
+
+My_pdf2txt records each txt it writes in a conversion_manifest, with the
+source pdf, the backend version, the cleaning options and the page offsets,
+and skips the reports whose txt is still valid when run again; the crawler
+records the txt of its fused mode in the same way when it keeps the pdf.
+
 CONTENTS
 --------
 - <FUNC> convert_num2code
+- <FUNC> clean_text
+- <FUNC> iter_pages
+- <FUNC> extract_pages
+- <FUNC> write_pages
+- <FUNC> count_pages
+- <FUNC> page_ranges
+- <FUNC> pdf2text
+- <FUNC> extract_pages_split
+- <FUNC> conversion_signature
+- <FUNC> convert_to_file
+- <FUNC> convert_timed
+- <FUNC> extract_timed
+- <CLASS> text_converter
 - <CLASS> My_pdf2txt
 
 OTHER INFO.
@@ -19,11 +44,21 @@ OTHER INFO.
 
 '''
 
-import PyPDF2
+import json
 import os
 import pandas as pd
 from tqdm import tqdm
 import time
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from crawl_common.report_store import report_store
+from pdf_backends import get_backend
+from conversion_manifest import conversion_manifest
+
+# options of iter_pages and clean_text, recorded with each txt; change them
+# here along with the code so that the txt files are converted again
+CLEAN_OPTIONS = json.dumps({'strip_newlines': '\r\n', 'charset_filter': 'gbk'}, sort_keys = True)
 
 def convert_num2code(code_list:list):
     '''
@@ -49,6 +84,284 @@ def convert_num2code(code_list:list):
         
     return output
 
+def clean_text(text: str):
+    '''
+    A series of encode-decoding procedures to insure the content can be
+    decoded by utf-8; meaningless symbols removed in this step.
+
+    '''
+    return text.encode('gbk',errors='ignore').decode('gbk').encode('utf-8').decode('utf-8')
+
+def iter_pages(source, start: int = 0, end: int = None, backend: str = 'auto'):
+    '''
+    Extract the text of pages [start, end) of a pdf file one page at a time,
+    each page cleaned on its own, so that only one page is held in memory.
+
+    Parameters
+    ----------
+    source : str or bytes
+        Path to the pdf file, or its content already in memory.
+    start : int, default 0
+        First page.
+    end : int, default None
+        Page after the last; to the last page if None.
+    backend : str, default 'auto'
+        Name of the pdf backend; the fastest one installed if 'auto'.
+
+    Yields
+    ------
+    text : str
+        Content of a page, with line breaks and symbols that cannot be
+        decoded by gbk removed.
+
+    '''
+    for page in get_backend(backend).iter_pages(source, start, end):
+        # pypdfium2 breaks lines with '\r\n', PyPDF2 with '\n'
+        yield clean_text(page.replace('\r', '').replace('\n', ''))
+
+def extract_pages(source, start: int = 0, end: int = None, backend: str = 'auto'):
+    '''
+    Extract the text of pages [start, end) of a pdf file.
+
+    Returns
+    -------
+    pages : list
+        Content of each page, cleaned as in iter_pages.
+
+    '''
+    return list(iter_pages(source, start, end, backend))
+
+def write_pages(pages, text_path: str):
+    '''
+    Write the text of a file page by page through a buffered writer, to a
+    temp file renamed to [text_path] once complete.
+
+    Parameters
+    ----------
+    pages : iterable
+        Content of each page, e.g from iter_pages.
+    text_path : str
+
+    Returns
+    -------
+    offsets : list
+        Offset(in characters) in the txt at which each page starts.
+
+    '''
+    folder = os.path.dirname(text_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir = folder, prefix = '.', suffix = '.part')
+    offsets = []
+    position = 0
+    try:
+        with os.fdopen(fd, 'w', encoding = 'utf-8', newline = '') as f:
+            for page in pages:
+                offsets.append(position)
+                f.write(page)
+                position += len(page)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, text_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return offsets
+
+def count_pages(source, backend: str = 'auto'):
+    '''
+    Num of pages of a pdf file, without extracting any text.
+
+    '''
+    return get_backend(backend).count_pages(source)
+
+def page_ranges(num_page: int, num_parts: int):
+    '''
+    Split pages [0, num_page) into [num_parts] ranges of nearly equal length.
+
+    Returns
+    -------
+    list
+        A list of (start, end) tuples, in page order.
+
+    '''
+    num_parts = max(1, min(num_parts, num_page))
+    bounds = [num_page * i // num_parts for i in range(num_parts + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_parts)]
+
+def pdf2text(source, backend: str = 'auto'):
+    '''
+    Extract the text of a pdf file.
+
+    Parameters
+    ----------
+    source : str or bytes
+        Path to the pdf file, or its content already in memory.
+    backend : str, default 'auto'
+        Name of the pdf backend.
+
+    Returns
+    -------
+    text : str
+        Content of the file, with line breaks and symbols that cannot be
+        decoded by gbk removed.
+
+    '''
+    return ''.join(iter_pages(source, backend = backend))
+
+def extract_pages_split(file_path: str, executor, num_parts: int, num_page: int = None, backend: str = 'auto'):
+    '''
+    Extract the text of a large pdf file with its pages split across the
+    workers of [executor], reassembled in page order.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the pdf file; each worker opens the file itself.
+    executor : ProcessPoolExecutor
+    num_parts : int
+        Num of page ranges, usually the num of workers.
+    num_page : int, default None
+        Num of pages of the file, if already known.
+    backend : str, default 'auto'
+        Name of the pdf backend.
+
+    Returns
+    -------
+    pages : list
+        Content of each page, cleaned as in iter_pages.
+
+    '''
+    num_page = count_pages(file_path, backend) if num_page is None else num_page
+    futures = [executor.submit(extract_pages, file_path, start, end, backend)
+               for start, end in page_ranges(num_page, num_parts)]
+    return [page for future in futures for page in future.result()]
+
+def conversion_signature(backend: str):
+    '''
+    What a txt depends on besides its pdf: (backend, backend_version, options).
+
+    '''
+    backend = get_backend(backend)
+    return (backend.name, backend.version(), CLEAN_OPTIONS)
+
+def convert_to_file(source, text_path: str, backend: str = 'auto'):
+    '''
+    Extract the text of a pdf file and save it to [text_path]; run in the
+    worker processes of text_converter.
+
+    Returns
+    -------
+    offsets : list
+        Offset in the txt at which each page starts, as write_pages; None if
+        the text is not extracted and saved.
+
+    '''
+    try:
+        return write_pages(iter_pages(source, backend = backend), text_path)
+    except Exception as e:
+        print(f'Conversion FAILED {text_path}: {e}')
+        return None
+
+def convert_timed(file_path: str, text_path: str, split_pages: int = None, backend: str = 'auto'):
+    '''
+    Extract the text of a pdf file and save it to [text_path], timing the
+    conversion; run in the worker processes of My_pdf2txt.process_all.
+
+    Parameters
+    ----------
+    file_path : str
+    text_path : str
+    split_pages : int, default None
+        A file with more pages than this is not converted here; its num of
+        pages is returned instead, so that its pages can be split across
+        the workers.
+    backend : str, default 'auto'
+        Name of the pdf backend.
+
+    Returns
+    -------
+    success : bool
+        None if the file is left to be split.
+    seconds : float
+    error : str
+        None if succeeded.
+    num_page : int
+        Num of pages if the file is left to be split; None otherwise.
+    offsets : list
+        Offset in the txt at which each page starts; None if not converted.
+
+    '''
+    start = time.perf_counter()
+    try:
+        if split_pages is not None:
+            num_page = count_pages(file_path, backend)
+            if num_page > split_pages:
+                return None, time.perf_counter() - start, None, num_page, None
+        offsets = write_pages(iter_pages(file_path, backend = backend), text_path)
+    except Exception as e:
+        return False, time.perf_counter() - start, f'{type(e).__name__}: {e}', None, None
+    return True, time.perf_counter() - start, None, None, offsets
+
+def extract_timed(file_path: str, start: int, end: int, backend: str = 'auto'):
+    '''
+    extract_pages, timed; run in the worker processes of
+    My_pdf2txt.process_all for a part of a large file.
+
+    Returns
+    -------
+    pages : list
+    seconds : float
+
+    '''
+    begin = time.perf_counter()
+    pages = extract_pages(file_path, start, end, backend)
+    return pages, time.perf_counter() - begin
+
+class text_converter:
+    def __init__(self, workers: int = 2, backend: str = 'auto'):
+        '''
+        A pool of conversion worker processes, fed with pdf files downloaded
+        into memory, so that a pdf is converted without being written to and
+        read back from disk.
+
+        Parameters
+        ----------
+        workers : int, default 2
+            Num of worker processes.
+        backend : str, default 'auto'
+            Name of the pdf backend; the fastest one installed if 'auto'.
+
+        '''
+        self.backend = get_backend(backend).name
+        self.executor = ProcessPoolExecutor(max_workers = workers)
+    
+    def submit(self, data: bytes, text_path: str):
+        '''
+        Hand a pdf over to the workers; returns a future of convert_to_file.
+
+        '''
+        return self.executor.submit(convert_to_file, data, text_path, self.backend)
+    
+    def convert(self, data: bytes, text_path: str):
+        '''
+        Convert a pdf in a worker and wait for the result; callers running in
+        several threads keep all the workers busy.
+
+        Returns
+        -------
+        offsets : list
+            Offset in the txt at which each page starts; None if failed.
+
+        '''
+        try:
+            return self.submit(data, text_path).result()
+        except Exception as e:
+            # e.g. a worker killed by a malformed file
+            print(f'Conversion FAILED {text_path}: {e}')
+            return None
+    
+    def close(self):
+        self.executor.shutdown()
 
 class My_pdf2txt:
     def __init__(self,
@@ -56,11 +369,59 @@ class My_pdf2txt:
                  store_path: str,
                  summary_df_path: str,
                  identifier,
-                 identified):
+                 identified,
+                 store_root: str = None,
+                 split_pages: int = None,
+                 page_workers: int = 4,
+                 backend: str = 'auto',
+                 incremental: bool = True,
+                 manifest_path: str = None,
+                 use_hash: bool = False):
         
         self.pdf_file_path = pdf_file_path
         self.store_path = store_path
         
+        '''
+        Name of the pdf backend(see pdf_backends), resolved here so that all
+        the workers use the same one; the fastest one installed if 'auto'.
+        
+        '''
+        self.backend = get_backend(backend).name
+        self.signature = conversion_signature(self.backend)
+        
+        '''
+        If incremental, each txt written is recorded in a conversion_manifest
+        (manifest_path, [store_path]/.conversions.db by default) and a report
+        whose txt is still valid is not converted again: same pdf size and
+        mtime(or sha256 if use_hash), backend version and cleaning options.
+        
+        '''
+        self.manifest = None
+        if incremental:
+            os.makedirs(store_path, exist_ok = True)
+            manifest_path = manifest_path if manifest_path is not None else f'{store_path}/.conversions.db'
+            self.manifest = conversion_manifest(manifest_path, use_hash = use_hash)
+        
+        '''
+        A report with more pages than split_pages has its pages split across
+        page_workers processes and the text reassembled in page order, so
+        that one long annual report does not hold up a batch. No splitting
+        if split_pages is None.
+        
+        '''
+        self.split_pages = split_pages
+        self.page_workers = page_workers
+        self.page_executor = None
+        
+        '''
+        If the pdf files were downloaded into a report_store(store_root of the
+        crawler), a report shared by several fund codes is converted only once
+        and its txt is copied for the other codes. pdf_file_path should be the
+        same store_path passed to the crawler so that the paths match.
+        
+        '''
+        self.store = report_store(store_root) if store_root is not None else None
+        
         '''
         Extract observations whose 'identified' satisfies 'identifier', e.g 
         by setting:
@@ -78,9 +439,14 @@ class My_pdf2txt:
         self.summary_df['code'] = convert_num2code([code for code in self.summary_df['code'].values])
         self.code_list = list(self.summary_df['code'].drop_duplicates())
         
-    def process_single_file(self, code: str, file_name: str):
+    def process_single_file(self, code: str, file_name: str, return_text: bool = True):
         '''
         Convert a single pdf file to a string of content in the file.
+        
+        The pages are extracted, cleaned and written to the txt one at a
+        time, so the memory used by the conversion grows with a page rather
+        than the whole report; the offset at which each page starts is kept
+        in the manifest(see page_offsets).
 
         Parameters
         ----------
@@ -88,6 +454,9 @@ class My_pdf2txt:
             Fund code of the report.
         file_name : str
             File name of the report.
+        return_text : bool, default True
+            Whether to read the txt back and return it; None is returned
+            instead if False.
 
         Returns
         -------
@@ -98,33 +467,63 @@ class My_pdf2txt:
         
         # read pdf file as binary codes
         file_path = '/'.join([self.pdf_file_path,code, file_name])
-        pdf_file = open(file_path,'rb')
-        
-        # initialise PdfFileReader instance
-        pdf_reader = PyPDF2.PdfFileReader(pdf_file)
-        # get the num of pages in the file
-        num_page = pdf_reader.numPages
+        store_path = '/'.join([self.store_path, code, file_name.split('.')[0]])
         
-        # read the file content in iteration
-        text = ''
-        for page in range(num_page):
-            page_obj = pdf_reader.getPage(page)
-            text += page_obj.extractText().replace('\n', '')
+        # skip a report whose txt is still valid
+        if self.manifest is not None and self.manifest.is_fresh(file_path, store_path + '.txt', self.signature):
+            return self.read_text(store_path + '.txt') if return_text else None
         
-        pdf_file.close()
+        # reuse the txt of an identical report already converted
+        sha256 = self.store.lookup_path(file_path) if self.store is not None else None
+        if sha256 is not None:
+            text_path = self.store.get_text(sha256)
+            if text_path is not None:
+                shutil.copyfile(text_path, store_path + '.txt')
+                if self.manifest is not None:
+                    self.manifest.record(file_path, store_path + '.txt', self.signature, sha256,
+                                         self.manifest.page_offsets(text_path))
+                return self.read_text(store_path + '.txt') if return_text else None
         
-        # A series of encode-decoding procedures to insure the content can be decoded by utf-8
-        # meaningless symbols removed in this step
-        text = text.encode('gbk',errors='ignore').decode('gbk').encode('utf-8').decode('utf-8')
+        # split the pages of a long report across the page workers
+        num_page = count_pages(file_path, self.backend) if self.split_pages is not None else None
+        if num_page is not None and num_page > self.split_pages:
+            if self.page_executor is None:
+                self.page_executor = ProcessPoolExecutor(max_workers = self.page_workers)
+            pages = extract_pages_split(file_path, self.page_executor, self.page_workers, num_page, self.backend)
+        else:
+            pages = iter_pages(file_path, backend = self.backend)
         
         # save the txt file to the folder named as the fund code
-        store_path = '/'.join([self.store_path, code, file_name.split('.')[0]])
         try:
-            with open(store_path + '.txt', 'w', encoding = 'utf-8') as f:
-                f.write(text)
-        except UnicodeEncodeError: text = 'UnicodeEncodeError'
+            offsets = write_pages(pages, store_path + '.txt')
+        except UnicodeEncodeError: return 'UnicodeEncodeError'
         
-        return text
+        if sha256 is not None:
+            self.store.set_text(sha256, store_path + '.txt')
+        if self.manifest is not None:
+            self.manifest.record(file_path, store_path + '.txt', self.signature, sha256, offsets)
+        
+        return self.read_text(store_path + '.txt') if return_text else None
+    
+    @staticmethod
+    def read_text(text_path: str):
+        with open(text_path, 'r', encoding = 'utf-8') as f:
+            return f.read()
+    
+    def page_offsets(self, code: str, file_name: str):
+        '''
+        Offsets(in characters) at which the pages of a converted report start
+        in its txt.
+
+        Returns
+        -------
+        offsets : list
+            None if not recorded, e.g not incremental.
+
+        '''
+        if self.manifest is None:
+            return None
+        return self.manifest.page_offsets('/'.join([self.store_path, code, file_name.split('.')[0]]) + '.txt')
     
     def process_single_code(self, code:str):
         '''
@@ -160,7 +559,7 @@ class My_pdf2txt:
             formt = file.split('.')[1]
             if formt == 'pdf':
                 try:
-                    text = self.process_single_file(code, file)
+                    text = self.process_single_file(code, file, return_text = False)
                 except: continue
                 
                 if text == 'UnicodeEncodeError':
@@ -168,6 +567,219 @@ class My_pdf2txt:
             
             extract_suc.append(esuc)
         return extract_suc
+    
+    def list_files(self, code_list: list = None):
+        '''
+        List the pdf files of the funds in [code_list] to be converted, with
+        their sizes.
+
+        Parameters
+        ----------
+        code_list : list, default None
+            Fund codes; all the codes in the summary if None.
+
+        Returns
+        -------
+        files : list
+            A list of (code, file_name, size) tuples.
+
+        '''
+        code_list = self.code_list if code_list is None else code_list
+        files = []
+        for code in code_list:
+            code_file_list = set(self.summary_df.loc[self.summary_df['code'] == code, 'file_name'].values)
+            code_path = f'{self.pdf_file_path}/{code}'
+            if not os.path.exists(code_path): continue
+            
+            for file in os.listdir(code_path):
+                if file not in code_file_list or file.split('.')[1] != 'pdf': continue
+                files.append((code, file, os.path.getsize(f'{code_path}/{file}')))
+        return files
+    
+    def process_all(self, jobs: int = 4, code_list: list = None):
+        '''
+        Convert the reports of all the funds on a pool of worker processes.
+        
+        Files rather than funds are handed out, largest first, and each
+        worker takes the next file as soon as it is free, so a few long
+        annual reports do not leave the other workers idle at the end. A
+        file with more pages than split_pages is further split into [jobs]
+        page ranges converted by all the workers.
+
+        Parameters
+        ----------
+        jobs : int, default 4
+            Num of worker processes.
+        code_list : list, default None
+            Fund codes to be processed; all the codes in the summary if None.
+
+        Returns
+        -------
+        output : pd.DataFrame
+            One row per file, with columns code, file_name, size, success,
+            seconds, error and cached; seconds is 0 for a txt copied from the
+            report_store, and the sum over the parts for a split file; cached
+            is True for a txt still valid from a previous run, which is not
+            converted again.
+
+        '''
+        files = self.list_files(code_list)
+        files.sort(key = lambda x: x[2], reverse = True)
+        for code in set(code for code, _, _ in files):
+            os.makedirs(f'{self.store_path}/{code}', exist_ok = True)
+        
+        records = []
+        def record(code, file, sha256, store_path, offsets):
+            if self.manifest is not None:
+                self.manifest.record('/'.join([self.pdf_file_path, code, file]), store_path, self.signature,
+                                     sha256, offsets)
+        
+        # identical reports in the store: convert the first, copy for the others
+        pending_copies = {}
+        def copy_text(code, file, size, text_path, sha256):
+            store_path = '/'.join([self.store_path, code, file.split('.')[0]]) + '.txt'
+            try:
+                shutil.copyfile(text_path, store_path)
+                offsets = self.manifest.page_offsets(text_path) if self.manifest is not None else None
+                record(code, file, sha256, store_path, offsets)
+                records.append((code, file, size, True, 0.0, None, False))
+            except OSError as e:
+                records.append((code, file, size, False, 0.0, f'{type(e).__name__}: {e}', False))
+        
+        executor = ProcessPoolExecutor(max_workers = jobs)
+        # future -> (code, file, size, sha256, store_path), or, for a part of
+        # a split file, -> (key of the file in splits, index of the part)
+        futures = {}
+        splits = {}
+        
+        def finish(job, success, seconds, error, offsets):
+            code, file, size, sha256, store_path = job
+            records.append((code, file, size, success, seconds, error, False))
+            pbar.update(1)
+            if success:
+                record(code, file, sha256, store_path, offsets)
+            
+            if sha256 is None: return
+            if success:
+                self.store.set_text(sha256, store_path)
+                for copy in pending_copies.pop(sha256, []):
+                    copy_text(*copy, store_path, sha256)
+                    pbar.update(1)
+            else:
+                # convert the next copy instead
+                copies = pending_copies.pop(sha256, [])
+                if len(copies) > 0:
+                    submit(*copies[0], sha256)
+                    pending_copies[sha256] = copies[1:]
+        
+        def split(job, seconds, num_page):
+            # hand the page ranges of a long file to all the workers
+            file_path = '/'.join([self.pdf_file_path, job[0], job[1]])
+            ranges = page_ranges(num_page, jobs)
+            splits[file_path] = {'job': job, 'parts': [None] * len(ranges),
+                                 'left': len(ranges), 'seconds': seconds, 'error': None}
+            for idx, (start, end) in enumerate(ranges):
+                future = executor.submit(extract_timed, file_path, start, end, self.backend)
+                futures[future] = (file_path, idx)
+        
+        def collect_part(future, key, idx):
+            state = splits[key]
+            try:
+                state['parts'][idx], seconds = future.result()
+                state['seconds'] += seconds
+            except Exception as e:
+                state['error'] = f'{type(e).__name__}: {e}'
+            state['left'] -= 1
+            if state['left'] > 0: return
+            
+            # all parts are back: write their pages in page order
+            del splits[key]
+            error, offsets = state['error'], None
+            if error is None:
+                try:
+                    offsets = write_pages((page for part in state['parts'] for page in part), state['job'][4])
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'
+            finish(state['job'], error is None, state['seconds'], error, offsets)
+        
+        def collect(done):
+            for future in done:
+                job = futures.pop(future)
+                if len(job) == 2:
+                    collect_part(future, *job)
+                    continue
+                
+                try:
+                    success, seconds, error, num_page, offsets = future.result()
+                except Exception as e:
+                    # e.g. a worker killed by a malformed file
+                    success, seconds, error, num_page, offsets = False, 0.0, f'{type(e).__name__}: {e}', None, None
+                if success is None:
+                    split(job, seconds, num_page)
+                else:
+                    finish(job, success, seconds, error, offsets)
+        
+        def submit(code, file, size, sha256):
+            file_path = '/'.join([self.pdf_file_path, code, file])
+            store_path = '/'.join([self.store_path, code, file.split('.')[0]]) + '.txt'
+            future = executor.submit(convert_timed, file_path, store_path, self.split_pages, self.backend)
+            futures[future] = (code, file, size, sha256, store_path)
+        
+        pbar = tqdm(total = len(files))
+        try:
+            for code, file, size in files:
+                file_path = '/'.join([self.pdf_file_path, code, file])
+                # skip a report whose txt is still valid
+                store_path = '/'.join([self.store_path, code, file.split('.')[0]]) + '.txt'
+                if self.manifest is not None and self.manifest.is_fresh(file_path, store_path, self.signature):
+                    records.append((code, file, size, True, 0.0, None, True))
+                    pbar.update(1)
+                    continue
+                
+                sha256 = self.store.lookup_path(file_path) if self.store is not None else None
+                if sha256 is not None:
+                    text_path = self.store.get_text(sha256)
+                    if text_path is not None:
+                        copy_text(code, file, size, text_path, sha256)
+                        pbar.update(1)
+                        continue
+                    if sha256 in pending_copies:
+                        pending_copies[sha256].append((code, file, size))
+                        continue
+                    pending_copies[sha256] = []
+                
+                submit(code, file, size, sha256)
+                # keep a few files queued per worker, so the next is ready
+                # as soon as one is free
+                while len(futures) >= jobs * 4:
+                    done, _ = wait(list(futures), return_when = FIRST_COMPLETED)
+                    collect(done)
+            
+            while len(futures) > 0:
+                done, _ = wait(list(futures), return_when = FIRST_COMPLETED)
+                collect(done)
+        finally:
+            executor.shutdown()
+            pbar.close()
+        
+        output = pd.DataFrame(records, columns = ['code', 'file_name', 'size', 'success', 'seconds', 'error', 'cached'])
+        n_failed = len(output) - int(output['success'].sum()) if len(output) > 0 else 0
+        n_cached = int(output['cached'].sum()) if len(output) > 0 else 0
+        print(f'Converted {len(output) - n_failed - n_cached} file(s), {n_cached} still valid, {n_failed} FAILED, '
+              f'{output["seconds"].sum():.1f}s of work')
+        return output
+    
+    def close(self):
+        '''
+        Shut down the page workers, if started, and close the manifest.
+
+        '''
+        if self.page_executor is not None:
+            self.page_executor.shutdown()
+            self.page_executor = None
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
           
 if __name__ == '__main__':
     path_cninf = 'F:/eastmoney/CNINF'
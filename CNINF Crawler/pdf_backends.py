@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Text extraction backends for pdf2txt, so that the conversion uses the fastest
+extractor installed on the machine instead of PyPDF2 only.
+
+Backends, in order of preference when 'auto' is asked for:
+    - pypdfium2: bindings to PDFium, the pdf engine of Chrome;
+    - pdftotext: the command line tool of poppler, run in a subprocess;
+    - pdfminer:  pdfminer.six, pure Python;
+    - pypdf2:    PyPDF2, the original extractor and the fallback.
+
+Each backend counts the pages of a pdf and extracts the text of a range of
+pages, from a path or from the content in memory. iter_pages yields the text
+one page at a time, so that a caller writing it out holds a single page.
+Backends produce different spacing and line breaks for the same page;
+benchmark_pdf compares their speed and how far their output agrees.
+
+CONTENTS
+--------
+- <CLASS> pdf_backend
+- <CLASS> pypdf2_backend
+- <CLASS> pdfminer_backend
+- <CLASS> pypdfium2_backend
+- <CLASS> pdftotext_backend
+- <FUNC> available_backends
+- <FUNC> get_backend
+
+'''
+import importlib.metadata
+import importlib.util
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from abc import ABC, abstractmethod
+
+class pdf_backend(ABC):
+    '''
+    Interface of a backend; a subclass sets [name], the [module] it imports
+    and the [distribution] installing it, and implements count_pages and
+    iter_pages.
+
+    '''
+    name = None
+    module = None
+    distribution = None
+
+    @classmethod
+    def available(cls):
+        '''
+        Whether the backend is installed
+
+        '''
+        return importlib.util.find_spec(cls.module) is not None
+
+    def version(self):
+        '''
+        Version of the extractor, recorded with the converted files
+
+        '''
+        try:
+            return importlib.metadata.version(self.distribution)
+        except importlib.metadata.PackageNotFoundError:
+            return 'unknown'
+
+    @abstractmethod
+    def count_pages(self, source):
+        '''
+        Num of pages of a pdf file
+
+        Parameters
+        ----------
+        source: str or bytes
+            Path to the pdf file, or its content already in memory
+
+        '''
+
+    @abstractmethod
+    def iter_pages(self, source, start: int = 0, end: int = None):
+        '''
+        Extract the text of pages [start, end) of a pdf file, one page at a
+        time
+
+        Parameters
+        ----------
+        source: str or bytes
+            Path to the pdf file, or its content already in memory
+        start: int, default 0
+            First page
+        end: int, default None
+            Page after the last; to the last page if None
+
+        Yields
+        ------
+        text: str
+            Text of a page, in page order
+
+        '''
+
+    def extract_pages(self, source, start: int = 0, end: int = None):
+        '''
+        Extract the text of pages [start, end) of a pdf file
+
+        Returns
+        -------
+        pages: list
+            Text of each page, in page order
+
+        '''
+        return list(self.iter_pages(source, start, end))
+
+    def __repr__(self):
+        return f'{self.name} backend'
+
+def _open(source):
+    return open(source, 'rb') if isinstance(source, str) else io.BytesIO(source)
+
+class pypdf2_backend(pdf_backend):
+    name = 'pypdf2'
+    module = 'PyPDF2'
+    distribution = 'PyPDF2'
+
+    def __init__(self):
+        import PyPDF2
+        self.PyPDF2 = PyPDF2
+
+    def count_pages(self, source):
+        with _open(source) as pdf_file:
+            return self.PyPDF2.PdfFileReader(pdf_file).numPages
+
+    def iter_pages(self, source, start: int = 0, end: int = None):
+        with _open(source) as pdf_file:
+            pdf_reader = self.PyPDF2.PdfFileReader(pdf_file)
+            num_page = pdf_reader.numPages
+            end = num_page if end is None else min(end, num_page)
+            for page in range(start, end):
+                yield pdf_reader.getPage(page).extractText()
+
+class pdfminer_backend(pdf_backend):
+    name = 'pdfminer'
+    module = 'pdfminer'
+    distribution = 'pdfminer.six'
+
+    def __init__(self):
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        from pdfminer.pdfpage import PDFPage
+        self._extract_pages = extract_pages
+        self.LTTextContainer = LTTextContainer
+        self.PDFPage = PDFPage
+
+    def count_pages(self, source):
+        with _open(source) as pdf_file:
+            return sum(1 for _ in self.PDFPage.get_pages(pdf_file))
+
+    def iter_pages(self, source, start: int = 0, end: int = None):
+        with _open(source) as pdf_file:
+            if end is None:
+                end = sum(1 for _ in self.PDFPage.get_pages(pdf_file))
+                pdf_file.seek(0)
+            for layout in self._extract_pages(pdf_file, page_numbers = range(start, end)):
+                yield ''.join(element.get_text() for element in layout
+                              if isinstance(element, self.LTTextContainer))
+
+class pypdfium2_backend(pdf_backend):
+    name = 'pypdfium2'
+    module = 'pypdfium2'
+    distribution = 'pypdfium2'
+
+    def __init__(self):
+        import pypdfium2
+        self.pdfium = pypdfium2
+
+    def count_pages(self, source):
+        pdf = self.pdfium.PdfDocument(source)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def iter_pages(self, source, start: int = 0, end: int = None):
+        pdf = self.pdfium.PdfDocument(source)
+        try:
+            end = len(pdf) if end is None else min(end, len(pdf))
+            for idx in range(start, end):
+                page = pdf[idx]
+                text_page = page.get_textpage()
+                text = text_page.get_text_range()
+                text_page.close()
+                page.close()
+                yield text
+        finally:
+            pdf.close()
+
+class pdftotext_backend(pdf_backend):
+    '''
+    poppler's pdftotext, run in a subprocess; pdfinfo of poppler is used to
+    count the pages. Content in memory is written to a temporary file first.
+    The pages of a range come back from one run, so iter_pages holds them
+    all.
+
+    '''
+    name = 'pdftotext'
+    module = None
+
+    @classmethod
+    def available(cls):
+        return shutil.which('pdftotext') is not None and shutil.which('pdfinfo') is not None
+
+    def version(self):
+        output = subprocess.run(['pdftotext', '-v'], capture_output = True, text = True)
+        found = re.search(r'[0-9]+\.[0-9]+\.[0-9]+', output.stdout + output.stderr)
+        return found.group() if found else 'unknown'
+
+    def _run(self, func, source):
+        if isinstance(source, str):
+            return func(source)
+        fd, temp_path = tempfile.mkstemp(suffix = '.pdf')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(source)
+            return func(temp_path)
+        finally:
+            os.remove(temp_path)
+
+    def count_pages(self, source):
+        def count(file_path):
+            output = subprocess.run(['pdfinfo', file_path], capture_output = True, check = True)
+            found = re.search(rb'^Pages:\s+([0-9]+)', output.stdout, re.M)
+            if found is None:
+                raise ValueError(f'pdfinfo cannot read {file_path}')
+            return int(found.group(1))
+
+        return self._run(count, source)
+
+    def extract_pages(self, source, start: int = 0, end: int = None):
+        def extract(file_path):
+            last = end if end is not None else self.count_pages(file_path)
+            if last <= start:
+                return []
+            # pages are 1-based and ended by a form feed
+            output = subprocess.run(['pdftotext', '-enc', 'UTF-8', '-f', str(start + 1), '-l', str(last),
+                                     file_path, '-'], capture_output = True, check = True)
+            pages = output.stdout.decode('utf-8', errors = 'ignore').split('\f')
+            return pages[:last - start]
+
+        return self._run(extract, source)
+
+    def iter_pages(self, source, start: int = 0, end: int = None):
+        yield from self.extract_pages(source, start, end)
+
+BACKENDS = {'pypdfium2': pypdfium2_backend,
+            'pdftotext': pdftotext_backend,
+            'pdfminer': pdfminer_backend,
+            'pypdf2': pypdf2_backend}
+
+_instances = {}
+
+def available_backends():
+    '''
+    Names of the backends installed, in order of preference
+
+    '''
+    return [name for name, backend in BACKENDS.items() if backend.available()]
+
+def get_backend(name: str = 'auto'):
+    '''
+    Get a backend by name; 'auto' for the first one installed
+
+    Parameters
+    ----------
+    name: str, default 'auto'
+        One of 'auto', 'pypdfium2', 'pdftotext', 'pdfminer' and 'pypdf2'
+
+    Returns
+    -------
+    pdf_backend
+
+    '''
+    if name == 'auto':
+        installed = available_backends()
+        if len(installed) == 0:
+            raise ImportError(f'no pdf backend installed; install one of {list(BACKENDS)}')
+        name = installed[0]
+    if name not in BACKENDS:
+        raise ValueError(f'unknown pdf backend {name}; choose from {list(BACKENDS)}')
+
+    if name not in _instances:
+        if not BACKENDS[name].available():
+            raise ImportError(f'pdf backend {name} is not installed')
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
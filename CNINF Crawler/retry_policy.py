@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A retry policy shared by the orgId finder and the announcement queries, so
+that a flaky response costs a retry instead of a multi-hour batch.
+
+Errors are classified as:
+    - retryable: network errors and timeouts(OSError, which includes the
+      exceptions of requests), throttled responses and bodies that cannot be
+      parsed(RetryableError);
+    - fatal: anything else, e.g a key that does not exist(FatalError), a
+      request that is malformed(e.g requests' MissingSchema or InvalidURL,
+      OSErrors too), or a bug; raised at once.
+Retryable errors are retried with exponential backoff and full jitter, i.e. a
+random sleep between 0 and base_delay * 2**attempt, capped at max_delay, so
+that the workers of a pool do not retry in lockstep.
+
+A circuit_breaker may be shared by all workers calling the same upstream.
+After [failure_threshold] consecutive retryable failures it opens, and every
+worker waiting on it pauses until [reset_timeout] has passed. It is then half
+open: a single call goes through as a probe while the others keep waiting; the
+probe closes the circuit on success or opens it again for twice as long on
+failure. Failures of calls sent before the circuit opened do not count again.
+The pool thus slows down while the upstream is failing and picks up again when
+it recovers.
+
+The time spent in the backoff sleeps and waiting on the circuit is kept by the
+policy(time_waited), and counted as sleeping time by crawl_metrics.
+
+CONTENTS
+--------
+- <CLASS> RetryableError
+- <CLASS> FatalError
+- <FUNC> is_retryable
+- <CLASS> circuit_breaker
+- <CLASS> retry_policy
+
+'''
+import random
+import threading
+import time
+from requests.exceptions import InvalidHeader, InvalidSchema, InvalidURL, MissingSchema, URLRequired
+
+# requests raises these before sending anything; sending again fails the same way
+INVALID_REQUEST = (InvalidHeader, InvalidSchema, InvalidURL, MissingSchema, URLRequired)
+
+class RetryableError(ConnectionError):
+    '''
+    A transient failure, e.g a throttled response or a body that is not json;
+    a ConnectionError, so callers catching it keep working when retries run out
+
+    '''
+
+class FatalError(Exception):
+    '''
+    A failure that retrying cannot fix
+
+    '''
+
+def is_retryable(e: Exception):
+    '''
+    A func to tell whether an error is worth retrying
+
+    Parameters
+    ----------
+    e: Exception
+
+    Returns
+    -------
+    bool
+
+    '''
+    if isinstance(e, (FatalError,) + INVALID_REQUEST):
+        return False
+    # requests.RequestException is an IOError(OSError)
+    return isinstance(e, (RetryableError, OSError, TimeoutError))
+
+class circuit_breaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half open'
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 60.0,
+                 max_timeout: float = 1800.0,
+                 name: str = 'circuit'):
+        '''
+        Parameters
+        ----------
+        failure_threshold: int, default 5
+            Num of consecutive failures opening the circuit
+        reset_timeout: float, default 60.0
+            Seconds the circuit stays open the first time; doubled each time
+            a probe fails
+        max_timeout: float, default 1800.0
+            Upper bound of the time the circuit stays open
+        name: str, default 'circuit'
+            Name shown when printing
+
+        '''
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.name = name
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.n_opened = 0
+        self.open_until = 0.0
+        self.timeout = reset_timeout
+        # thread sending the probe while half open, and since when; a probe
+        # silent for longer than the timeout is taken over by another caller
+        self.prober = None
+        self.probe_since = 0.0
+        self._cond = threading.Condition()
+
+    def wait(self):
+        '''
+        Block while the circuit is open, or half open with a probe in flight.
+        The first caller after the timeout becomes the probe.
+
+        Returns
+        -------
+        waited: float
+            Seconds spent waiting
+
+        '''
+        waited = 0.0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.state == self.CLOSED:
+                    break
+                if self.state == self.HALF_OPEN and self.prober == threading.get_ident():
+                    break
+                if (self.state == self.OPEN and now >= self.open_until) or \
+                   (self.state == self.HALF_OPEN and now >= self.probe_since + self.timeout):
+                    self.state = self.HALF_OPEN
+                    self.prober = threading.get_ident()
+                    self.probe_since = now
+                    break
+                # woken up early when the probe ends
+                deadline = self.open_until if self.state == self.OPEN else self.probe_since + self.timeout
+                self._cond.wait(deadline - now)
+                waited += time.monotonic() - now
+        return waited
+
+    def record_success(self):
+        with self._cond:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.timeout = self.reset_timeout
+            self.prober = None
+            self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            if self.state == self.HALF_OPEN:
+                # only the probe decides; calls sent before the circuit opened do not count
+                if self.prober != threading.get_ident():
+                    return
+                # a failing probe keeps it open for twice as long
+                self.timeout = min(self.max_timeout, self.timeout * 2)
+            elif self.state == self.OPEN:
+                return
+            else:
+                self.failures += 1
+                if self.failures < self.failure_threshold:
+                    return
+            timeout = self.timeout
+            self.state = self.OPEN
+            self.open_until = time.monotonic() + timeout
+            self.prober = None
+            self.n_opened += 1
+            self._cond.notify_all()
+
+        print(f'{self.name} open: upstream failing, all workers pause for {timeout:.0f}s')
+
+    def release(self):
+        '''
+        Give up the probe without a verdict(e.g it failed with a fatal error),
+        so that the next caller probes instead
+
+        '''
+        with self._cond:
+            if self.state == self.HALF_OPEN and self.prober == threading.get_ident():
+                self.state = self.OPEN
+                self.open_until = time.monotonic()
+                self.prober = None
+                self._cond.notify_all()
+
+    @property
+    def is_open(self):
+        with self._cond:
+            return self.state != self.CLOSED
+
+    def __repr__(self):
+        with self._cond:
+            return f'{self.name}: {self.state}'
+
+class retry_policy:
+    def __init__(self,
+                 max_tries: int = 5,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0,
+                 breaker: circuit_breaker = None,
+                 classify = is_retryable,
+                 name: str = 'retry'):
+        '''
+        Parameters
+        ----------
+        max_tries: int, default 5
+            Max num of calls, including the first one
+        base_delay: float, default 1.0
+            Cap(in seconds) of the random sleep before the first retry;
+            doubled for every further retry
+        max_delay: float, default 60.0
+            Upper bound of the cap
+        breaker: circuit_breaker, default None
+            Circuit shared by the workers calling the same upstream
+        classify: func, default is_retryable
+            Tells whether an exception is retryable
+        name: str, default 'retry'
+            Name shown when printing
+
+        '''
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.classify = classify
+        self.name = name
+
+        # some stats
+        self.n_calls = 0
+        self.n_retries = 0
+        self.n_fatal = 0
+        self.n_exhausted = 0
+        # seconds slept before retries and waiting on the circuit
+        self.time_waited = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt: int):
+        '''
+        Jittered sleep before retry [attempt](starting from 0)
+
+        '''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, max_tries: int = None, **kwargs):
+        '''
+        Call func(*args, **kwargs) under the policy
+
+        Parameters
+        ----------
+        func: callable
+        max_tries: int, default None
+            Overrides the max num of calls of the policy
+
+        Returns
+        -------
+        The output of func; the last error is raised if it is fatal or the
+        tries run out
+
+        '''
+        max_tries = max_tries if max_tries is not None else self.max_tries
+        with self._lock:
+            self.n_calls += 1
+
+        for attempt in range(max_tries):
+            if self.breaker is not None:
+                waited = self.breaker.wait()
+                with self._lock:
+                    self.time_waited += waited
+            try:
+                output = func(*args, **kwargs)
+            except Exception as e:
+                if not self.classify(e):
+                    with self._lock:
+                        self.n_fatal += 1
+                    if self.breaker is not None:
+                        self.breaker.release()
+                    raise
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                if attempt == max_tries - 1:
+                    with self._lock:
+                        self.n_exhausted += 1
+                    raise
+
+                delay = self.delay(attempt)
+                with self._lock:
+                    self.n_retries += 1
+                    self.time_waited += delay
+                print(f'{self.name}: {type(e).__name__}: {e}; retry {attempt + 1}/{max_tries - 1} in {delay:.1f}s')
+                time.sleep(delay)
+                continue
+
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return output
+
+    def stats(self):
+        with self._lock:
+            return {'name': self.name,
+                    'n_calls': self.n_calls,
+                    'n_retries': self.n_retries,
+                    'n_fatal': self.n_fatal,
+                    'n_exhausted': self.n_exhausted,
+                    'time_waited': self.time_waited,
+                    'circuit_opened': self.breaker.n_opened if self.breaker is not None else 0}
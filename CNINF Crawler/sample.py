@@ -5,8 +5,12 @@ Test & sample usage of the crawler modules
 '''
 from cninf_orgid import cninf_orgid_finder
 from cninf_crawler import cninf_crawler
+from cninf_session import session_pool
 
-finder = cninf_orgid_finder()
+# share keep-alive connections between the finder and the crawler
+session = session_pool(pool_maxsize = 10, 
+                       host_limits = {'static.cninfo.com.cn': 4})
+finder = cninf_orgid_finder(session = session)
 
 '''
 Find the orgID for the fund '华夏成长'(000001) using:
@@ -44,7 +48,7 @@ The orgID is already known: jjjl0000031
 target_weblink = 'http://static.cninfo.com.cn/'
 store_path = 'F:/eastmoney/test'
 code2orgid_dict_path = 'F:/eastmoney/cninf_orgid_dict.xlsx'
-crawler = cninf_crawler(code2orgid_dict_path, target_weblink)
+crawler = cninf_crawler(code2orgid_dict_path, target_weblink, session = session)
 
 fund_reports = crawler.crawl_single_fund('000001', '2020-01-01', '2022-01-01', 
                                          'all', 'fund', True)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A work queue of fund codes shared by crawler processes on several hosts, so
+that each egress IP gets its own share of the rate limit and throughput grows
+with the num of nodes.
+
+The queue is a SQLite file on a shared file system(or on a local disk, for
+several processes on one host). A node claims codes inside an exclusive
+transaction(BEGIN IMMEDIATE), so no code is handed out twice. Every claim is
+a lease: the node renews the leases of the codes it holds from a heartbeat
+thread, and a code whose lease has expired(the node died or lost the share)
+is handed out again. A code failing [max_attempts] times is parked as failed.
+
+The rollback journal is used instead of WAL, since WAL needs shared memory
+and does not work across hosts. Leases compare the clocks of different hosts;
+keep them synchronised(NTP) and the lease much longer than any clock skew.
+
+CONTENTS
+--------
+- <CLASS> work_queue
+
+'''
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+class work_queue:
+    def __init__(self,
+                 db_path: str,
+                 lease_seconds: float = 900.0,
+                 max_attempts: int = 3,
+                 worker_id: str = None,
+                 busy_timeout: float = 60.0):
+        '''
+        Parameters
+        ----------
+        db_path: str
+            Path to the SQLite file, e.g on an NFS/SMB share; created if not exists
+        lease_seconds: float, default 900.0
+            How long a claimed code stays with a node without being renewed
+        max_attempts: int, default 3
+            Num of claims after which a failing code is parked as failed
+        worker_id: str, default None
+            Name of this node in the queue; hostname-pid-random if None
+        busy_timeout: float, default 60.0
+            Seconds to wait for the lock of the file held by another node
+
+        '''
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id if worker_id is not None else \
+            f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+        # autocommit mode; transactions are opened explicitly
+        self.conn = sqlite3.connect(db_path, timeout = busy_timeout, check_same_thread = False,
+                                    isolation_level = None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute('PRAGMA journal_mode=DELETE')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                    code TEXT PRIMARY KEY,
+                                    status TEXT,
+                                    worker TEXT,
+                                    lease_until REAL,
+                                    attempts INTEGER DEFAULT 0,
+                                    last_error TEXT,
+                                    updated_at REAL)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, lease_until)')
+
+        # codes held by this node, renewed by the heartbeat; shared by the
+        # crawling threads and the heartbeat
+        self.held = set()
+        self._held_lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    def _write(self, func):
+        '''
+        Run func(conn) in an exclusive transaction
+
+        '''
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                output = func(self.conn)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return output
+
+    def add(self, codes: list):
+        '''
+        Add codes to the queue; codes already in it keep their status
+
+        Returns
+        -------
+        output: int
+            Num of codes added
+
+        '''
+        now = time.time()
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO jobs (code, status, attempts, updated_at) VALUES (?, ?, 0, ?)',
+                             [(code, PENDING, now) for code in codes])
+            return conn.total_changes - before
+
+        return self._write(insert)
+
+    def claim(self, n: int = 1):
+        '''
+        Claim up to [n] codes: pending ones first, then those whose lease has
+        expired
+
+        Returns
+        -------
+        codes: list
+            The codes claimed; empty if nothing is left to claim
+
+        '''
+        now = time.time()
+        def take(conn):
+            rows = conn.execute('''SELECT code FROM jobs
+                                   WHERE status = ? OR (status = ? AND lease_until < ?)
+                                   ORDER BY attempts, code LIMIT ?''',
+                                (PENDING, LEASED, now, n)).fetchall()
+            codes = [row[0] for row in rows]
+            conn.executemany('''UPDATE jobs SET status = ?, worker = ?, lease_until = ?,
+                                attempts = attempts + 1, updated_at = ? WHERE code = ?''',
+                             [(LEASED, self.worker_id, now + self.lease_seconds, now, code) for code in codes])
+            return codes
+
+        codes = self._write(take)
+        if len(codes) > 0:
+            with self._held_lock:
+                self.held.update(codes)
+                self._start_heartbeat()
+        return codes
+
+    def renew(self):
+        '''
+        Extend the leases of the codes held by this node
+
+        Returns
+        -------
+        lost: list
+            Codes no longer leased to this node(the lease expired and another
+            node took them)
+
+        '''
+        with self._held_lock:
+            codes = list(self.held)
+        if len(codes) == 0:
+            return []
+
+        now = time.time()
+        def extend(conn):
+            lost = []
+            for code in codes:
+                cursor = conn.execute('''UPDATE jobs SET lease_until = ?, updated_at = ?
+                                         WHERE code = ? AND worker = ? AND status = ?''',
+                                      (now + self.lease_seconds, now, code, self.worker_id, LEASED))
+                if cursor.rowcount == 0:
+                    lost.append(code)
+            return lost
+
+        lost = self._write(extend)
+        with self._held_lock:
+            self.held.difference_update(lost)
+        return lost
+
+    def complete(self, code: str):
+        '''
+        Mark a code claimed by this node as done
+
+        '''
+        self._finish(code, DONE, None)
+
+    def fail(self, code: str, error: str = None):
+        '''
+        Give a code back after a failure; it is parked as failed after
+        [max_attempts] claims
+
+        '''
+        self._finish(code, None, error)
+
+    def release(self, code: str):
+        '''
+        Give a code back without counting the claim as an attempt, e.g when
+        the node shuts down
+
+        '''
+        now = time.time()
+        def give_back(conn):
+            conn.execute('''UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL,
+                            attempts = MAX(attempts - 1, 0), updated_at = ?
+                            WHERE code = ? AND worker = ? AND status = ?''',
+                         (PENDING, now, code, self.worker_id, LEASED))
+
+        self._write(give_back)
+        with self._held_lock:
+            self.held.discard(code)
+
+    def _finish(self, code: str, status: str, error: str):
+        now = time.time()
+        def finish(conn):
+            if status is None:
+                row = conn.execute('SELECT attempts FROM jobs WHERE code = ?', (code,)).fetchone()
+                new_status = FAILED if row is not None and row[0] >= self.max_attempts else PENDING
+            else:
+                new_status = status
+            conn.execute('''UPDATE jobs SET status = ?, lease_until = NULL, last_error = ?, updated_at = ?
+                            WHERE code = ? AND worker = ?''',
+                         (new_status, error, now, code, self.worker_id))
+
+        self._write(finish)
+        with self._held_lock:
+            self.held.discard(code)
+
+    def retry_failed(self):
+        '''
+        Put the codes parked as failed back to pending
+
+        '''
+        now = time.time()
+        def reset(conn):
+            return conn.execute('UPDATE jobs SET status = ?, attempts = 0, updated_at = ? WHERE status = ?',
+                                (PENDING, now, FAILED)).rowcount
+
+        return self._write(reset)
+
+    def stats(self):
+        '''
+        Num of codes by status; leases expired are counted as pending
+
+        Returns
+        -------
+        dict
+
+        '''
+        now = time.time()
+        with self._lock:
+            rows = self.conn.execute('''SELECT CASE WHEN status = ? AND lease_until < ? THEN ? ELSE status END,
+                                        COUNT(*) FROM jobs GROUP BY 1''',
+                                     (LEASED, now, PENDING)).fetchall()
+            workers = self.conn.execute('SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = ? AND lease_until >= ?',
+                                        (LEASED, now)).fetchone()[0]
+        output = dict((status, 0) for status in [PENDING, LEASED, DONE, FAILED])
+        output.update(dict(rows))
+        output['active_workers'] = workers
+        return output
+
+    def _start_heartbeat(self):
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+
+        def beat():
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    lost = self.renew()
+                except sqlite3.Error as e:
+                    print(f'Lease renewal FAILED: {e}')
+                    continue
+                if len(lost) > 0:
+                    print(f'Lease lost: {lost}')
+
+        self._heartbeat = threading.Thread(target = beat, daemon = True)
+        self._heartbeat.start()
+
+    def close(self):
+        '''
+        Stop the heartbeat and give back the codes still held
+
+        '''
+        self._stop.set()
+        with self._held_lock:
+            codes = list(self.held)
+        for code in codes:
+            self.release(code)
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,17 +1,60 @@
 import requests
 import json
-import time
 import xlrd
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# report_index lives next to this file, which may be loaded from elsewhere(e.g. by the benchmark);
+# the modules shared with the CNINF crawler are in crawl_common, see `pip install -e .` at the root
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from crawl_common.rate_limiter import aimd_limiter
+from crawl_common.atomic_download import stream_download, revalidate, response_validators, DownloadError
+from crawl_common.crawl_manifest import crawl_manifest
+from report_index import report_index
+from crawl_common.crawl_metrics import crawl_metrics
 Headers = {'Referer': 'http://fundf10.eastmoney.com/'}
-
-s = requests.Session()
+# hosts of the api, announcement and attachment servers; overridden by the benchmark to point at the mock server
+API_BASE = 'http://api.fund.eastmoney.com'
+NOTICE_BASE = 'https://np-cnotice-fund.eastmoney.com'
+PDF_BASE = 'https://pdf.dfcfw.com'
+
+# latencies, bytes, throttles and queue depths of the crawl; see export_metrics
+METRICS = crawl_metrics()
+METRICS_JSON = './Reports/.metrics.json'
+# e.g. the textfile directory of the node_exporter: '/var/lib/node_exporter/textfile/eastmoney.prom'
+METRICS_PROM = None
+
+s = METRICS.instrument(requests.Session())
 INTERVAL_INDEX = 0.7
-
-
-def get_list(fund_code):
+# starts at one request per INTERVAL_INDEX seconds and adapts from there;
+# a block page pauses the crawl for 30s, doubled for every consecutive one
+LIMITER = aimd_limiter(rate=1 / INTERVAL_INDEX, base_backoff=30, max_backoff=600, name='eastmoney')
+BLOCK_MARKER = b'The access control configuration prevents your request at this time'
+# set to report_store('./Store')(from report_store import report_store) to keep identical reports of
+# different fund codes only once;
+# files are still exposed under ./Reports/{fund_code}/ as hard links
+STORE = None
+# per-thread sessions of the concurrent mode
+_local = threading.local()
+# validators (ETag/Last-Modified/Content-Length) of the attachments, saved at download time so that the
+# first sweep of revalidate_single sends conditional requests; None to keep none
+VALIDATORS_DB = './Reports/.validators.db'
+_validators = None
+_validators_lock = threading.Lock()
+
+
+def worker_session():
+    # each worker thread keeps its own session and keep-alive connections
+    if not hasattr(_local, 'session'):
+        _local.session = METRICS.instrument(requests.Session())
+    return _local.session
+
+
+def get_list(fund_code, session=None):
+    session = session if session is not None else s
     try:
-        resp = s.get(f'http://api.fund.eastmoney.com/f10/JJGG?fundcode={fund_code}&pageIndex=1&pageSize=99999&type=3'
+        resp = session.get(f'{API_BASE}/f10/JJGG?fundcode={fund_code}&pageIndex=1&pageSize=99999&type=3'
                      ,headers=Headers, timeout=6)
         return resp.json()
     except Exception as e:
@@ -21,7 +64,7 @@ def get_list(fund_code):
 
 def get_pub_info(ID):
     try:
-        resp = s.get(f'https://np-cnotice-fund.eastmoney.com/api/content/ann?client_source=web_fund'
+        resp = s.get(f'{NOTICE_BASE}/api/content/ann?client_source=web_fund'
                      f'&show_all=1&art_code={ID}', headers=Headers)
         return resp.json()
     except Exception as e:
@@ -30,15 +73,15 @@ def get_pub_info(ID):
 
 
 def generate_pdf_url(ID: str):
-    return f'https://pdf.dfcfw.com/pdf/H2_{ID}_1.pdf'
+    return f'{PDF_BASE}/pdf/H2_{ID}_1.pdf'
 
 
 def generate_txt_url(ID: str):
-    return f'https://pdf.dfcfw.com/pdf/H2_{ID}_1.txt'
+    return f'{PDF_BASE}/pdf/H2_{ID}_1.txt'
 
 
 def generate_doc_url(ID: str):
-    return f'https://pdf.dfcfw.com/pdf/H2_{ID}_1.doc'
+    return f'{PDF_BASE}/pdf/H2_{ID}_1.doc'
 
 
 def get_pdf(ID: str):
@@ -52,26 +95,63 @@ def get_pdf(ID: str):
         return None
 
 
-def get_doc(ID: str):
+def download_attachment(url: str, path: str, check_pdf: bool, fund_code: str = '', session=None,
+                        force=False):
+    # stream into a temp file and rename only if complete, so no partial file is left in ./Reports;
+    # force skips the store lookup, for files changed upstream.
+    # Returns (ok, validators of the response); validators are None for a file linked from the store
+    session = session if session is not None else s
+    if STORE is not None and not force and STORE.link_known(url, path, fund_code) is not None:
+        return True, None
     try:
-        url = generate_doc_url(ID)
-        # print(url)
-        resp = s.get(url, headers=Headers, timeout=6)
-        return resp.content
+        with METRICS.timer('download'):
+            if STORE is not None:
+                size, _, validators = STORE.download(session, url, path, fund_code, headers=Headers,
+                                                     check_pdf=check_pdf, block_marker=BLOCK_MARKER, timeout=6,
+                                                     return_validators=True)
+            else:
+                size, _, validators = stream_download(session, url, path, headers=Headers, check_pdf=check_pdf,
+                                                      block_marker=BLOCK_MARKER, timeout=6, return_validators=True)
+    except DownloadError as e:
+        print(url, str(e))
+        METRICS.count('blocked' if e.throttled else 'download_failed', endpoint='download')
+        if e.throttled:
+            LIMITER.on_throttle()
+        return False, None
     except Exception as e:
         print(str(e))
-        return None
-
-
-def get_txt(ID: str):
+        METRICS.count('download_failed', endpoint='download')
+        return False, None
+    LIMITER.on_success()
+    METRICS.count('downloaded_files', endpoint='download')
+    METRICS.count('downloaded_bytes', size, endpoint='download')
+    return True, validators
+
+
+def save_validators(url: str, validators: dict):
+    global _validators
+    if VALIDATORS_DB is None or validators is None or all(value is None for value in validators.values()):
+        return
+    with _validators_lock:
+        if _validators is None:
+            _validators = crawl_manifest(VALIDATORS_DB)
+    _validators.set_validators(url, validators)
+
+
+def get_txt(ID: str, session=None, return_validators=False):
+    # with return_validators, returns (content, validators of the response); (None, None) on failure
+    session = session if session is not None else s
     try:
         url = generate_txt_url(ID)
         # print(url)
-        resp = s.get(url, headers=Headers, timeout=6)
-        return resp.content.decode('gbk', errors='ignore')
+        resp = session.get(url, headers=Headers, timeout=6)
+        content = resp.content.decode('gbk', errors='ignore')
     except Exception as e:
         print(str(e))
-        return None
+        return (None, None) if return_validators else None
+    if return_validators:
+        return content, response_validators(resp.headers)
+    return content
 
 
 def extract_info(data_json: dict) -> list:
@@ -93,21 +173,11 @@ def check_make_directory(directory: str):
         os.mkdir(directory)
 
 
-def save_pdf(title: str, fund_code: str, time: str, pdf_bytes: bytes):
-    with open(f'./Reports/{fund_code}/{title}_{time}.pdf', 'wb') as f:
-        f.write(pdf_bytes)
-
-
 def save_txt(title: str, fund_code: str, time: str, txt_str: str):
     with open(f'./Reports/{fund_code}/{title}_{time}.txt', 'w', encoding='utf-8', errors='ignore') as f:
         f.write(txt_str)
 
 
-def save_doc(title: str, fund_code: str, time: str, doc_bytes: bytes):
-    with open(f'./Reports/{fund_code}/{title}_{time}.doc', 'wb') as f:
-        f.write(doc_bytes)
-
-
 def test_check():
     check_make_directory('./Reports/')
     codes = load_fund_codes()
@@ -147,11 +217,57 @@ def check_content(content) -> bool:
         print('ERROR!')
         return False
 
+def fetch_announcement(code, title, time_stamp, ID, attach_type, session=None, force=False) -> bool:
+    LIMITER.acquire()
+    # pdf version
+    if attach_type == '0':
+        url = generate_pdf_url(ID)
+        ok, validators = download_attachment(url, f'./Reports/{code}/{title}_{time_stamp}.pdf', True, code,
+                                             session, force)
+    # txt version
+    elif attach_type == '5':
+        url = generate_txt_url(ID)
+        txt_content, validators = get_txt(ID, session, return_validators=True)
+        if not txt_content:
+            print(ID)
+            return False
+        if not check_content(txt_content):
+            METRICS.count('blocked', endpoint='txt')
+            LIMITER.on_throttle()
+            return False
+        save_txt(title, code, time_stamp, txt_content)
+        LIMITER.on_success()
+        ok = True
+    # doc version
+    elif attach_type == '1':
+        url = generate_doc_url(ID)
+        ok, validators = download_attachment(url, f'./Reports/{code}/{title}_{time_stamp}.doc', False, code,
+                                             session, force)
+    else:
+        print(code, title, time_stamp, ID, attach_type)
+        return True
+    if ok:
+        save_validators(url, validators)
+    return ok
+
+
+def export_metrics():
+    # the limiter may be replaced after import, e.g. by the benchmark
+    METRICS.watch_limiter(LIMITER)
+    if METRICS_JSON is not None:
+        METRICS.to_json(METRICS_JSON)
+    if METRICS_PROM is not None:
+        METRICS.to_prometheus(METRICS_PROM)
+    print(METRICS.summary())
+
+
 def start():
     check_make_directory('./Reports/')
+    # one pass over ./Reports instead of three os.path.exists per announcement
+    index = report_index('./Reports').build()
     codes = load_fund_codes()
     for fund_code in codes:
-        check_make_directory(f'./Reports/{fund_code}/')
+        index.ensure_dir(fund_code)
         pre_list = get_list(fund_code)
         if not pre_list:
             continue
@@ -161,47 +277,15 @@ def start():
         count = 0
         for code, title, time_stamp, ID, attach_type in detail_info_list:
             title = title.replace("/", '').replace("\\", '').replace(":", '：')
-            if os.path.exists(f'./Reports/{code}/{title}_{time_stamp}.pdf'):
+            if index.has(code, f'{title}_{time_stamp}'):
                 continue
-            elif os.path.exists(f'./Reports/{code}/{title}_{time_stamp}.txt'):
+            if not fetch_announcement(code, title, time_stamp, ID, attach_type):
                 continue
-            elif os.path.exists(f'./Reports/{code}/{title}_{time_stamp}.doc'):
-                continue
-            time.sleep(INTERVAL_INDEX)
-            # pdf version
-            if attach_type == '0':
-                pdf_content = get_pdf(ID)
-                if not pdf_content:
-                    print(ID)
-                    continue
-                if not check_content(pdf_content):
-                    time.sleep(300)
-                    continue
-                save_pdf(title, code, time_stamp, pdf_content)
-            # txt version
-            elif attach_type == '5':
-                txt_content = get_txt(ID)
-                if not txt_content:
-                    print(ID)
-                    continue
-                if not check_content(txt_content):
-                    time.sleep(300)
-                    continue
-                save_txt(title, code, time_stamp, txt_content)
-            # doc version
-            elif attach_type == '1':
-                doc_content = get_doc(ID)
-                if not doc_content:
-                    print(ID)
-                    continue
-                if not check_content(doc_content):
-                    time.sleep(300)
-                    continue
-                save_doc(title, code, time_stamp, doc_content)
-            else:
-                print(code, title, time_stamp, ID, attach_type)
+            index.add(code, f'{title}_{time_stamp}')
             count += 1
-            print(count)
+            print(count, LIMITER)
+    index.save()
+    export_metrics()
 
 
 def test():
@@ -218,8 +302,9 @@ def test():
 
 def download_single(codes):
     check_make_directory('./Reports/')
+    index = report_index('./Reports').build()
     for fund_code in codes:
-        check_make_directory(f'./Reports/{fund_code}/')
+        index.ensure_dir(fund_code)
         pre_list = get_list(fund_code)
         if not pre_list:
             continue
@@ -229,47 +314,105 @@ def download_single(codes):
         count = 0
         for code, title, time_stamp, ID, attach_type in detail_info_list:
             title = title.replace("/", '').replace("\\", '').replace(":", '：')
-            if os.path.exists(f'./Reports/{code}/{title}_{time_stamp}.pdf'):
-                continue
-            elif os.path.exists(f'./Reports/{code}/{title}_{time_stamp}.txt'):
+            if index.has(code, f'{title}_{time_stamp}'):
                 continue
-            elif os.path.exists(f'./Reports/{code}/{title}_{time_stamp}.doc'):
+            if not fetch_announcement(code, title, time_stamp, ID, attach_type):
                 continue
-            time.sleep(INTERVAL_INDEX)
-            # pdf version
-            if attach_type == '0':
-                pdf_content = get_pdf(ID)
-                if not pdf_content:
-                    print(ID)
-                    continue
-                if not check_content(pdf_content):
-                    time.sleep(300)
-                    continue
-                save_pdf(title, code, time_stamp, pdf_content)
-            # txt version
-            elif attach_type == '5':
-                txt_content = get_txt(ID)
-                if not txt_content:
-                    print(ID)
-                    continue
-                if not check_content(txt_content):
-                    time.sleep(300)
-                    continue
-                save_txt(title, code, time_stamp, txt_content)
-            # doc version
-            elif attach_type == '1':
-                doc_content = get_doc(ID)
-                if not doc_content:
-                    print(ID)
+            index.add(code, f'{title}_{time_stamp}')
+            count += 1
+            print(count, LIMITER)
+    index.save()
+    export_metrics()
+
+
+def download_concurrent(codes, workers=4, attachment_workers=8):
+    # fund codes are spread over [workers] threads listing the announcements, and the attachments
+    # over [attachment_workers] threads; every thread has its own session, all share LIMITER.
+    # Files are saved in the same ./Reports/{code}/{title}_{time}.{ext} layout as download_single
+    check_make_directory('./Reports/')
+    index = report_index('./Reports').build()
+
+    def fetch_in_worker(args):
+        METRICS.add_queue('attachments', -1)
+        code, title, time_stamp = args[:3]
+        if not fetch_announcement(*args, session=worker_session()):
+            return False
+        index.add(code, f'{title}_{time_stamp}')
+        return True
+
+    with ThreadPoolExecutor(max_workers=attachment_workers) as attachment_pool:
+        def crawl_fund(fund_code):
+            index.ensure_dir(fund_code)
+            pre_list = get_list(fund_code, worker_session())
+            if not pre_list:
+                return 0
+            futures = []
+            for code, title, time_stamp, ID, attach_type in extract_info(pre_list):
+                title = title.replace("/", '').replace("\\", '').replace(":", '：')
+                if index.has(code, f'{title}_{time_stamp}'):
                     continue
-                if not check_content(doc_content):
-                    time.sleep(300)
+                METRICS.add_queue('attachments', 1)
+                futures.append(attachment_pool.submit(fetch_in_worker, (code, title, time_stamp, ID, attach_type)))
+            return sum(future.result() for future in futures)
+
+        with ThreadPoolExecutor(max_workers=workers) as fund_pool:
+            total = 0
+            for fund_code, count in zip(codes, fund_pool.map(crawl_fund, codes)):
+                total += count
+                print(fund_code, count, LIMITER)
+    index.save()
+    export_metrics()
+    return total
+
+
+def revalidate_single(codes, manifest_path=None):
+    # correction sweep: probe the attachments already saved with a conditional HEAD request and download
+    # again only those changed upstream. Validators (ETag/Last-Modified/Content-Length) are kept per url in
+    # the manifest(VALIDATORS_DB by default), from the download on; files saved before any validator was
+    # stored are compared by size
+    manifest = crawl_manifest(manifest_path if manifest_path is not None else VALIDATORS_DB)
+    index = report_index('./Reports').build()
+    urls = {'0': (generate_pdf_url, 'pdf'), '1': (generate_doc_url, 'doc'), '5': (generate_txt_url, 'txt')}
+    total = 0
+    for fund_code in codes:
+        pre_list = get_list(fund_code)
+        if not pre_list:
+            continue
+        changed = 0
+        for code, title, time_stamp, ID, attach_type in extract_info(pre_list):
+            title = title.replace("/", '').replace("\\", '').replace(":", '：')
+            if attach_type not in urls or not index.has(code, f'{title}_{time_stamp}'):
+                continue
+            generate_url, ext = urls[attach_type]
+            url = generate_url(ID)
+            validators = manifest.get_validators(url)
+            if validators is None:
+                # txt files are re-encoded when saved, so their size cannot be compared
+                path = f'./Reports/{code}/{title}_{time_stamp}.{ext}'
+                size = os.path.getsize(path) if ext != 'txt' and os.path.exists(path) else None
+                validators = {'content_length': size}
+            LIMITER.acquire()
+            try:
+                is_changed, fresh = revalidate(s, url, validators, headers=Headers, timeout=6)
+            except DownloadError as e:
+                print(url, str(e))
+                if e.throttled:
+                    LIMITER.on_throttle()
+                continue
+            except Exception as e:
+                print(str(e))
+                continue
+            LIMITER.on_success()
+            if is_changed:
+                if not fetch_announcement(code, title, time_stamp, ID, attach_type, force=True):
                     continue
-                save_doc(title, code, time_stamp, doc_content)
-            else:
-                print(code, title, time_stamp, ID, attach_type)
-            count += 1
-            print(count)
+                changed += 1
+            manifest.set_validators(url, fresh)
+        total += changed
+        print(fund_code, changed, 'changed', LIMITER)
+    manifest.close()
+    export_metrics()
+    return total
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+'''
+A one-pass index of the files under ./Reports, answering "is this
+{title}_{time} already saved in any format(pdf/txt/doc)" in memory instead of
+three os.path.exists calls per announcement.
+
+The tree is walked once with os.scandir. The names found in each fund folder
+are cached in a json file together with the folder's mtime; on the next run a
+folder whose mtime has not changed is taken from the cache without being
+listed again, so refreshing a fully synced tree only stats the fund folders.
+'''
+import json
+import os
+import threading
+
+EXTENSIONS = ('pdf', 'txt', 'doc')
+
+
+class report_index:
+    def __init__(self, root: str = './Reports', cache_path: str = None):
+        self.root = root
+        self.cache_path = cache_path if cache_path is not None else os.path.join(root, '.index.json')
+        # {code: (mtime_ns, set of '{title}_{time}')}
+        self.dirs = {}
+        self._lock = threading.Lock()
+
+    def _load_cache(self) -> dict:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _list_stems(path: str) -> set:
+        stems = set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                stem, _, ext = entry.name.rpartition('.')
+                if ext in EXTENSIONS:
+                    stems.add(stem)
+        return stems
+
+    def build(self):
+        # walk the fund folders once; unchanged folders come from the cache
+        cache = self._load_cache()
+        dirs = {}
+        n_listed = 0
+        if os.path.exists(self.root):
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+                    mtime = entry.stat().st_mtime_ns
+                    cached = cache.get(entry.name)
+                    if cached is not None and cached[0] == mtime:
+                        dirs[entry.name] = (mtime, set(cached[1]))
+                    else:
+                        dirs[entry.name] = (mtime, self._list_stems(entry.path))
+                        n_listed += 1
+        with self._lock:
+            self.dirs = dirs
+        print(f'Indexed {len(dirs)} fund folder(s), listed {n_listed}')
+        return self
+
+    def has(self, code: str, stem: str) -> bool:
+        with self._lock:
+            entry = self.dirs.get(code)
+            return entry is not None and stem in entry[1]
+
+    def add(self, code: str, stem: str):
+        with self._lock:
+            if code not in self.dirs:
+                self.dirs[code] = (None, set())
+            self.dirs[code][1].add(stem)
+
+    def ensure_dir(self, code: str):
+        # the index may be stale(e.g. the folder was removed after the scan), so the folder is always created
+        with self._lock:
+            if code not in self.dirs:
+                self.dirs[code] = (None, set())
+        os.makedirs(os.path.join(self.root, code), exist_ok=True)
+
+    def save(self):
+        # folders changed in this run keep their old mtime, so they are listed again next time
+        with self._lock:
+            cache = dict((code, [mtime, sorted(stems)]) for code, (mtime, stems) in self.dirs.items()
+                         if mtime is not None)
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(temp_path, self.cache_path)
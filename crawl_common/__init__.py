@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Modules shared by the CNINF and EastMoney crawlers, installed with
+`pip install -e .` at the root of the repo together with report_titles.
+
+CONTENTS
+--------
+- <MODULE> rate_limiter
+- <MODULE> atomic_download
+- <MODULE> crawl_manifest
+- <MODULE> report_store
+- <MODULE> crawl_metrics
+
+'''
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Streamed, atomic file downloads shared by the CNINF and EastMoney crawlers.
+
+The response body is written chunk by chunk into a hidden temp file next to
+the target, so memory stays flat however large the report is. While streaming
+the func checks:
+    - the status code;
+    - the block page of the server, if a marker is given;
+    - the PDF magic('%PDF-') at the head and the '%%EOF' trailer at the tail;
+    - the num of bytes received against Content-Length.
+Only when all checks pass is the temp file fsync-ed and renamed to the target
+path(os.replace is atomic on the same file system), so a crash or a broken
+response never leaves a truncated file behind.
+
+Both return, if asked, the validators(ETag, Last-Modified, Content-Length)
+of the response, to be stored with the file at download time.
+
+For correction sweeps, revalidate sends a conditional HEAD probe with the
+stored validators(ETag, Last-Modified, Content-Length) of a file, so that it
+is downloaded again only if the upstream object has changed.
+
+download_bytes applies the same checks to a file kept in memory, for the
+fused download-to-text mode of the CNINF crawler; write_atomic writes bytes
+already in memory with the same temp file and rename.
+
+CONTENTS
+--------
+- <CLASS> DownloadError
+- <FUNC> stream_download
+- <FUNC> download_bytes
+- <FUNC> write_atomic
+- <FUNC> response_validators
+- <FUNC> revalidate
+
+'''
+import hashlib
+import io
+import os
+import tempfile
+from .rate_limiter import is_throttled
+
+PDF_MAGIC = b'%PDF-'
+PDF_TRAILER = b'%%EOF'
+# the trailer may be followed by some whitespace or a linearisation dict
+TRAILER_WINDOW = 1024
+
+class DownloadError(Exception):
+    def __init__(self, message: str, status_code: int = None, throttled: bool = False):
+        '''
+        Parameters
+        ----------
+        message: str
+            Error info
+        status_code: int, default None
+            Status code of the response, if any
+        throttled: bool, default False
+            Whether the failure is a throttling signal(403/429/5xx or a block page)
+
+        '''
+        super().__init__(message)
+        self.status_code = status_code
+        self.throttled = throttled or (status_code is not None and is_throttled(status_code))
+
+def stream_download(http,
+                    url: str,
+                    file_path: str,
+                    headers: dict = None,
+                    check_pdf: bool = True,
+                    block_marker: bytes = None,
+                    chunk_size: int = 64 * 1024,
+                    timeout = None,
+                    return_validators: bool = False):
+    '''
+    Download a file to [file_path] in chunks, through a temp file and an atomic
+    rename.
+
+    Parameters
+    ----------
+    http: session_pool, requests.Session or requests
+        Anything with a requests-like get method
+    url: str
+        Url of the file
+    file_path: str
+        Target path of the file
+    headers: dict, default None
+        Headers sent with the request
+    check_pdf: bool, default True
+        Whether to check the PDF magic and trailer
+    block_marker: bytes, default None
+        A piece of the server's block page; the download fails as throttled if
+        it appears in the first chunk
+    chunk_size: int, default 64KB
+        Size of the chunks read from the response
+    timeout: default None
+        Passed to requests
+    return_validators: bool, default False
+        Also return the validators of the response
+
+    Returns
+    -------
+    size: int
+        Num of bytes written
+    sha256: str
+        Hex digest of the content
+    validators: dict
+        See response_validators; only if return_validators
+
+    '''
+    folder = os.path.dirname(file_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir = folder, prefix = '.', suffix = '.part')
+
+    try:
+        with http.get(url, headers = headers, stream = True, timeout = timeout) as r:
+            with os.fdopen(fd, 'wb') as f:
+                fd = None
+                size, sha256 = _copy_checked(r, f.write, check_pdf, block_marker, chunk_size)
+                f.flush()
+                os.fsync(f.fileno())
+            validators = response_validators(r.headers)
+
+        os.replace(temp_path, file_path)
+
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if return_validators:
+        return size, sha256, validators
+    return size, sha256
+
+def download_bytes(http,
+                   url: str,
+                   headers: dict = None,
+                   check_pdf: bool = True,
+                   block_marker: bytes = None,
+                   chunk_size: int = 64 * 1024,
+                   timeout = None,
+                   return_validators: bool = False):
+    '''
+    Download a file into memory with the same checks as stream_download, for
+    files consumed right away(e.g. converted to text) without touching disk.
+
+    Returns
+    -------
+    data: bytes
+        Content of the file
+    sha256: str
+        Hex digest of the content
+    validators: dict
+        See response_validators; only if return_validators
+
+    '''
+    buffer = io.BytesIO()
+    with http.get(url, headers = headers, stream = True, timeout = timeout) as r:
+        _, sha256 = _copy_checked(r, buffer.write, check_pdf, block_marker, chunk_size)
+        validators = response_validators(r.headers)
+
+    if return_validators:
+        return buffer.getvalue(), sha256, validators
+    return buffer.getvalue(), sha256
+
+def _copy_checked(r, write, check_pdf: bool, block_marker: bytes, chunk_size: int):
+    '''
+    Pass the body of a streamed response to [write] chunk by chunk, checking
+    the status code, block page, PDF magic and trailer, and Content-Length
+
+    Returns
+    -------
+    size: int
+    sha256: str
+
+    '''
+    if r.status_code != 200:
+        raise DownloadError(f'status {r.status_code}', status_code = r.status_code)
+
+    # Content-Length is the size of the encoded body; only comparable
+    # when the body is not compressed
+    expected = r.headers.get('Content-Length')
+    if r.headers.get('Content-Encoding', 'identity') != 'identity':
+        expected = None
+
+    hasher = hashlib.sha256()
+    size = 0
+    tail = b''
+    for chunk in r.iter_content(chunk_size = chunk_size):
+        if not chunk: continue
+
+        if size == 0:
+            if block_marker is not None and block_marker in chunk:
+                raise DownloadError('blocked by the server', status_code = r.status_code,
+                                    throttled = True)
+            if check_pdf and not chunk.startswith(PDF_MAGIC):
+                raise DownloadError('not a pdf file', status_code = r.status_code)
+
+        write(chunk)
+        hasher.update(chunk)
+        size += len(chunk)
+        tail = (tail + chunk)[-TRAILER_WINDOW:]
+
+    if expected is not None and size != int(expected):
+        raise DownloadError(f'truncated: {size}/{expected} bytes', status_code = r.status_code)
+    if check_pdf and PDF_TRAILER not in tail:
+        raise DownloadError('pdf trailer not found', status_code = r.status_code)
+
+    return size, hasher.hexdigest()
+
+def write_atomic(data: bytes, file_path: str):
+    '''
+    Write [data] to [file_path] through a temp file and an atomic rename
+
+    '''
+    folder = os.path.dirname(file_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir = folder, prefix = '.', suffix = '.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def response_validators(headers):
+    '''
+    Pick the validators out of the headers of a response
+
+    Returns
+    -------
+    output: dict
+        A dict with keys etag, last_modified and content_length; missing
+        validators are None
+
+    '''
+    content_length = headers.get('Content-Length')
+    # the length of a compressed body says nothing about the file
+    if headers.get('Content-Encoding', 'identity') != 'identity':
+        content_length = None
+
+    return {'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_length': int(content_length) if content_length is not None else None}
+
+def revalidate(http, url: str, validators: dict, headers: dict = None, timeout = None):
+    '''
+    Tell whether the upstream object of a url has changed, with a conditional
+    HEAD request.
+
+    Parameters
+    ----------
+    http: session_pool, requests.Session or requests
+        Anything with a requests-like head method
+    url: str
+        Url of the file
+    validators: dict
+        Stored validators, in the format of response_validators; a file
+        without any stored validator may pass {'content_length': its size}
+    headers: dict, default None
+        Headers sent with the request
+    timeout: default None
+        Passed to requests
+
+    Returns
+    -------
+    changed: bool
+        True if any validator differs, or if nothing can be compared
+    fresh: dict
+        The validators returned by the server, to be stored
+
+    '''
+    probe_headers = dict(headers) if headers is not None else {}
+    if validators.get('etag') is not None:
+        probe_headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified') is not None:
+        probe_headers['If-Modified-Since'] = validators['last_modified']
+
+    r = http.head(url, headers = probe_headers, timeout = timeout, allow_redirects = True)
+    if r.status_code == 304:
+        return False, validators
+    if r.status_code != 200:
+        raise DownloadError(f'status {r.status_code}', status_code = r.status_code)
+
+    fresh = response_validators(r.headers)
+    compared = False
+    for key in ['etag', 'last_modified', 'content_length']:
+        if validators.get(key) is None or fresh[key] is None: continue
+        compared = True
+        if str(validators[key]) != str(fresh[key]):
+            return True, fresh
+
+    return not compared, fresh
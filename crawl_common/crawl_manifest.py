@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A local SQLite manifest recording the download state of each announcement,
+keyed by its announcementId and the code it is saved under: the same
+announcement may be listed under several codes(e.g. the share classes of an
+umbrella fund), each with a file of its own.
+
+For each announcement the manifest keeps the url, target path, byte size,
+sha256 checksum and status(pending/done/failed). save_file and
+save_file_async look up the finished announcements of a fund in a single
+query, so a crawl that died half way resumes without re-downloading or
+stat-ing the files already on disk.
+
+The manifest also keeps:
+    - a watermark per code and report category: the latest announcementTime
+      seen, used by the incremental mode of crawl_single_fund;
+    - the validators(ETag, Last-Modified, Content-Length) per url, used by the
+      revalidation mode of save_file.
+
+CONTENTS
+--------
+- <CLASS> crawl_manifest
+
+'''
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+ANNOUNCEMENTS_TABLE = '''CREATE TABLE IF NOT EXISTS {name} (
+                            ann_id TEXT,
+                            code TEXT,
+                            url TEXT,
+                            file_path TEXT,
+                            size INTEGER,
+                            sha256 TEXT,
+                            status TEXT,
+                            updated_at REAL,
+                            PRIMARY KEY (ann_id, code))'''
+
+class crawl_manifest:
+    def __init__(self, db_path: str):
+        '''
+        Parameters
+        ----------
+        db_path: str
+            Path to the SQLite file; created if not exists
+
+        '''
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread = False)
+        self._lock = threading.Lock()
+
+        with self._lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(ANNOUNCEMENTS_TABLE.format(name = 'announcements'))
+            # manifests written when the table was keyed by ann_id alone
+            keys = [row[1] for row in self.conn.execute('PRAGMA table_info(announcements)') if row[5] > 0]
+            if keys == ['ann_id']:
+                self.conn.execute(ANNOUNCEMENTS_TABLE.format(name = 'announcements_new'))
+                self.conn.execute('''INSERT INTO announcements_new
+                                     SELECT ann_id, code, url, file_path, size, sha256, status, updated_at
+                                     FROM announcements''')
+                self.conn.execute('DROP TABLE announcements')
+                self.conn.execute('ALTER TABLE announcements_new RENAME TO announcements')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_ann_code ON announcements(code, status)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS watermarks (
+                                    code TEXT,
+                                    category TEXT,
+                                    last_time INTEGER,
+                                    updated_at REAL,
+                                    PRIMARY KEY (code, category))''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS validators (
+                                    url TEXT PRIMARY KEY,
+                                    etag TEXT,
+                                    last_modified TEXT,
+                                    content_length INTEGER,
+                                    checked_at REAL)''')
+
+    def register(self, code: str, tasks: list):
+        '''
+        Record a list of download tasks as pending; tasks already in the
+        manifest keep their status
+
+        Parameters
+        ----------
+        code: str
+            Code of the fund
+        tasks: list
+            A list of task dicts generated by cninf_crawler.init_download_task
+
+        '''
+        now = time.time()
+        rows = [(task['ann_id'], code, task['url'], task['file_path'], PENDING, now) for task in tasks]
+        with self._lock, self.conn:
+            self.conn.executemany('''INSERT OR IGNORE INTO announcements
+                                     (ann_id, code, url, file_path, status, updated_at)
+                                     VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+    def done_ids(self, code: str = None):
+        '''
+        Get the ids of the announcements already downloaded
+
+        Parameters
+        ----------
+        code: str, default None
+            Code of the fund; all codes if None
+
+        Returns
+        -------
+        output: set
+
+        '''
+        with self._lock:
+            if code is None:
+                cursor = self.conn.execute('SELECT ann_id FROM announcements WHERE status = ?', (DONE,))
+            else:
+                cursor = self.conn.execute('SELECT ann_id FROM announcements WHERE code = ? AND status = ?',
+                                           (code, DONE))
+            output = set(row[0] for row in cursor.fetchall())
+        return output
+
+    def mark_done(self, ann_id: str, code: str, file_path: str, size: int, sha256: str):
+        with self._lock, self.conn:
+            self.conn.execute('''UPDATE announcements
+                                 SET status = ?, file_path = ?, size = ?, sha256 = ?, updated_at = ?
+                                 WHERE ann_id = ? AND code = ?''',
+                              (DONE, file_path, size, sha256, time.time(), ann_id, code))
+
+    def mark_failed(self, ann_id: str, code: str):
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE announcements SET status = ?, updated_at = ? WHERE ann_id = ? AND code = ?',
+                              (FAILED, time.time(), ann_id, code))
+
+    def get(self, ann_id: str, code: str):
+        '''
+        Get the record of an announcement saved under a code
+
+        Returns
+        -------
+        output: dict or None
+
+        '''
+        with self._lock:
+            cursor = self.conn.execute('''SELECT ann_id, code, url, file_path, size, sha256, status, updated_at
+                                          FROM announcements WHERE ann_id = ? AND code = ?''', (ann_id, code))
+            row = cursor.fetchone()
+        if row is None: return None
+
+        keys = ['ann_id', 'code', 'url', 'file_path', 'size', 'sha256', 'status', 'updated_at']
+        return dict(zip(keys, row))
+
+    def get_watermark(self, code: str, category: str):
+        '''
+        Get the latest announcementTime seen for a code and report category
+
+        Parameters
+        ----------
+        code: str
+            Code of the fund/stock
+        category: str
+            The category flag posted to the server, e.g 'category_jdbg_jjgg'
+
+        Returns
+        -------
+        last_time: int or None
+            13-digit unix timestamp; None if the code has never been crawled
+
+        '''
+        with self._lock:
+            cursor = self.conn.execute('SELECT last_time FROM watermarks WHERE code = ? AND category = ?',
+                                       (code, category))
+            row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def set_watermark(self, code: str, category: str, last_time: int):
+        '''
+        Move the watermark forward; an earlier last_time is ignored
+
+        '''
+        with self._lock, self.conn:
+            self.conn.execute('''INSERT INTO watermarks (code, category, last_time, updated_at)
+                                 VALUES (?, ?, ?, ?)
+                                 ON CONFLICT(code, category) DO UPDATE SET
+                                 last_time = MAX(last_time, excluded.last_time),
+                                 updated_at = excluded.updated_at''',
+                              (code, category, int(last_time), time.time()))
+
+    def get_validators(self, url: str):
+        '''
+        Get the validators stored for a url
+
+        Returns
+        -------
+        output: dict or None
+            In the format of atomic_download.response_validators
+
+        '''
+        with self._lock:
+            row = self.conn.execute('SELECT etag, last_modified, content_length FROM validators WHERE url = ?',
+                                    (url,)).fetchone()
+        if row is None: return None
+        return {'etag': row[0], 'last_modified': row[1], 'content_length': row[2]}
+
+    def set_validators(self, url: str, validators: dict):
+        with self._lock, self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO validators
+                                 (url, etag, last_modified, content_length, checked_at)
+                                 VALUES (?, ?, ?, ?, ?)''',
+                              (url, validators.get('etag'), validators.get('last_modified'),
+                               validators.get('content_length'), time.time()))
+
+    def summary(self):
+        '''
+        Num of announcements in each status
+
+        Returns
+        -------
+        output: dict
+
+        '''
+        with self._lock:
+            cursor = self.conn.execute('SELECT status, COUNT(*) FROM announcements GROUP BY status')
+            output = dict(cursor.fetchall())
+        return output
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
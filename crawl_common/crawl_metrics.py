@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Built-in metrics of the CNINF and EastMoney crawlers, to see where the crawl
+time goes and when the upstream is degrading.
+
+Collected:
+    - latency histogram of each endpoint(time until the response headers,
+      taken from the requests response hook), and of the timed stages, e.g.
+      whole downloads;
+    - responses by endpoint and status code, throttled responses, and bytes
+      received(by Content-Length, where the server sends it);
+    - counters of events such as retries and failed downloads;
+    - time spent sleeping in the rate limiters and the retry policies versus
+      on the network;
+    - current and max depth of the work queues.
+
+A session is instrumented with instrument(); a limiter is read when exporting,
+with watch_limiter(), and a retry policy with watch_retry(). The metrics are
+exported to a json file and to a Prometheus textfile(for the node_exporter
+textfile collector), both written atomically.
+
+An endpoint is the host plus the leading path segments that look like api
+paths rather than dates, ids or file names(no dot, underscore or run of 4
+digits), e.g
+    'www.cninfo.com.cn/new/hisAnnouncement/query'
+    'static.cninfo.com.cn/finalpage'
+    'api.fund.eastmoney.com/f10/JJGG'
+so that the urls of single files share one label.
+
+CONTENTS
+--------
+- <FUNC> endpoint_of
+- <CLASS> crawl_metrics
+
+'''
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from .rate_limiter import is_throttled
+
+# upper bounds(in seconds) of the latency buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# path segments from which the rest of a url is specific to a single file
+FILE_SEGMENT = re.compile(r'[._]|[0-9]{4}')
+
+def endpoint_of(url: str):
+    '''
+    A func to get the endpoint label of a url
+
+    Parameters
+    ----------
+    url: str
+
+    Returns
+    -------
+    output: str
+        Host plus the leading api path segments
+
+    '''
+    parsed = urlparse(url)
+    segments = []
+    for segment in parsed.path.split('/'):
+        if segment == '': continue
+        if FILE_SEGMENT.search(segment) is not None: break
+        segments.append(segment)
+
+    return '/'.join([parsed.netloc] + segments)
+
+class crawl_metrics:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        '''
+        Parameters
+        ----------
+        buckets: tuple, default DEFAULT_BUCKETS
+            Upper bounds(in seconds) of the latency histogram buckets
+
+        '''
+        self.buckets = tuple(sorted(buckets))
+        self.started = time.time()
+
+        # {endpoint: {'counts': [n per bucket, +Inf last], 'sum': float, 'count': int}}
+        self.latency = {}
+        # {(endpoint, status): n}
+        self.responses = {}
+        # {endpoint: n}
+        self.bytes = {}
+        # {(event, endpoint): n}
+        self.events = {}
+        # {queue: [current, max]}
+        self.queues = {}
+        self.limiters = []
+        self.retries = []
+        # sum of the response latencies, i.e. the time spent on the network
+        self.network_time = 0.0
+
+        self._lock = threading.Lock()
+
+    ''' recording '''
+    def observe(self, endpoint: str, seconds: float):
+        '''
+        Record a latency of an endpoint or a timed stage
+
+        '''
+        with self._lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            histogram = self.latency[endpoint]
+
+            idx = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    idx = i
+                    break
+            histogram['counts'][idx] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, endpoint: str):
+        '''
+        Time the block inside a with statement as [endpoint]
+
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(endpoint, time.perf_counter() - start)
+
+    def count(self, event: str, n: float = 1, endpoint: str = ''):
+        '''
+        Add [n] to the counter of an event, e.g 'retry' or 'download_failed'
+
+        '''
+        with self._lock:
+            key = (event, endpoint)
+            self.events[key] = self.events.get(key, 0) + n
+
+    def record_response(self, r, *args, **kwargs):
+        '''
+        Response hook of requests; records the latency, status and size of
+        a response
+
+        '''
+        endpoint = endpoint_of(r.url)
+        self.observe(endpoint, r.elapsed.total_seconds())
+
+        content_length = r.headers.get('Content-Length')
+        with self._lock:
+            self.network_time += r.elapsed.total_seconds()
+            key = (endpoint, r.status_code)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            if content_length is not None and content_length.isdigit():
+                self.bytes[endpoint] = self.bytes.get(endpoint, 0) + int(content_length)
+        return r
+
+    def set_queue(self, name: str, depth: int):
+        '''
+        Record the current depth of a queue
+
+        '''
+        with self._lock:
+            current = self.queues.setdefault(name, [0, 0])
+            current[0] = depth
+            current[1] = max(current[1], depth)
+
+    def add_queue(self, name: str, delta: int):
+        '''
+        Change the depth of a queue by [delta], for queues without a qsize
+
+        '''
+        with self._lock:
+            current = self.queues.setdefault(name, [0, 0])
+            current[0] += delta
+            current[1] = max(current[1], current[0])
+
+    ''' wiring '''
+    def instrument(self, http):
+        '''
+        Record every response of a requests.Session or a session_pool
+
+        Parameters
+        ----------
+        http: requests.Session or session_pool
+
+        Returns
+        -------
+        http: the same object
+
+        '''
+        if hasattr(http, 'hooks'):
+            if self.record_response not in http.hooks['response']:
+                http.hooks['response'].append(self.record_response)
+        elif hasattr(http, 'sessions'):
+            # sessions created later by the pool are instrumented by the pool
+            http.metrics = self
+            for session in list(http.sessions.values()):
+                self.instrument(session)
+
+        return http
+
+    def watch_limiter(self, limiter):
+        '''
+        Export the rate, sleeping time and throttles of an aimd_limiter
+
+        '''
+        with self._lock:
+            if limiter not in self.limiters:
+                self.limiters.append(limiter)
+
+    def watch_retry(self, policy):
+        '''
+        Export the retries of a retry_policy, and its sleeps before retries
+        and on the circuit breaker as sleeping time
+
+        '''
+        with self._lock:
+            if policy not in self.retries:
+                self.retries.append(policy)
+
+    ''' export '''
+    def snapshot(self):
+        '''
+        Current state of all metrics
+
+        Returns
+        -------
+        output: dict
+
+        '''
+        limiters = [limiter.stats() for limiter in self.limiters]
+        retries = [policy.stats() for policy in self.retries]
+        with self._lock:
+            latency = {}
+            for endpoint, histogram in self.latency.items():
+                latency[endpoint] = {'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'],
+                                                         histogram['counts'])),
+                                     'sum': round(histogram['sum'], 6),
+                                     'count': histogram['count'],
+                                     'mean': round(histogram['sum'] / histogram['count'], 6)}
+
+            responses = {}
+            throttled = {}
+            for (endpoint, status), n in self.responses.items():
+                responses.setdefault(endpoint, {})[str(status)] = n
+                if is_throttled(status):
+                    throttled[endpoint] = throttled.get(endpoint, 0) + n
+
+            events = {}
+            for (event, endpoint), n in self.events.items():
+                events.setdefault(event, {})[endpoint] = n
+
+            return {'uptime': round(time.time() - self.started, 3),
+                    'time_network': round(self.network_time, 3),
+                    'time_sleeping': round(sum(limiter['time_waited'] for limiter in limiters) +
+                                           sum(policy['time_waited'] for policy in retries), 3),
+                    'latency': latency,
+                    'responses': responses,
+                    'throttled': throttled,
+                    'bytes': dict(self.bytes),
+                    'events': events,
+                    'queues': dict((name, {'depth': depth, 'max': max_depth})
+                                   for name, (depth, max_depth) in self.queues.items()),
+                    'limiters': limiters,
+                    'retries': retries}
+
+    def to_json(self, path: str):
+        '''
+        Export the snapshot to a json file
+
+        '''
+        self._write_atomic(path, json.dumps(self.snapshot(), indent = 2, ensure_ascii = False))
+
+    def to_prometheus(self, path: str):
+        '''
+        Export the metrics in the Prometheus text format, e.g to
+        [textfile_directory]/crawler.prom for the node_exporter
+
+        '''
+        self._write_atomic(path, self.prometheus_text())
+
+    def prometheus_text(self):
+        '''
+        The metrics in the Prometheus text format
+
+        '''
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+        family('crawler_request_duration_seconds', 'histogram', 'Latency of each endpoint or timed stage')
+        for endpoint, histogram in snapshot['latency'].items():
+            cumulative = 0
+            for bound, n in histogram['buckets'].items():
+                cumulative += n
+                lines.append(f'crawler_request_duration_seconds_bucket{{endpoint="{label(endpoint)}",le="{bound}"}} {cumulative}')
+            lines.append(f'crawler_request_duration_seconds_sum{{endpoint="{label(endpoint)}"}} {histogram["sum"]}')
+            lines.append(f'crawler_request_duration_seconds_count{{endpoint="{label(endpoint)}"}} {histogram["count"]}')
+
+        family('crawler_responses_total', 'counter', 'Responses by endpoint and status code')
+        for endpoint, statuses in snapshot['responses'].items():
+            for status, n in statuses.items():
+                lines.append(f'crawler_responses_total{{endpoint="{label(endpoint)}",status="{status}"}} {n}')
+
+        family('crawler_throttled_total', 'counter', 'Throttled responses(403/429/5xx) by endpoint')
+        for endpoint, n in snapshot['throttled'].items():
+            lines.append(f'crawler_throttled_total{{endpoint="{label(endpoint)}"}} {n}')
+
+        family('crawler_response_bytes_total', 'counter', 'Bytes received by endpoint, by Content-Length')
+        for endpoint, n in snapshot['bytes'].items():
+            lines.append(f'crawler_response_bytes_total{{endpoint="{label(endpoint)}"}} {n}')
+
+        family('crawler_events_total', 'counter', 'Crawler events such as retries and failures')
+        for event, endpoints in snapshot['events'].items():
+            for endpoint, n in endpoints.items():
+                lines.append(f'crawler_events_total{{event="{label(event)}",endpoint="{label(endpoint)}"}} {n}')
+
+        family('crawler_network_seconds_total', 'counter', 'Time spent waiting for responses')
+        lines.append(f'crawler_network_seconds_total {snapshot["time_network"]}')
+
+        family('crawler_limiter_sleep_seconds_total', 'counter', 'Time spent sleeping in a rate limiter')
+        for limiter in snapshot['limiters']:
+            lines.append(f'crawler_limiter_sleep_seconds_total{{limiter="{label(limiter["name"])}"}} {limiter["time_waited"]}')
+        family('crawler_limiter_rate', 'gauge', 'Current rate of a rate limiter, in requests per second')
+        for limiter in snapshot['limiters']:
+            lines.append(f'crawler_limiter_rate{{limiter="{label(limiter["name"])}"}} {limiter["rate"]}')
+        family('crawler_limiter_throttles_total', 'counter', 'Throttling signals seen by a rate limiter')
+        for limiter in snapshot['limiters']:
+            lines.append(f'crawler_limiter_throttles_total{{limiter="{label(limiter["name"])}"}} {limiter["n_throttle"]}')
+
+        family('crawler_retry_sleep_seconds_total', 'counter', 'Time spent sleeping before retries and on a circuit breaker')
+        for policy in snapshot['retries']:
+            lines.append(f'crawler_retry_sleep_seconds_total{{policy="{label(policy["name"])}"}} {policy["time_waited"]}')
+        family('crawler_retries_total', 'counter', 'Calls retried by a retry policy')
+        for policy in snapshot['retries']:
+            lines.append(f'crawler_retries_total{{policy="{label(policy["name"])}"}} {policy["n_retries"]}')
+
+        family('crawler_queue_depth', 'gauge', 'Current depth of a work queue')
+        for name, depth in snapshot['queues'].items():
+            lines.append(f'crawler_queue_depth{{queue="{label(name)}"}} {depth["depth"]}')
+        family('crawler_queue_depth_max', 'gauge', 'Max depth of a work queue')
+        for name, depth in snapshot['queues'].items():
+            lines.append(f'crawler_queue_depth_max{{queue="{label(name)}"}} {depth["max"]}')
+
+        family('crawler_uptime_seconds', 'gauge', 'Seconds since the metrics were created')
+        lines.append(f'crawler_uptime_seconds {snapshot["uptime"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        '''
+        A short text summary, e.g for printing after a crawl
+
+        '''
+        snapshot = self.snapshot()
+        n_requests = sum(sum(statuses.values()) for statuses in snapshot['responses'].values())
+        lines = [f'{n_requests} request(s), {sum(snapshot["bytes"].values()) / 1024**2:.1f} MB, '
+                 f'{sum(snapshot["throttled"].values())} throttled; '
+                 f'network {snapshot["time_network"]:.1f}s, sleeping {snapshot["time_sleeping"]:.1f}s']
+        for endpoint, histogram in snapshot['latency'].items():
+            lines.append(f' - {endpoint}: {histogram["count"]} x {histogram["mean"]:.3f}s')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _write_atomic(path: str, text: str):
+        folder = os.path.dirname(path)
+        if folder != '':
+            os.makedirs(folder, exist_ok = True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, path)
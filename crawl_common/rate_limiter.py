@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A token-bucket rate limiter that adjusts its rate with AIMD(additive increase,
+multiplicative decrease), shared by the CNINF and EastMoney crawlers.
+
+Instead of sleeping for a fixed interval, a crawler calls acquire() before
+each request and reports the outcome with on_success()/on_throttle():
+    - every clean response raises the rate by a small constant;
+    - every throttling signal(403/429/5xx, block page) cuts the rate by a
+      factor and pauses the bucket with an exponential backoff, which resets
+      once a clean response comes back.
+The rate therefore converges to just below the server's real limit.
+
+CONTENTS
+--------
+- <FUNC> is_throttled
+- <CLASS> aimd_limiter
+
+'''
+import threading
+import time
+
+# status codes treated as a throttling signal
+THROTTLE_STATUS = (403, 429, 500, 502, 503, 504)
+
+def is_throttled(status_code: int):
+    '''
+    A func to tell whether a status code is a throttling signal
+
+    Parameters
+    ----------
+    status_code: int
+        HTTP status code of a response
+
+    Returns
+    -------
+    bool
+
+    '''
+    return status_code in THROTTLE_STATUS
+
+class aimd_limiter:
+    def __init__(self,
+                 rate: float = 1.0,
+                 min_rate: float = 0.01,
+                 max_rate: float = 10.0,
+                 increase: float = 0.05,
+                 decrease: float = 0.5,
+                 burst: int = 1,
+                 base_backoff: float = 5.0,
+                 max_backoff: float = 600.0,
+                 name: str = 'limiter'):
+        '''
+        Parameters
+        ----------
+        rate: float, default 1.0
+            Initial num of requests per second
+        min_rate, max_rate: float, default 0.01, 10.0
+            Bounds of the rate
+        increase: float, default 0.05
+            Rate added after each clean response
+        decrease: float, default 0.5
+            Factor the rate is multiplied by on a throttling signal
+        burst: int, default 1
+            Capacity of the bucket, i.e. max num of requests sent back to back
+        base_backoff: float, default 5.0
+            Pause(in seconds) after the first throttling signal; doubled for
+            each consecutive signal
+        max_backoff: float, default 600.0
+            Upper bound of the pause
+        name: str, default 'limiter'
+            Name shown when printing the limiter
+
+        '''
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.name = name
+
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.backoff_until = 0.0
+        self.consecutive_throttles = 0
+
+        # some stats
+        self.n_success = 0
+        self.n_throttle = 0
+        self.time_waited = 0.0
+
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        '''
+        Block until a token is available and the backoff pause, if any, is over.
+
+        Returns
+        -------
+        waited: float
+            Seconds spent waiting
+
+        '''
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.backoff_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.time_waited += waited
+                    return waited
+
+                if now < self.backoff_until:
+                    wait = self.backoff_until - now
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        '''
+        Additive increase after a clean response
+
+        '''
+        with self._lock:
+            self.n_success += 1
+            self.consecutive_throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        '''
+        Multiplicative decrease and exponential backoff after a throttling signal
+
+        Returns
+        -------
+        backoff: float
+            Seconds the bucket is paused for
+
+        '''
+        with self._lock:
+            self.n_throttle += 1
+            self.consecutive_throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+            backoff = min(self.max_backoff,
+                          self.base_backoff * 2 ** (self.consecutive_throttles - 1))
+            self.backoff_until = max(self.backoff_until, time.monotonic() + backoff)
+            # drop the tokens saved up before the signal
+            self.tokens = 0.0
+            self.last_refill = time.monotonic()
+
+        print(f'Throttled; {self.name} backs off for {backoff:.1f}s, rate now {self.rate:.3f}/s')
+        return backoff
+
+    def feedback(self, ok: bool):
+        '''
+        Shortcut of on_success/on_throttle
+
+        '''
+        if ok:
+            self.on_success()
+        else:
+            self.on_throttle()
+
+    def stats(self):
+        '''
+        Current state of the limiter
+
+        Returns
+        -------
+        dict
+
+        '''
+        with self._lock:
+            return {'name': self.name,
+                    'rate': self.rate,
+                    'n_success': self.n_success,
+                    'n_throttle': self.n_throttle,
+                    'time_waited': self.time_waited,
+                    'backoff_left': max(0.0, self.backoff_until - time.monotonic())}
+
+    def __repr__(self):
+        return f'{self.name}: {self.rate:.3f} req/s'
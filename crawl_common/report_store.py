@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+A content-addressed store of report files shared by the crawlers.
+
+Umbrella fund families and share classes(A/C) often file byte-identical
+reports under different fund codes. The store keeps every file once as a
+blob named by its sha256, and exposes it under the usual
+[store_path]/[code]/[title]_[date].[ext] layout with a hard link(a copy if the
+file system does not support hard links). A small SQLite index maps:
+    - url -> sha256, so a url already fetched is never downloaded again;
+    - file_path -> sha256, the per-code view of the blobs;
+    - sha256 -> txt path, so that an identical report is converted only once.
+
+Layout under [root]:
+    blobs/ab/abcdef....pdf
+    incoming/      temp files being downloaded
+    store.db
+
+CONTENTS
+--------
+- <CLASS> report_store
+
+'''
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from .atomic_download import stream_download, write_atomic
+
+class report_store:
+    def __init__(self, root: str):
+        '''
+        Parameters
+        ----------
+        root: str
+            Root directory of the store; created if not exists
+
+        '''
+        self.root = root
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok = True)
+        os.makedirs(os.path.join(root, 'incoming'), exist_ok = True)
+
+        self.conn = sqlite3.connect(os.path.join(root, 'store.db'), check_same_thread = False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                                    sha256 TEXT PRIMARY KEY,
+                                    ext TEXT,
+                                    size INTEGER,
+                                    text_path TEXT,
+                                    created_at REAL)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS urls (
+                                    url TEXT PRIMARY KEY,
+                                    sha256 TEXT)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS views (
+                                    file_path TEXT PRIMARY KEY,
+                                    code TEXT,
+                                    sha256 TEXT)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_view_sha ON views(sha256)')
+
+    def blob_path(self, sha256: str, ext: str):
+        return os.path.join(self.root, 'blobs', sha256[:2], f'{sha256}.{ext}')
+
+    def _query_one(self, sql: str, params: tuple):
+        with self._lock:
+            row = self.conn.execute(sql, params).fetchone()
+        return row
+
+    def lookup_url(self, url: str):
+        '''
+        Returns the sha256 of a url already in the store; None if not found
+
+        '''
+        row = self._query_one('SELECT sha256 FROM urls WHERE url = ?', (url,))
+        return row[0] if row is not None else None
+
+    def lookup_path(self, file_path: str):
+        '''
+        Returns the sha256 of a file exposed by the store; None if not found
+
+        '''
+        row = self._query_one('SELECT sha256 FROM views WHERE file_path = ?', (file_path,))
+        return row[0] if row is not None else None
+
+    def codes_of(self, sha256: str):
+        '''
+        Returns a list of (code, file_path) sharing the same blob
+
+        '''
+        with self._lock:
+            rows = self.conn.execute('SELECT code, file_path FROM views WHERE sha256 = ?', (sha256,)).fetchall()
+        return rows
+
+    def link(self, sha256: str, file_path: str, code: str):
+        '''
+        Expose a blob at file_path(hard link, or a copy as a fallback) and
+        record it in the per-code view
+
+        '''
+        row = self._query_one('SELECT ext FROM blobs WHERE sha256 = ?', (sha256,))
+        blob = self.blob_path(sha256, row[0])
+
+        folder = os.path.dirname(file_path) or '.'
+        os.makedirs(folder, exist_ok = True)
+        
+        # link under a temp name first, so that file_path is replaced atomically
+        temp_path = os.path.join(folder, f'.{uuid.uuid4().hex}.part')
+        try:
+            os.link(blob, temp_path)
+        except OSError:
+            shutil.copyfile(blob, temp_path)
+        os.replace(temp_path, file_path)
+
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO views (file_path, code, sha256) VALUES (?, ?, ?)',
+                              (file_path, code, sha256))
+
+    def link_known(self, url: str, file_path: str, code: str):
+        '''
+        Expose the blob of a url already fetched at file_path, without downloading
+
+        Returns
+        -------
+        sha256: str or None
+            None if the url is not in the store
+
+        '''
+        sha256 = self.lookup_url(url)
+        if sha256 is not None:
+            self.link(sha256, file_path, code)
+        return sha256
+
+    def ingest(self, temp_path: str, sha256: str, size: int, url: str, ext: str):
+        '''
+        Move a downloaded file into the blobs; if an identical blob exists the
+        temp file is simply dropped
+
+        '''
+        blob = self.blob_path(sha256, ext)
+        os.makedirs(os.path.dirname(blob), exist_ok = True)
+        if os.path.exists(blob):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, blob)
+
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO blobs (sha256, ext, size, created_at) VALUES (?, ?, ?, ?)',
+                              (sha256, ext, size, time.time()))
+            self.conn.execute('INSERT OR REPLACE INTO urls (url, sha256) VALUES (?, ?)', (url, sha256))
+
+    def download(self, http, url: str, file_path: str, code: str, **kwargs):
+        '''
+        Stream a file into the store and expose it at file_path
+
+        Parameters
+        ----------
+        http: session_pool, requests.Session or requests
+        url: str
+        file_path: str
+            Path where the file is exposed
+        code: str
+            Code of the fund
+        **kwargs:
+            Passed to stream_download
+
+        Returns
+        -------
+        size: int
+        sha256: str
+        validators: dict
+            Only if return_validators is passed; see stream_download
+
+        '''
+        ext = file_path.rsplit('.', 1)[-1]
+        temp_path = os.path.join(self.root, 'incoming', f'{uuid.uuid4().hex}.{ext}')
+
+        output = stream_download(http, url, temp_path, **kwargs)
+        size, sha256 = output[:2]
+        self.ingest(temp_path, sha256, size, url, ext)
+        self.link(sha256, file_path, code)
+        return output
+
+    def put_bytes(self, data: bytes, sha256: str, url: str, file_path: str, code: str):
+        '''
+        Store a file already downloaded into memory and expose it at file_path
+
+        '''
+        ext = file_path.rsplit('.', 1)[-1]
+        temp_path = os.path.join(self.root, 'incoming', f'{uuid.uuid4().hex}.{ext}')
+
+        write_atomic(data, temp_path)
+        self.ingest(temp_path, sha256, len(data), url, ext)
+        self.link(sha256, file_path, code)
+
+    def get_text(self, sha256: str):
+        '''
+        Returns the path of the converted txt of a blob; None if not converted
+
+        '''
+        row = self._query_one('SELECT text_path FROM blobs WHERE sha256 = ?', (sha256,))
+        if row is None or row[0] is None or not os.path.exists(row[0]):
+            return None
+        return row[0]
+
+    def set_text(self, sha256: str, text_path: str):
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE blobs SET text_path = ? WHERE sha256 = ?', (text_path, sha256))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+Modules shared by the crawlers and the word freq calculator, installed with
+`pip install -e .` at the root of the repo, so that each part imports them
+without knowing where the others live.
+
+CONTENTS
+--------
+- <MODULE> title_classifier
+
+'''
+from .title_classifier import num_cn2eng, classify_title, format_info, classify_titles
+
+__all__ = ['num_cn2eng', 'classify_title', 'format_info', 'classify_titles']
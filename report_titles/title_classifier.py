@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+'''
+DESCRIPTION
+-----------
+One engine to classify report titles(or file names) into
+[report_type]-[year]-[quarter], shared by cninf_crawler, pdf2txt and the
+panel extractors under word freq.
+
+The patterns are compiled once at import and the result of each title is
+memoized, so the same title met again in another fund, run or file list
+costs a dict lookup. classify_titles works on a whole announcement list or
+filename column at once and returns columnar arrays.
+
+Format:
+    - report_type:
+        - 'Q': quarterly report;
+        - 'H': mid-term report;
+        - 'A': annual report;
+        - 'M': monthly report(only if with_month = True)
+    - year: year of issue
+    - quarter: 1-4 for quarterly report; 5 for mid-term report; 6 for annual
+      report; the month for monthly report
+Items not found are ''.
+
+CONTENTS
+--------
+- <FUNC> num_cn2eng
+- <FUNC> classify_title
+- <FUNC> format_info
+- <FUNC> classify_titles
+
+'''
+import re
+from functools import lru_cache
+import numpy as np
+
+YEAR_DETECTOR = re.compile(r'[0-9,一,二,三,四,五,六,七,八,九,零,〇]{4}年')
+QUARTER_DETECTOR = re.compile(r'[1-4,一,二,三,四]季')
+ANNUAL_DETECTOR = re.compile(r'年[度,报]')
+MID_DETECTOR = re.compile(r'(半年|中期)')
+MONTH_DETECTOR = re.compile(r'年[0-9,一,二,三,四,五,六,七,八,九,十]{1,2}月')
+
+CN2ENG_DATE_DICT = {'一':1,
+                    '二':2,
+                    '三':3,
+                    '四':4,
+                    '五':5,
+                    '六':6,
+                    '七':7,
+                    '八':8,
+                    '九':9,
+                    '零':0,
+                    '〇':0}
+
+def num_cn2eng(date:str):
+    '''
+    A func to convert Chinese num to Arab num, e.g '二〇一二' -> 2012
+
+    Parameters
+    ----------
+    date: str
+        A str of Chinese num
+
+    Returns
+    -------
+    output: str
+        A str of Arab num
+
+    '''
+    output = ''
+    for num in date:
+        if num in CN2ENG_DATE_DICT.keys():
+            num = CN2ENG_DATE_DICT[num]
+
+        output += str(num)
+    return output
+
+@lru_cache(maxsize = None)
+def classify_title(title: str, with_month: bool = False):
+    '''
+    Classify a single title; results are memoized
+
+    Parameters
+    ----------
+    title: str
+        The title of a report, or its file name
+    with_month: bool, default False
+        Whether to detect monthly reports
+
+    Returns
+    -------
+    (report_type, year, quarter): tuple of str
+
+    '''
+    year = YEAR_DETECTOR.search(title)
+    year = num_cn2eng(year.group()[:-1]) if year is not None else ''
+
+    quarter = QUARTER_DETECTOR.search(title)
+    if quarter is not None:
+        return 'Q', year, num_cn2eng(quarter.group()[0])
+    if MID_DETECTOR.search(title) is not None:
+        return 'H', year, '5'
+    if ANNUAL_DETECTOR.search(title) is not None:
+        return 'A', year, '6'
+    if with_month:
+        month = MONTH_DETECTOR.search(title)
+        if month is not None:
+            return 'M', year, num_cn2eng(month.group()[1:-1])
+
+    return '', year, ''
+
+def format_info(report_type: str, year: str, quarter: str):
+    '''
+    Join the output of classify_title in the format [report_type]-[year]-[quarter]
+
+    '''
+    return '-'.join([report_type, year, quarter])
+
+def classify_titles(titles, with_month: bool = False):
+    '''
+    Classify a whole list of titles at once. Each distinct title is classified
+    only once.
+
+    Parameters
+    ----------
+    titles: iterable of str
+        e.g. the announcementTitle of an announcement list, or a column of
+        file names
+    with_month: bool, default False
+        Whether to detect monthly reports
+
+    Returns
+    -------
+    output: dict
+        A dict of np.ndarray with keys report_type, year, quarter and info,
+        aligned with titles
+
+    '''
+    titles = list(titles)
+    unique = dict((title, classify_title(title, with_month)) for title in set(titles))
+
+    results = [unique[title] for title in titles]
+    report_type = np.array([result[0] for result in results], dtype = object)
+    year = np.array([result[1] for result in results], dtype = object)
+    quarter = np.array([result[2] for result in results], dtype = object)
+    info = np.array([format_info(*result) for result in results], dtype = object)
+
+    return {'report_type': report_type,
+            'year': year,
+            'quarter': quarter,
+            'info': info}
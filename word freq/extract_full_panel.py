@@ -26,9 +26,9 @@ import os
 from joblib import Parallel, delayed
 import pandas as pd
 import numpy as np
-import re
 from tqdm import tqdm
-from utils import num_cn2eng, get_type
+from utils import get_type
+from report_titles import classify_titles
 
 class panel_info_extractor: 
     def __init__(self,
@@ -48,66 +48,28 @@ class panel_info_extractor:
         
     def process_single_code_info(self,code: str):
         code_file_path = self.code_file_path_dict[code]
-        code_file_list = os.listdir(code_file_path)
-        
-        report_info_df = pd.DataFrame(columns = ['file_name','report_type', 'year', 'quarter',
+        code_file_list = [file for file in os.listdir(code_file_path) if '摘要' not in file]
+        
+        # classify all file names of the fund at once
+        title_info = classify_titles(code_file_list, with_month = True)
+        report_dates = [file.split('_')[1].split('.')[0] for file in code_file_list]
+        ymd = [[int(num) for num in report_date.split('-')] for report_date in report_dates]
+        
+        report_type = title_info['report_type']
+        report_info_df = pd.DataFrame({'file_name': code_file_list,
+                                       'report_type': np.where(report_type != '', report_type, np.nan),
+                                       'year': np.where(title_info['year'] != '', title_info['year'], np.nan),
+                                       'quarter': np.where(title_info['quarter'] != '', title_info['quarter'], np.nan),
+                                       'date': report_dates,
+                                       'info': np.where((report_type != '') & (title_info['year'] != ''),
+                                                        title_info['info'], np.nan),
+                                       'type': [get_type(t) for t in report_type],
+                                       'report_year': [d[0] for d in ymd],
+                                       'month': [d[1] for d in ymd],
+                                       'day': [d[2] for d in ymd]},
+                                      columns = ['file_name','report_type', 'year', 'quarter',
                                                  'date','info','type',
-                                              'report_year', 'month', 'day'])
-        
-        year_detector = re.compile(r'[0-9,一,二,三,四,五,六,七,八,九,零]{4}年')
-        quarter_detector = re.compile(r'[1-4,一,二,三,四]季')
-        annual_detector = re.compile(r'年[度,报]')
-        mid_detector = re.compile(r'(半年|中期)')
-        month_detector = re.compile(r'年[0-9,一,二,三,四,五,六,七,八,九,十]{1,2}月')
-        
-        for file in code_file_list:
-            if '摘要' in file: continue
-            
-            single_report_info_df = pd.DataFrame(columns = ['file_name','report_type', 'year', 'quarter',
-                                                            'date','info','type',
-                                                            'report_year', 'month', 'day'])
-            single_report_info_df.loc[0,'file_name'] = file
-        
-            report_date = file.split('_')[1].split('.')[0]
-            single_report_info_df.loc[0,'date'] = report_date
-            single_report_info_df.loc[0,['report_year', 'month', 'day']] = [int(num) for num in report_date.split('-')]
-            
-            title = file
-            year = re.findall(year_detector, title)
-            quarter = re.findall(quarter_detector, title)
-            annual = re.findall(annual_detector, title)
-            mid = re.findall(mid_detector, title)
-            month = re.findall(month_detector, title)
-            
-            if len(year) > 0:
-                single_report_info_df['year'] = num_cn2eng(year[0][:-1])
-            if len(quarter) > 0:
-                quarter = num_cn2eng(quarter[0][0])
-                    
-                single_report_info_df['report_type'] = 'Q'
-                single_report_info_df['quarter'] = quarter
-                
-            if len(mid) > 0:
-                single_report_info_df['report_type'] = 'H'
-                single_report_info_df['quarter'] = '5'
-            elif len(annual) > 0:
-                single_report_info_df['report_type'] = 'A'
-                single_report_info_df['quarter'] = '6'
-            elif len(month) > 0:
-                month = num_cn2eng(month[0][1:-1])
-                
-                single_report_info_df['report_type'] = 'M'
-                single_report_info_df['quarter'] = num_cn2eng(month)
-        
-            if len(single_report_info_df) > 0:
-                try:
-                    single_report_info_df.loc[0,'info'] = '-'.join([single_report_info_df['report_type'].values[0],
-                                                                    single_report_info_df['year'].values[0],
-                                                                    single_report_info_df['quarter'].values[0]])
-                except: pass
-                single_report_info_df.loc[0,'type'] = get_type(single_report_info_df['report_type'].values[0])
-                report_info_df = pd.concat([report_info_df, single_report_info_df], axis = 0)
-                
+                                                 'report_year', 'month', 'day'])
         
         report_info_df = report_info_df.reset_index(drop = True)
         
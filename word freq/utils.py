@@ -4,9 +4,13 @@ Some useful functions.
 
 '''
 import pandas as pd
-import re
-import numpy as np
 import jieba
+# shared with the crawlers; `pip install -e .` at the root of the repo
+from report_titles import num_cn2eng, classify_title, format_info
+
+# num_cn2eng used to live here, and is re-exported for the callers importing it from utils
+__all__ = ['num_cn2eng', 'get_type', 'convert_num2code', 'find_info', 'code_info_dict_initialiser',
+           'compare_list', 'load_stopwords', 'cut_sentence', 'load_jieba', 'cal_certain_tone', 'two_digits']
 
 def get_type(t):
     type_dict = {'A': '年报',
@@ -17,25 +21,6 @@ def get_type(t):
         return ''
     return '基金' + type_dict[t]
 
-def num_cn2eng(date:str):
-    cn2eng_date_dict = {'一':1,
-                        '二':2,
-                        '三':3,
-                        '四':4,
-                        '五':5,
-                        '六':6,
-                        '七':7,
-                        '八':8,
-                        '九':9,
-                        '零':0}
-    output = ''
-    for num in date:
-        if num in cn2eng_date_dict.keys():
-            num = cn2eng_date_dict[num]
-        
-        output += str(num)
-    return output
-
 def convert_num2code(code_list:list):
     output = []
     for code in code_list:
@@ -46,30 +31,9 @@ def convert_num2code(code_list:list):
     return output
 
 def find_info(column:str):
-    year_detector = re.compile(r'[0-9,一,二,三,四,五,六,七,八,九,零]{4}年')
-    quarter_detector = re.compile(r'[1-4,一,二,三,四]季')
-    annual_detector = re.compile(r'年[度,报]')
-    mid_detector = re.compile(r'(半年|中期)')
-    
-    year = re.findall(year_detector, column)
-    quarter = re.findall(quarter_detector, column)
-    annual = re.findall(annual_detector, column)
-    mid = re.findall(mid_detector,column)
-    
-    if len(year) > 0:
-        year = num_cn2eng(year[0][:-1])
-        
-    if len(quarter) > 0:
-        quarter = num_cn2eng(quarter[0][0])
-        report_type = 'Q'
-    elif len(mid) > 0:
-        quarter = 5
-        report_type  = 'H'     
-    elif len(annual) > 0:
-        report_type = 'A'
-        quarter = 6
-    
-    return '-'.join([report_type, year, quarter])
+    # [report_type]-[year]-[quarter] of a title, by the shared title classifier
+    return format_info(*classify_title(column))
+
 def code_info_dict_initialiser(code_info_dict_path: str):
     raw_dict = pd.read_csv(code_info_dict_path, encoding = 'gbk')
     raw_dict.columns = ['code','name', 'inv_typeI', 'inv_type_II', 'fund_type']